@@ -0,0 +1,147 @@
+"""
+拠点ごとの在庫集計（アイテム区分ごとの件数・上代・下代の合計）を持ち続ける
+
+一覧を開くたびに全行を数え直さなくてよいよう、入庫・出庫・編集のときに
+増えた行・減った行の分だけ足し引きする。集計は data/inventory_totals.json に
+拠点ごとに、そのときの在庫のバージョン（storage の inventory_version）と一緒に保存する。
+  {"神戸": {"version": [...], "totals": {"リング": [件数, 上代, 下代], ...}}, ...}
+在庫のバージョンが保存したものと違えば（別の手段で書き換えられたなど）その拠点は数え直す。
+全拠点の集計は拠点ごとの集計を足すだけ。
+"""
+import json
+import os
+import threading
+
+import records
+from durable import FileLock, atomic_write
+from storage import version_key
+
+
+def empty():
+    """{区分: [件数, 上代, 下代]}（すべて 0）"""
+    return {c: [0, 0, 0] for c in records.CATEGORIES}
+
+
+def _add(totals, rows, sign):
+    for row in rows:
+        if not row:
+            continue
+        rec = records.ensure(row)
+        up, dn = rec.uedai_value, rec.gedai_value
+        if up is None or dn is None:
+            continue  # 上代・下代が数値でない行は数えない
+        t = totals[rec.category]
+        t[0] += sign
+        t[1] += sign * up
+        t[2] += sign * dn
+
+
+def tally(rows):
+    """在庫のレコード（在庫行でもよい）を数える"""
+    totals = empty()
+    _add(totals, rows, 1)
+    return totals
+
+
+def applied(totals, added=(), removed=()):
+    """totals に増えた行・減った行を反映した新しい集計"""
+    totals = {c: list(v) for c, v in totals.items()}
+    _add(totals, removed, -1)
+    _add(totals, added, 1)
+    return totals
+
+
+def combine(totals_list):
+    """拠点ごとの集計を足し合わせる"""
+    out = empty()
+    for totals in totals_list:
+        for c, v in totals.items():
+            t = out[c]
+            t[0] += v[0]
+            t[1] += v[1]
+            t[2] += v[2]
+    return out
+
+
+def display(totals):
+    """集計 → 画面用の (summary, totals)（金額はカンマ区切りの文字列）"""
+    summary = {}
+    all_count = all_up = all_dn = 0
+    for c in records.CATEGORIES:
+        count, up, dn = totals[c]
+        summary[c] = {"count": count, "上代": f"{up:,.0f}", "下代": f"{dn:,.0f}"}
+        all_count += count
+        all_up += up
+        all_dn += dn
+    return summary, {"count": all_count, "上代": f"{all_up:,.0f}", "下代": f"{all_dn:,.0f}"}
+
+
+class InventoryTotals:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = FileLock(path + ".lock")
+        self._lock = threading.Lock()
+        self._bases = {}        # 拠点名 → (バージョン, 集計)
+        self._file_stamp = None  # 最後に読んだときのファイルの (mtime_ns, size)
+
+    def _file_version(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _read_file(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return {
+            base: (entry.get("version"), entry.get("totals"))
+            for base, entry in data.items()
+            if isinstance(entry, dict) and isinstance(entry.get("totals"), dict)
+        }
+
+    def _refresh(self):
+        """別プロセスがファイルを書き換えていれば読み直す（ロックを持って呼ぶ）"""
+        stamp = self._file_version()
+        if stamp != self._file_stamp:
+            self._bases = self._read_file()
+            self._file_stamp = stamp
+
+    def get(self, base_name, version):
+        """在庫が version のときの集計。持っていなければ（古ければ）None"""
+        key = version_key(version)
+        with self._lock:
+            cached = self._bases.get(base_name)
+            if cached is None or cached[0] != key:
+                self._refresh()
+                cached = self._bases.get(base_name)
+        if cached is None or cached[0] != key:
+            return None
+        return cached[1]
+
+    def put(self, base_name, version, totals):
+        """在庫が version になったときの集計を保存する"""
+        key = version_key(version)
+        with self._lock, self.lock:
+            bases = self._read_file()
+            bases[base_name] = (key, totals)
+            data = {b: {"version": v, "totals": t} for b, (v, t) in bases.items()}
+            with atomic_write(self.path, encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            self._bases = bases
+            self._file_stamp = self._file_version()
+
+    def apply(self, base_name, old_version, new_version, added=(), removed=()):
+        """
+        在庫が old_version → new_version になったときの差分を足し引きする
+        old_version の集計を持っていなければ何もせず False（呼び出し側で数え直す）
+        """
+        totals = self.get(base_name, old_version)
+        if totals is None:
+            return False
+        self.put(base_name, new_version, applied(totals, added, removed))
+        return True
@@ -1,11 +1,35 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Response, stream_with_context
+from jinja2 import FileSystemBytecodeCache
 import csv
+import hashlib
+import io
 import os
-from collections import defaultdict
+import threading
+import time
+from bisect import bisect_right
+from collections import defaultdict, OrderedDict
 import datetime  # ← これを追加
 from datetime import date
 import re
-import requests  # ★ これを追加
+import unicodedata
+from urllib.parse import quote
+import click
+import aggregates
+import base_registry
+import changefeed
+import crossbase
+from durable import FileLock
+import gas_outbox
+import intake
+import locate_index
+import storage
+import query
+import records
+import search_index
+import snapshot
+import xlsx_reader
+import xlsx_writer
 
 app = Flask(__name__)
 
@@ -21,54 +45,54 @@ GAS_ENDPOINT_URL = os.environ.get("GAS_ENDPOINT_URL")
 
 def send_inventory_to_gas(payload):
     """
-    在庫データを GAS の Web アプリに送信するヘルパー関数（まだ枠だけ）
-    payload: dict にして渡す想定（後で中身を決める）
+    在庫データを GAS の Web アプリに送る（送信キューに入れるだけで、すぐ戻る）
+    実際の送信・まとめ送り・再送は gas_outbox のバックグラウンドスレッドが行う。
     """
     if not GAS_ENDPOINT_URL:
         # まだエンドポイントを設定していない場合は何もせずスキップ
         print("[send_inventory_to_gas] GAS_ENDPOINT_URL not set. Skip sending.")
         return False
-
-    try:
-        # JSON 形式で POST
-        res = requests.post(GAS_ENDPOINT_URL, json=payload, timeout=10)
-        # ログを少しだけ出しておく（テキストは長すぎないよう先頭だけ）
-        print("[send_inventory_to_gas] status:", res.status_code, res.text[:200])
-        res.raise_for_status()
-        return True
-    except Exception as e:
-        # エラーが出てもアプリ本体は落とさない
-        print("[send_inventory_to_gas] Error:", e)
-        return False
+    GAS_OUTBOX.enqueue(payload)
+    return True
 
 
 # === 設定値 ===
-# URL で使うスラッグ → 実際の拠点名（CSVファイル名にもなる）
-BASE_SLUGS = {
-    "kobe": "神戸",
-    "yokohama": "横浜",
-    "omiya": "大宮",
-    "senboku": "泉北",
-    "chiba": "千葉",
-    "ateam": "Aチーム",
-}
+# 拠点の一覧（スラッグ・拠点名・メニューの表示・使っているか）は bases.json に書く（base_registry.py）
+# BASES_FILE で別のファイルにできる。書き換えれば再起動しなくても反映される
+BASE_REGISTRY = base_registry.BaseRegistry(os.environ.get("BASES_FILE", "bases.json"))
+
 
 # URL のスラッグ → 拠点名（例: "kobe" -> "神戸"）
 def get_base_name_from_slug(slug: str):
-    return BASE_SLUGS.get(slug)
+    base = BASE_REGISTRY.by_slug(slug)
+    return base.name if base else None
+
 
+# 拠点名 → URL のスラッグ（例: "神戸" -> "kobe"）
+def get_slug_from_base_name(base_name: str):
+    base = BASE_REGISTRY.by_name(base_name)
+    return base.slug if base else None
 
-# 既存処理で使っている拠点名リスト（値だけ取り出す）
-BASE_NAMES = list(BASE_SLUGS.values())
+
+def base_names():
+    """使っている（active な）拠点名。メニュー・全拠点の一覧・集計・検索・入庫先はこちら"""
+    return [b.name for b in BASE_REGISTRY.active()]
+
+
+def all_base_names():
+    """登録されている拠点名すべて（使っていない拠点も。在庫 ID で探すとき・移行など）"""
+    return [b.name for b in BASE_REGISTRY.all()]
 
 DATA_DIR = "data"
-LOG_FILE = os.path.join(DATA_DIR, "log.csv")
+LOG_DIR = os.path.join(DATA_DIR, "log")  # 月別のログ（CSV 保存時）
 
 # 在庫CSVのヘッダー（拠点ごと）
 HEADERS = [
     "No.", "出庫", "地金", "アイテム", "中石", "サイズ", "品番",
-    "上代", "下代", "脇石", "チェーン長", "摘要", "入力者", "入庫日", "下代（数値）"
+    "上代", "下代", "脇石", "チェーン長", "摘要", "入力者", "入庫日", "下代（数値）",
+    "ID",  # 在庫1点ごとの固定 ID（No. と違って振り直さない・再利用しない）
 ]
+ID_COL = HEADERS.index("ID")
 
 # ログCSVのヘッダー
 # 出庫ログ用に「出庫日」「メモ」を追加
@@ -76,8 +100,11 @@ LOG_HEADERS = [
     "処理", "拠点",
     "No.", "地金", "アイテム", "中石", "サイズ", "品番",
     "上代", "下代", "脇石", "チェーン長", "摘要", "入力者",
-    "入庫日", "出庫日", "メモ", "下代（数値）"
+    "入庫日", "出庫日", "メモ", "下代（数値）", "ID"
 ]
+LOG_BASE_COL = LOG_HEADERS.index("拠点")
+LOG_MEMO_COL = LOG_HEADERS.index("メモ")
+LOG_ID_COL = LOG_HEADERS.index("ID")
 
 # === 共通関数 ===
 def _to_int(x):
@@ -93,30 +120,363 @@ def _to_int(x):
         return 0
 
 
+# === ストレージエンジン ===
+# "csv"（従来の data/*.csv）または "sqlite"（data/inventory.db）
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "csv")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", os.path.join(DATA_DIR, "inventory.db"))
+
+STORAGE = storage.create_storage(STORAGE_BACKEND, DATA_DIR, HEADERS, LOG_HEADERS, SQLITE_PATH)
+
+# GAS への送信キュー（data/gas_outbox/）
+GAS_OUTBOX = gas_outbox.GasOutbox(os.path.join(DATA_DIR, "gas_outbox"), GAS_ENDPOINT_URL)
+
+# 在庫の変更履歴（data/changes/）。入庫・出庫・編集・メモを拠点ごとの通し番号つきで残し、GAS には差分で送る
+CHANGE_FEED = changefeed.ChangeFeed(os.path.join(DATA_DIR, "changes"))
+
+# シートとの突き合わせの間隔（秒）。0 なら定期的には行わない（flask gas-reconcile で手動実行）
+GAS_RECONCILE_INTERVAL = int(os.environ.get("GAS_RECONCILE_INTERVAL", "3600"))
+
+# 拠点ごとの集計（data/inventory_totals.json）。入庫・出庫・編集のたびに差分だけ足し引きする
+INVENTORY_TOTALS = aggregates.InventoryTotals(os.path.join(DATA_DIR, "inventory_totals.json"))
+
+
+# === 在庫キャッシュ ===
+# 拠点名 → (ストレージのバージョン, 行のシーケンス, {在庫ID: 行位置}, 行から作った値の dict)
+# 行のシーケンスは次のどちらか（どちらも行と同じく row[i] で読める）
+#   - スナップショット（snapshot.BaseView）：全ワーカーで共有する mmap。ID 索引も兼ねる
+#   - レコード（records.InventoryRecord）のタプル：スナップショットを使わないとき
+#   - 行のまま（records.RowRecord）のタプル：書いた直後、スナップショットをバックグラウンドで書き終えるまで
+# 読み込みのたびに CSV をパースし直さないよう、プロセス内に保持する。
+# CSV なら (inode, mtime, size)、SQLite なら拠点ごとの更新カウンタがバージョンになるので、
+# 別ワーカーの書き込みがあれば読み直す。
+# 拠点は最初に使われたときに読み込み、INVENTORY_CACHE_IDLE 秒使われなければ捨てる（次に使うときに読み直す）。
+# 拠点数が INVENTORY_CACHE_MAX を超えたら、一番長く使われていない拠点から捨てる
+# （全拠点の一覧が毎回読み直しにならないよう、使っている拠点の数より大きくしておく）
+INVENTORY_CACHE_MAX = int(os.environ.get("INVENTORY_CACHE_MAX", "64"))
+INVENTORY_CACHE_IDLE = float(os.environ.get("INVENTORY_CACHE_IDLE", "1800"))
+
+_inventory_cache = OrderedDict()  # 使われた順（先頭が一番古い）
+_inventory_cache_used = {}        # 拠点名 → 最後に使われた時刻（time.monotonic）
+_inventory_cache_lock = threading.Lock()
+
+# 在庫のスナップショット（data/snapshot/<拠点名>.snap）。INVENTORY_SNAPSHOT=0 で使わない
+# 書き込みの後の書き直しはバックグラウンドで行い、書き終えたらキャッシュをスナップショットに切り替える
+INVENTORY_SNAPSHOT = os.environ.get("INVENTORY_SNAPSHOT", "1") != "0"
+SNAPSHOT = (
+    snapshot.InventorySnapshot(
+        os.path.join(DATA_DIR, "snapshot"), HEADERS, ID_COL,
+        is_current=lambda base, stamp: STORAGE.inventory_version(base) == stamp,
+        on_published=lambda base, stamp: _use_snapshot(base, stamp),
+    )
+    if INVENTORY_SNAPSHOT else None
+)
+
+# キーワード検索の索引（/api/search）。検索のときに、変わった拠点の差分だけ反映する
+SEARCH_COLUMNS = [HEADERS.index(h) for h in ("品番", "摘要", "脇石", "サイズ", "入力者")]
+SEARCH_INDEX = search_index.InventorySearchIndex(SEARCH_COLUMNS, ID_COL)
+
+# 品番 → どの拠点に何点あるか（/api/locate）。入庫・出庫・編集では差分だけ反映する
+LOCATE_INDEX = locate_index.SkuLocateIndex(
+    HEADERS.index("品番"), HEADERS.index("サイズ"), HEADERS.index("地金"), ID_COL)
+
+# コンパイル済みテンプレートのキャッシュ（data/.cache/jinja）。再起動後もテンプレートをコンパイルし直さない
+# （テンプレートを書き換えればソースのチェックサムが変わるので、古いキャッシュは使われない）
+TEMPLATE_CACHE_DIR = os.path.join(DATA_DIR, ".cache", "jinja")
+os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_DIR)
+
+
+def _cache_put(base_name, stamp, rows, derived=None):
+    """
+    キャッシュに登録（上限を超えたら一番古く使われた拠点から捨てる）
+    derived: 行から作った値（"sort_keys" など）。同じ行のキャッシュの間だけ使い回す
+    """
+    if isinstance(rows, snapshot.BaseView):
+        id_index = rows
+    else:
+        id_index = {r[ID_COL]: i for i, r in enumerate(rows) if len(r) > ID_COL and r[ID_COL]}
+    with _inventory_cache_lock:
+        _inventory_cache[base_name] = (stamp, rows, id_index, derived or {})
+        _touch_cached(base_name)
+        while len(_inventory_cache) > INVENTORY_CACHE_MAX:
+            old, _ = _inventory_cache.popitem(last=False)
+            _inventory_cache_used.pop(old, None)
+
+
+def _touch_cached(base_name):
+    """使われた拠点を最後尾へ。先頭から、しばらく使われていない拠点を捨てる（ロックを持って呼ぶ）"""
+    now = time.monotonic()
+    _inventory_cache.move_to_end(base_name)
+    _inventory_cache_used[base_name] = now
+    for old in list(_inventory_cache):
+        if old == base_name or now - _inventory_cache_used.get(old, now) < INVENTORY_CACHE_IDLE:
+            break
+        del _inventory_cache[old]
+        _inventory_cache_used.pop(old, None)
+
+
+def invalidate_inventory_cache(base_name=None):
+    """在庫キャッシュを破棄（base_name 省略時は全拠点）"""
+    with _inventory_cache_lock:
+        if base_name is None:
+            _inventory_cache.clear()
+            _inventory_cache_used.clear()
+        else:
+            _inventory_cache.pop(base_name, None)
+            _inventory_cache_used.pop(base_name, None)
+
+
+def new_item_ids(count):
+    """新しい在庫 ID を count 個払い出す"""
+    return STORAGE.allocate_item_ids(count)
+
+
+def _assign_missing_ids(rows):
+    """ID の無い行（ID 導入前のデータ）に ID を振る。振った行があれば True"""
+    missing = [r for r in rows if len(r) <= ID_COL or not r[ID_COL]]
+    if not missing:
+        return False
+    for r, item_id in zip(missing, new_item_ids(len(missing))):
+        if len(r) <= ID_COL:
+            r.extend([""] * (ID_COL + 1 - len(r)))
+        r[ID_COL] = item_id
+    return True
+
+
+def _cached_records(base_name):
+    """キャッシュにある（バージョンを問わない）レコード。作り直すときの使い回し用"""
+    with _inventory_cache_lock:
+        cached = _inventory_cache.get(base_name)
+    return cached[1] if cached is not None else ()
+
+
+def _cached_sort_keys(base_name, rows):
+    """
+    キャッシュの行 rows の並び順キー（intake.inventory_sort_key）のリストと、並び順どおりか
+    キャッシュ1つにつき1回だけ作る（入庫で差し込んだときは、差し込んだ後のキーを引き継ぐ）
+    """
+    with _inventory_cache_lock:
+        cached = _inventory_cache.get(base_name)
+    derived = cached[3] if cached is not None and cached[1] is rows else {}
+    got = derived.get("sort_keys")
+    if got is None:
+        keys = [records.ensure(r).sort_key for r in rows]
+        got = derived["sort_keys"] = (keys, all(keys[i] <= keys[i + 1] for i in range(len(keys) - 1)))
+    return got
+
+
+def _cached_version(base_name):
+    """キャッシュにあるレコードのバージョン（無ければ None）"""
+    with _inventory_cache_lock:
+        cached = _inventory_cache.get(base_name)
+    return cached[0] if cached is not None else None
+
+
+def _load_cached(base_name):
+    """(レコードのタプル, {在庫ID: 行位置}) を返す。必要なときだけストレージから読む"""
+    stamp = STORAGE.inventory_version(base_name)
+    if stamp is None:
+        invalidate_inventory_cache(base_name)
+        return (), {}
+
+    with _inventory_cache_lock:
+        cached = _inventory_cache.get(base_name)
+        if cached is not None and cached[0] == stamp:
+            _touch_cached(base_name)
+            return cached[1], cached[2]
+
+    view = SNAPSHOT.base(base_name, stamp) if SNAPSHOT is not None else None
+    if view is not None:
+        # 他のワーカーが書いたスナップショットが今のバージョン：CSV は読まない
+        _cache_put(base_name, stamp, view)
+        return view, view
+
+    rows = STORAGE.load_inventory(base_name)
+    if any(len(r) <= ID_COL or not r[ID_COL] for r in rows):
+        # 初回だけ：ID を振って保存して固定する（別ワーカーと二重に振らないよう、ロックして読み直す）
+        with STORAGE.lock_base(base_name):
+            rows = STORAGE.load_inventory(base_name)
+            stamp = STORAGE.inventory_version(base_name)
+            if _assign_missing_ids(rows):
+                stamp = STORAGE.save_inventory(base_name, rows)
+    rows = _store(base_name, stamp, rows)
+    with _inventory_cache_lock:
+        return rows, _inventory_cache[base_name][2]
+
+
+def _store(base_name, stamp, rows, written=False, derived=None):
+    """
+    読んだ・書いた行をキャッシュに入れる。戻り値: キャッシュに入れた行のシーケンス
+    スナップショットを使うときは、その拠点のファイルを書き直して他のワーカーと共有する。
+      - 読んだとき（written=False）：その場で書き、キャッシュもスナップショットにする
+      - 書いたとき（written=True）：レコードをキャッシュに入れてすぐ戻り、ファイルはバックグラウンドで書く
+        （書き込みのリクエストを待たせない）
+    derived: 書いた行から作ってある値（_cache_put を参照）
+    """
+    if SNAPSHOT is not None and not written:
+        try:
+            SNAPSHOT.publish({base_name: (stamp, rows)})
+        except OSError as e:
+            print("[snapshot] publish failed:", e)
+        else:
+            view = SNAPSHOT.base(base_name, stamp)
+            if view is not None:
+                _cache_put(base_name, stamp, view, derived)
+                return view
+    if SNAPSHOT is not None and written:
+        # スナップショットに切り替わるまでの間だけなので、行を解釈せずに持つ（レコードはそのまま）
+        recs = tuple(r if isinstance(r, records.RecordBase) else records.RowRecord(r) for r in rows)
+        _cache_put(base_name, stamp, recs, derived)
+        SNAPSHOT.publish_later(base_name, stamp, recs)
+        return recs
+    recs = records.build(rows, _cached_records(base_name))
+    _cache_put(base_name, stamp, recs, derived)
+    return recs
+
+
+def _use_snapshot(base_name, stamp):
+    """バックグラウンドでスナップショットを書き終えたとき：キャッシュがまだそのバージョンなら mmap に切り替える"""
+    if _cached_version(base_name) != stamp:
+        return
+    view = SNAPSHOT.base(base_name, stamp)
+    if view is None:
+        return
+    with _inventory_cache_lock:
+        cached = _inventory_cache.get(base_name)
+        if cached is not None and cached[0] == stamp:
+            # 中身は同じなので、行から作った値（並び順のキーなど）はそのまま使う
+            _inventory_cache[base_name] = (stamp, view, view, cached[3])
+
+
+def inventory_records(base_name):
+    """拠点在庫のレコード（キャッシュそのもの。表示・集計など読むだけのとき用）"""
+    return _load_cached(base_name)[0]
+
+
 def load_inventory(base_name):
-    """拠点CSV読み込み"""
-    path = os.path.join(DATA_DIR, f"{base_name}.csv")
-    if not os.path.exists(path):
-        return []
-    with open(path, newline="", encoding="utf-8") as f:
-        return list(csv.reader(f))[1:]  # ヘッダー行除外
+    """拠点在庫の読み込み（バージョンが変わっていなければキャッシュから返す）"""
+    rows, _ = _load_cached(base_name)
+    # 呼び出し側が行を書き換えるので、毎回コピーを渡す（パースよりずっと安い）
+    return [list(r) for r in rows]
 
 
-def save_inventory(base_name, rows):
-    """拠点CSV書き込み"""
-    path = os.path.join(DATA_DIR, f"{base_name}.csv")
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(HEADERS)
-        for i, row in enumerate(rows, start=1):
-            row[0] = str(i)  # No. を振り直す
-            writer.writerow(row)
+def find_inventory_row(base_name, item_id):
+    """
+    在庫 ID から行を探す（ID → 行位置 の索引で O(1)）
+    戻り値: (行のコピー, index)。見つからなければ (None, None)
+    """
+    rows, id_index = _load_cached(base_name)
+    i = id_index.get(str(item_id))
+    if i is None:
+        return None, None
+    return list(rows[i]), i
+
+
+def find_item(item_id):
+    """全拠点から在庫 ID の行を探す。戻り値: (拠点名, 行) または (None, None)"""
+    item_id = str(item_id)
+    for base in all_base_names():
+        rows, id_index = _load_cached(base)
+        i = id_index.get(item_id)
+        if i is not None:
+            return base, list(rows[i])
+    return None, None
+
+
+def search_inventory(q):
+    """
+    キーワード（品番・摘要・脇石・サイズ・入力者の前方一致、空白区切りで AND）で在庫を探す
+    戻り値: [(在庫 ID, 拠点名)]
+    """
+    names = base_names()
+    for base in SEARCH_INDEX.bases():
+        if base not in names:
+            SEARCH_INDEX.drop_base(base)  # 使わなくなった拠点
+    for base in names:
+        # 他のワーカーが書き換えていれば、ここで読み直して索引に反映される
+        rows = inventory_records(base)
+        SEARCH_INDEX.update_base(base, _cached_version(base), rows)
+    return SEARCH_INDEX.search(q)
+
+
+def locate_sku(hinban, size=None, jigan=None):
+    """
+    品番（とサイズ・地金）の在庫がどの拠点に何点あるか（LOCATE_INDEX を引く。size は候補の集合でもよい）
+    在庫のバージョンが索引と同じ拠点は読まない（他のワーカーが書き換えた拠点だけ読み直して反映する）
+    """
+    names = base_names()
+    for base in LOCATE_INDEX.bases():
+        if base not in names:
+            LOCATE_INDEX.drop_base(base)  # 使わなくなった拠点
+    for base in names:
+        stamp = STORAGE.inventory_version(base)
+        if stamp is None or LOCATE_INDEX.version(base) != stamp:
+            rows = inventory_records(base)
+            LOCATE_INDEX.update_base(base, _cached_version(base), rows)
+    return LOCATE_INDEX.lookup(hinban, size, jigan)
+
+
+# 全拠点の一覧・集計・書き出しは拠点ごとに並べて処理してまとめる（crossbase.py）
+# CROSSBASE_PROCESSES を 1 以上にすると、絞り込み・並べ替え・集計を子プロセスでも行う（スナップショットを使うとき）
+CROSSBASE = crossbase.CrossBaseEngine(
+    inventory_records,
+    threads=int(os.environ.get("CROSSBASE_THREADS", "4")),
+    processes=int(os.environ.get("CROSSBASE_PROCESSES", "0")),
+    snapshot_args=(SNAPSHOT.path, HEADERS, ID_COL) if SNAPSHOT is not None else None,
+)
+
+
+def _after_write(base_name, stamp, rows, added=None, removed=None, sort_keys=None):
+    """
+    書き込み後：書いた内容でキャッシュ（とスナップショット）を更新
+    added / removed（増えた行・減った行）が分かっていれば、拠点の集計は差分だけ足し引きする
+    sort_keys: rows の (並び順キーのリスト, 並び順どおりか) が分かっていれば（入庫）
+    """
+    if stamp is None:
+        invalidate_inventory_cache(base_name)
+        return
+    old_stamp = _cached_version(base_name)
+    recs = _store(base_name, stamp, rows, written=True,
+                  derived={"sort_keys": sort_keys} if sort_keys else None)
+    if added is not None or removed is not None:
+        LOCATE_INDEX.apply(base_name, old_stamp, stamp, added or (), removed or ())
+    if added is None and removed is None or not INVENTORY_TOTALS.apply(
+            base_name, old_stamp, stamp, added or (), removed or ()):
+        # 差分が分からない・書く前の集計を持っていない：書いた行から数え直す
+        INVENTORY_TOTALS.put(base_name, stamp, aggregates.tally(recs))
+
+
+def update_inventory_row(base_name, index, row, old_row):
+    """
+    在庫の index 行目（old_row）を row に置き換えて保存する（lock_base の中で呼ぶ。SQLite なら1行だけ UPDATE）
+    ほかの行はレコードのまま渡す（CSV を書き直すときだけストレージ側でリストにする）
+    """
+    rows = list(inventory_records(base_name))  # 行はレコードのまま（リストの入れ物だけ作る）
+    rows[index] = row
+    stamp = STORAGE.update_inventory_row(base_name, rows, index)
+    _after_write(base_name, stamp, rows, added=[row], removed=[old_row])
 
 
-def append_log(row, mode, base_name=None):
+def base_totals(base_name):
     """
-    出庫・入庫ログ記録用
+    拠点の集計 {区分: [件数, 上代, 下代]}（aggregates を参照）
+    在庫が前回保存した集計のときから変わっていなければ行を読まずに返す
+    """
+    stamp = STORAGE.inventory_version(base_name)
+    if stamp is None:
+        return aggregates.empty()
+    totals = INVENTORY_TOTALS.get(base_name, stamp)
+    if totals is None:
+        # 集計が無い・古い（別の手段で書き換えられた）ときだけ数え直す
+        recs = inventory_records(base_name)
+        totals = aggregates.tally(recs)
+        INVENTORY_TOTALS.put(base_name, _cached_version(base_name), totals)
+    return totals
+
+
+def build_log_row(row, mode, base_name=None):
+    """
+    在庫1行からログ1行（LOG_HEADERS 順）を作る
     row       : 拠点在庫CSVの1行（HEADERS 順）
     mode      : "入庫" or "出庫"
     base_name : 拠点名
@@ -143,6 +503,7 @@ def append_log(row, mode, base_name=None):
     input_user    = safe_get(12)
     nyuko_date    = safe_get(13)
     gedai_numeric = safe_get(14)
+    item_id       = safe_get(ID_COL)
 
     # 出庫ログのときだけ出庫日を今日の日付にする
     if mode == "出庫":
@@ -172,137 +533,134 @@ def append_log(row, mode, base_name=None):
         shukko_date,
         memo_text,
         gedai_numeric,
+        item_id,
     ]
+    return log_row
+
+
+def checkout_items(base_name, item_ids):
+    """
+    まとめて出庫する。
+    在庫からの削除と出庫ログの追記を1つの単位としてコミットする（途中で落ちても片方だけ残らない）。
+    戻り値: (出庫した行のリスト, 見つからなかった ID のリスト)
+    """
+    wanted = {str(i) for i in item_ids if str(i)}
+    if not wanted:
+        return [], []
+
+    # 読み込みから書き込みまで、同じ拠点を書き換える他のワーカー・スレッドを待たせる
+    with STORAGE.lock_base(base_name):
+        rows = load_inventory(base_name)
+        kept, removed = [], []
+        for row in rows:
+            if row[ID_COL] in wanted:
+                removed.append(row)
+            else:
+                kept.append(row)
 
-    os.makedirs(DATA_DIR, exist_ok=True)
-    with open(LOG_FILE, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(log_row)
+        found = {r[ID_COL] for r in removed}
+        missing = [i for i in item_ids if str(i) not in found]
+        if not removed:
+            return [], missing
 
+        log_rows = [build_log_row(r, "出庫", base_name) for r in removed]
+        stamp = STORAGE.commit_checkout(base_name, kept, removed, log_rows)
+        _after_write(base_name, stamp, kept, removed=removed)
+        record_changes(base_name, [changefeed.checkout_event(r) for r in removed])
+        return removed, missing
 
 
-def load_log_rows(mode=None):
+# === GAS（シート）との同期 ===
+def record_changes(base_name, events):
+    """変更を履歴に残し（通し番号を振る）、同じものを GAS へ差分として送る"""
+    events = CHANGE_FEED.record(base_name, events)
+    if events:
+        send_inventory_to_gas({"action": "changes", "base": base_name, "rows": events})
+    return events
+
+
+def reconcile_gas(base_name):
     """
-    log.csv を読み込み、必要なら処理種別(mode)でフィルタし、
-    新しいものが上に来るように降順に並べる。
-    mode: None → 全件, "入庫" or "出庫" → 絞り込み
+    シートと在庫を塊ごとのハッシュで突き合わせ、違う塊だけを送り直す
+    戻り値: 送り直した塊の名前のリスト（送信待ちの差分が残っているときは None＝今回は見送り）
     """
-    if not os.path.exists(LOG_FILE):
-        return []
+    if not GAS_ENDPOINT_URL or GAS_OUTBOX.depth():
+        # 未送信の差分があるうちはシートが古くて当然なので、比べない
+        return None
+    seq = CHANGE_FEED.last_seq(base_name)
+    rows = load_inventory(base_name)
+    local = changefeed.chunk_hashes(rows)
+    res = GAS_OUTBOX.call({"action": "hashes", "base": base_name, "chunk_size": changefeed.CHUNK})
+    remote = res.get("chunks") or {}
+
+    diff = sorted(k for k in set(local) | set(remote) if local.get(k) != remote.get(k))
+    for name in diff:
+        # シートにしか無い塊は空で送って消してもらう
+        send_inventory_to_gas({
+            "action": "replace_chunk",
+            "base": base_name,
+            "chunk": name,
+            "chunk_size": changefeed.CHUNK,
+            "columns": changefeed.SYNC_COLUMNS,
+            "seq": seq,
+            "rows": changefeed.chunk_rows(rows, name),
+        })
+    return diff
+
 
-    with open(LOG_FILE, newline="", encoding="utf-8") as f:
-        rows = list(csv.reader(f))
+def reconcile_gas_all():
+    for base in base_names():
+        reconcile_gas(base)
 
-    if not rows:
-        return []
 
-    # 先頭行がヘッダーの場合は除外
-    if rows[0] == LOG_HEADERS:
-        rows = rows[1:]
+GAS_OUTBOX.add_periodic("reconcile", GAS_RECONCILE_INTERVAL, reconcile_gas_all)
 
-    if mode:
-        rows = [r for r in rows if r and r[0] == mode]
 
-    # 末尾に追記しているので、逆順にして新しいものを上に
-    rows = rows[::-1]
-    return rows
+# ログ画面の1ページあたりの件数
+LOG_PAGE_SIZE = int(os.environ.get("LOG_PAGE_SIZE", "200"))
+
+
+def load_log_page(mode=None, page=1, per_page=LOG_PAGE_SIZE):
+    """
+    新しい順に1ページ分のログを返す（ログ全体は読まない）
+    戻り値: (keys, rows, pager)
+      keys  : メモ保存などで使う行キー
+      pager : {"page", "pages", "total", "per_page"}
+    """
+    page = max(page, 1)
+    entries, total = STORAGE.read_log_page(mode, (page - 1) * per_page, per_page)
+    pages = max((total + per_page - 1) // per_page, 1)
+    keys = [k for k, _ in entries]
+    rows = [r for _, r in entries]
+    return keys, rows, {"page": page, "pages": pages, "total": total, "per_page": per_page}
 
 
 def summarize_inventory(rows):
-    """行配列の形（単拠点/全拠点）に応じて列位置を切り替えて集計"""
-    cats = ["リング", "ペンダント", "チェーン", "その他"]
-    summary = {c: {"count": 0, "上代": 0, "下代": 0} for c in cats}
-    totals = {"count": 0, "上代": 0, "下代": 0}
+    """
+    アイテム区分（リング/ペンダント/チェーン/その他）ごとの件数・上代・下代の合計
+    rows は在庫のレコード（在庫行のリストでもよい）。上代・下代が数値でない行は数えない
+    戻り値: (summary, totals)。金額はカンマ区切りの文字列
+    """
+    return aggregates.display(aggregates.tally(rows))
 
-    for row in rows:
-        if not row:
-            continue
 
-        # --- 列インデックスを形に応じて決定 ---
-        # 単拠点: 長さ>=15（No.,出庫を含む）
-        # 全拠点: 長さ==13（先頭=地金）
-        if len(row) >= 15:
-            idx_item = 3   # アイテム
-            idx_up   = 7   # 上代
-            idx_down = 8   # 下代
-        elif len(row) == 13:
-            idx_item = 1   # アイテム
-            idx_up   = 5   # 上代
-            idx_down = 6   # 下代
-        else:
-            # 念のためのフォールバック（列数が想定外のときはスキップ）
-            continue
+def summarize_bases(bases):
+    """拠点の在庫全体の集計（保存してある拠点ごとの集計を足すだけで、行は数えない）"""
+    return aggregates.display(aggregates.combine(base_totals(b) for b in bases))
 
-        try:
-            item = str(row[idx_item])
-            up_str = str(row[idx_up]).replace(",", "").strip()
-            dn_str = str(row[idx_down]).replace(",", "").strip()
-            up_val = float(up_str) if up_str else 0.0
-            dn_val = float(dn_str) if dn_str else 0.0
-        except Exception:
-            continue
 
-        # カテゴリ判定（含まれていれば該当）
-        if "リング" in item:
-            cat = "リング"
-        elif "ペンダント" in item:
-            cat = "ペンダント"
-        elif "チェーン" in item:
-            cat = "チェーン"
-        else:
-            cat = "その他"
-
-        summary[cat]["count"] += 1
-        summary[cat]["上代"] += up_val
-        summary[cat]["下代"] += dn_val
-
-        totals["count"] += 1
-        totals["上代"] += up_val
-        totals["下代"] += dn_val
-
-    # 表示整形
-    for c in cats:
-        summary[c]["上代"] = f"{summary[c]['上代']:,.0f}"
-        summary[c]["下代"] = f"{summary[c]['下代']:,.0f}"
-    totals["上代"] = f"{totals['上代']:,.0f}"
-    totals["下代"] = f"{totals['下代']:,.0f}"
-
-    return summary, totals
-
-
-# app.py の先頭あたりに追加
-BASES = [
-    {
-        "slug": "yokohama",
-        "label_entry": "横浜店",     # 入庫メニュー用の表示
-        "label_inventory": "横浜店"  # 在庫一覧での表示
-    },
-    {
-        "slug": "kobe",
-        "label_entry": "神戸店",
-        "label_inventory": "神戸店"
-    },
-    {
-        "slug": "omiya",
-        "label_entry": "大宮店",
-        "label_inventory": "大宮店"
-    },
-    {
-        "slug": "senboku",
-        "label_entry": "泉北店",
-        "label_inventory": "泉北店"
-    },
-    {
-        "slug": "chiba",
-        "label_entry": "千葉店",
-        "label_inventory": "千葉店"
-    },
-    {
-        "slug": "ateam",
-        "label_entry": "Aチーム",   # ここは「店」を付けない
-        "label_inventory": "Aチーム"
-    },
-]
+def summarize_query(bases, matched, q):
+    """一覧の集計：絞り込んでいなければ拠点の集計、絞り込んでいれば該当行を数える"""
+    if query.is_filtered(q):
+        return summarize_inventory([r for _, r in matched])
+    return summarize_bases(bases)
+
+
+@app.before_request
+def start_gas_outbox():
+    # 前回送れずに残っている分があれば送る（ワーカーはプロセスごとに1回だけ起動）
+    GAS_OUTBOX.ensure_worker()
+
 
 @app.before_request
 def require_login():
@@ -313,6 +671,10 @@ def require_login():
     if session.get("logged_in"):
         return
 
+    # API（ハンディ端末など）はリダイレクトではなく 401 を返す
+    if request.path.startswith("/api/"):
+        return jsonify({"ok": False, "error": "ログインしてください"}), 401
+
     return redirect(url_for("login"))
 
 
@@ -340,11 +702,11 @@ def logout():
 
 @app.route("/print/base/<base_name>")
 def print_base_inventory(base_name):
-    if base_name not in BASE_NAMES:
+    if BASE_REGISTRY.by_name(base_name) is None:
         return "拠点が見つかりません", 404
 
-    # すでに使っている共通関数をそのまま使う
-    rows = load_inventory(base_name)
+    # 表示するだけなのでキャッシュのレコードをそのまま使う
+    rows = inventory_records(base_name)
 
     return render_template(
         "inventory_base_print.html",
@@ -355,7 +717,14 @@ def print_base_inventory(base_name):
 
 @app.route("/")
 def index():
-    return render_template("index.html", bases=BASES)
+    # 拠点ごとの在庫数・上代合計（保存してある集計なので行は読まない）
+    active = BASE_REGISTRY.active()
+    per_base = {}
+    for b in active:
+        _, totals = aggregates.display(base_totals(b.name))
+        per_base[b.slug] = totals
+    _, all_totals = summarize_bases([b.name for b in active])
+    return render_template("index.html", bases=active, base_totals=per_base, all_totals=all_totals)
 
 @app.route("/inventory/<base_slug>", methods=["GET", "POST"])
 def inventory(base_slug):
@@ -368,21 +737,14 @@ def inventory(base_slug):
     if not base_name:
         return "拠点が見つかりません", 404
 
-    # 対象拠点の在庫を読み込み（CSV は拠点名で管理）
-    rows = load_inventory(base_name)
-
     # ---- 出庫処理 ----
     if request.method == "POST":
-        checked = request.form.getlist("checkout")  # チェックされた行の index
-        new_rows = []
-        for i, row in enumerate(rows):
-            if str(i) in checked:
-                # 出庫ログ記録（拠点名つき）
-                append_log(row, "出庫", base_name)
-            else:
-                new_rows.append(row)
-        save_inventory(base_name, new_rows)
-        rows = new_rows  # 出庫後の在庫に更新
+        checked = request.form.getlist("checkout")  # チェックされた行の在庫 ID
+        # 在庫削除と出庫ログ（拠点名つき）をまとめてコミット
+        checkout_items(base_name, checked)
+
+    # 対象拠点の在庫（表示するだけなのでキャッシュのレコードをそのまま使う）
+    rows = inventory_records(base_name)
 
     # ==== 表示用ヘッダー ====
     headers = [
@@ -390,8 +752,14 @@ def inventory(base_slug):
         "上代", "下代", "脇石", "チェーン長", "摘要", "入力者", "入庫日"
     ]
 
-    # ==== 集計（リング/ペンダント/チェーン/その他） ====
-    summary, totals = summarize_inventory(rows)
+    # ==== 絞り込み・並べ替え・ページ分け（サーバー側） ====
+    fields = query.FILTER_FIELDS[1:]  # 拠点のプルダウンは不要
+    q = query.parse_args(request.args, fields)
+    entries = [(base_name, r) for r in rows]
+    page_entries, matched, pager = query.run_query(entries, q)
+
+    # ==== 集計（リング/ペンダント/チェーン/その他）は絞り込んだ全件で ====
+    summary, totals = summarize_query([base_name], matched, q)
 
     # inventory.html を表示
     return render_template(
@@ -399,36 +767,233 @@ def inventory(base_slug):
         base_name=base_name,   # 画面表示用：神戸/横浜/Aチーム など
         base_slug=base_slug,   # 必要ならテンプレ側でリンク用に使える
         headers=headers,
-        rows=rows,
+        sort_keys=query.SORT_FIELDS[2:],
+        rows=[r for _, r in page_entries],
         enumerate=enumerate,
         summary=summary,
         totals=totals,
         total_count=totals["count"],
         total_上代=totals["上代"],
         total_下代=totals["下代"],
+        all_count=len(rows),
+        query=q,
+        query_args=lambda **kw: query.to_args(q, **kw),
+        pager=pager,
+        per_page_choices=query.PER_PAGE_CHOICES,
+        options=query.filter_options(entries, fields),
     )
 
-@app.route("/inventory/<base_name>/edit/<no>", methods=["GET", "POST"])
-def edit_inventory_row(base_name, no):
-    """拠点在庫1行分の編集用"""
+@app.route("/api/checkout/<base_slug>", methods=["POST"])
+def api_checkout(base_slug):
+    """
+    まとめて出庫する JSON API（ハンディスキャナーのかご単位の送信用）
+    リクエスト: {"ids": ["S0000001", ...]}
+    レスポンス: {"ok": true, "count": 出庫件数, "checked_out": [...], "missing": [...]}
+    """
+    base_name = get_base_name_from_slug(base_slug)
+    if not base_name:
+        return jsonify({"ok": False, "error": "拠点が見つかりません"}), 404
 
-    if base_name not in BASE_NAMES:
-        return "拠点が見つかりません", 404
+    data = request.get_json(silent=True) or {}
+    ids = data.get("ids")
+    if not isinstance(ids, list) or not ids:
+        return jsonify({"ok": False, "error": "ids を配列で指定してください"}), 400
 
-    # 対象拠点の在庫を読み込み
-    rows = load_inventory(base_name)
+    removed, missing = checkout_items(base_name, [str(i) for i in ids])
+    return jsonify({
+        "ok": True,
+        "base": base_name,
+        "count": len(removed),
+        "checked_out": [r[ID_COL] for r in removed],
+        "missing": missing,
+    })
 
-    # No. が一致する行を探す
-    target_index = None
-    for idx, row in enumerate(rows):
-        if len(row) > 0 and row[0] == str(no):
-            target_index = idx
-            break
 
-    if target_index is None:
-        return f"No.{no} の在庫が見つかりません", 404
+@app.route("/api/gas_outbox")
+def api_gas_outbox():
+    """GAS 送信キューの状態（送信待ちの件数・直近のエラーなど）"""
+    return jsonify(GAS_OUTBOX.status())
+
+
+@app.route("/api/changes/<base_slug>")
+def api_changes(base_slug):
+    """
+    拠点の変更履歴（since より後の分）
+    complete が false なら since の直後の履歴がもう無いので、突き合わせで合わせ直すこと
+    """
+    base_name = get_base_name_from_slug(base_slug)
+    if not base_name:
+        return jsonify({"ok": False, "error": "拠点が見つかりません"}), 404
+    since = request.args.get("since", 0, type=int)
+    limit = min(max(request.args.get("limit", 1000, type=int), 1), 5000)
+    return jsonify(dict(CHANGE_FEED.since(base_name, since, limit), ok=True, base=base_name))
+
+
+@app.route("/api/search")
+def api_search():
+    """
+    在庫のキーワード検索 API
+    /api/search?q=04A-289 pt → {"ok": true, "count": 件数, "ids": [...], "items": [{"id", "base"}]}
+    limit（既定 500）を超える分は返さない（count は全件数）
+    """
+    q = request.args.get("q", "")
+    limit = request.args.get("limit", 500, type=int)
+    hits = search_inventory(q)
+    shown = hits[:max(limit, 0)]
+    return jsonify({
+        "ok": True,
+        "count": len(hits),
+        "ids": [i for i, _ in shown],
+        "items": [{"id": i, "base": b} for i, b in shown],
+    })
+
+
+@app.route("/api/locate")
+def api_locate():
+    """
+    品番の在庫がどの拠点に何点あるか
+    /api/locate?hinban=04A-289&size=0.3&jigan=Pt900&chuseki=ダイヤ（size・jigan・chuseki は省略可）
+    サイズは入庫のときと同じく intake.normalize_size でそろえて引く（ダイヤの 1.5 → "1.5CT"）。
+    chuseki が無ければ、そのままのサイズとダイヤとしてそろえたサイズのどちらでも当たる
+      → {"ok": true, "hinban": ..., "count": 全拠点の点数,
+         "skus": [{"hinban", "size", "jigan", "count",
+                   "bases": [{"base", "slug", "count", "ids": [...]}]}]}
+    拠点は拠点一覧の順
+    """
+    hinban = request.args.get("hinban", "").strip()
+    if not hinban:
+        return jsonify({"ok": False, "error": "品番を指定してください"}), 400
+    size = request.args.get("size", "").strip()
+    chuseki = request.args.get("chuseki", "").strip()
+    if size:
+        sizes = ({intake.normalize_size(chuseki, size)} if chuseki
+                 else {size, intake.normalize_size("ダイヤ", size)})
+    else:
+        sizes = None
+    order = {b: i for i, b in enumerate(base_names())}
+    skus = []
+    for (h, size, jigan), per_base in locate_sku(hinban, sizes, request.args.get("jigan")):
+        bases = [
+            {"base": b, "slug": get_slug_from_base_name(b), "count": len(ids), "ids": ids}
+            for b, ids in sorted(per_base.items(), key=lambda e: order.get(e[0], len(order)))
+        ]
+        skus.append({"hinban": h, "size": size, "jigan": jigan,
+                     "count": sum(e["count"] for e in bases), "bases": bases})
+    return jsonify({
+        "ok": True,
+        "hinban": hinban,
+        "count": sum(s["count"] for s in skus),
+        "skus": skus,
+    })
+
+
+# === 参照用 JSON API（ETag つき） ===
+# ETag はストレージのバージョン（拠点ごと・ログ）とクエリ文字列から作る。
+# If-None-Match が一致すれば、在庫を読まず・JSON も作らずに 304 を返す。
+
+def _etag(*parts):
+    """データのバージョン＋リクエスト条件 → 強い ETag"""
+    return hashlib.sha1(repr((request.endpoint, request.query_string) + parts).encode("utf-8")).hexdigest()
+
+
+def _conditional_json(etag, build):
+    """build() は 304 にならなかったときだけ呼ぶ"""
+    if etag in request.if_none_match:
+        resp = app.response_class(status=304)
+    else:
+        resp = jsonify(build())
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"  # 毎回 ETag で確認させる
+    return resp
+
+
+def _inventory_versions(bases):
+    return tuple((b, STORAGE.inventory_version(b)) for b in bases)
+
+
+def _inventory_json(bases, q):
+    result = CROSSBASE.run(bases, q, base_totals)
+    summary, totals = aggregates.display(result["totals"])
+    return {
+        "ok": True,
+        "pager": result["pager"],
+        "summary": summary,
+        "totals": totals,
+        "rows": [
+            dict(zip(storage.INVENTORY_COLUMNS, row), base=base)
+            for base, row in result["entries"]
+        ],
+    }
+
+
+@app.route("/api/inventory/<base_slug>")
+def api_inventory(base_slug):
+    """拠点の在庫（/inventory/<base_slug> と同じクエリ文字列で絞り込み・ページ分け）"""
+    base_name = get_base_name_from_slug(base_slug)
+    if not base_name:
+        return jsonify({"ok": False, "error": "拠点が見つかりません"}), 404
+
+    def build():
+        q = query.parse_args(request.args, query.FILTER_FIELDS[1:])
+        return _inventory_json([base_name], q)
+
+    return _conditional_json(_etag(_inventory_versions([base_name])), build)
+
+
+@app.route("/api/inventory_all")
+def api_inventory_all():
+    """全拠点の在庫（/inventory_all と同じクエリ文字列で絞り込み・ページ分け）"""
+    def build():
+        return _inventory_json(names, query.parse_args(request.args))
+
+    names = base_names()
+    return _conditional_json(_etag(_inventory_versions(names)), build)
+
+
+@app.route("/api/summary")
+def api_summary():
+    """拠点ごと・全体のアイテム別集計"""
+    def build():
+        per_base = {b: base_totals(b) for b in names}
+        bases = {}
+        for b, t in per_base.items():
+            summary, totals = aggregates.display(t)
+            bases[b] = {"summary": summary, "totals": totals}
+        summary, totals = aggregates.display(aggregates.combine(per_base.values()))
+        return {"ok": True, "bases": bases, "summary": summary, "totals": totals}
+
+    names = base_names()
+    return _conditional_json(_etag(_inventory_versions(names)), build)
+
+
+@app.route("/api/log")
+def api_log():
+    """ログを新しい順に1ページ分（?mode=入庫|出庫&page=&per_page=）"""
+    mode = request.args.get("mode") or None
+    if mode not in (None, "入庫", "出庫"):
+        return jsonify({"ok": False, "error": "mode は 入庫 か 出庫 を指定してください"}), 400
+
+    def build():
+        page = request.args.get("page", 1, type=int)
+        per_page = request.args.get("per_page", LOG_PAGE_SIZE, type=int)
+        keys, rows, pager = load_log_page(mode, page, max(per_page, 1))
+        return {
+            "ok": True,
+            "pager": pager,
+            "rows": [dict(zip(storage.LOG_COLUMNS, row), key=str(k)) for k, row in zip(keys, rows)],
+        }
+
+    return _conditional_json(_etag(STORAGE.log_version()), build)
+
 
-    row = rows[target_index]
+@app.route("/inventory/<base_name>/edit/<item_id>", methods=["GET", "POST"])
+def edit_inventory_row(base_name, item_id):
+    """拠点在庫1行分の編集用（在庫 ID で行を特定する）"""
+
+    if BASE_REGISTRY.by_name(base_name) is None:
+        return "拠点が見つかりません", 404
+
+    base_slug = get_slug_from_base_name(base_name)
 
     if request.method == "POST":
         # 全拠点画面から来たかどうか（hidden で送られてくる）
@@ -461,13 +1026,18 @@ def edit_inventory_row(base_name, no):
         }
         missing = [name for name, val in required.items() if not val]
         if missing:
+            row, _ = find_inventory_row(base_name, item_id)
+            if row is None:
+                return f"ID {item_id} の在庫が見つかりません", 404
             flash("必須項目が不足しています。", "error")
 
             # そのまま編集画面を再表示
             return render_template(
                 "inventory_edit.html",
                 base_name=base_name,
-                no=no,
+                base_slug=base_slug,
+                no=row[0],
+                item_id=item_id,
                 from_all=from_all,
                 row={
                     "jigan": jigan,
@@ -493,31 +1063,41 @@ def edit_inventory_row(base_name, no):
             except ValueError:
                 nyuko_date = nyuko_date.replace("-", "/")
 
-        # 既存の No. / 出庫フラグ / 下代（数値）はそのまま使う
-        no_           = row[0] if len(row) > 0 else ""
-        shukko_flag   = row[1] if len(row) > 1 else ""
-        gedai_numeric = row[14] if len(row) > 14 else ""
-
-        new_row = [
-            no_,
-            shukko_flag,
-            jigan,
-            item,
-            chuseki,
-            size,
-            hinban,
-            uedai,
-            gedai,
-            wakishi,
-            chain_len,
-            tekiyo,
-            input_user,
-            nyuko_date,
-            gedai_numeric,
-        ]
+        with STORAGE.lock_base(base_name):
+            # フォームを開いた後に出庫・編集されているかもしれないので、ロックの中で探す
+            # （ID → 行位置 の索引で対象行を探す。No. は出庫でずれるので使わない）
+            row, target_index = find_inventory_row(base_name, item_id)
+            if target_index is None:
+                return f"ID {item_id} の在庫が見つかりません", 404
+            no = row[0]
+
+            # 既存の No. / 出庫フラグ / 下代（数値）はそのまま使う
+            no_           = row[0] if len(row) > 0 else ""
+            shukko_flag   = row[1] if len(row) > 1 else ""
+            gedai_numeric = row[14] if len(row) > 14 else ""
+            item_id_      = row[ID_COL]
+
+            new_row = [
+                no_,
+                shukko_flag,
+                jigan,
+                item,
+                chuseki,
+                size,
+                hinban,
+                uedai,
+                gedai,
+                wakishi,
+                chain_len,
+                tekiyo,
+                input_user,
+                nyuko_date,
+                gedai_numeric,
+                item_id_,
+            ]
 
-        rows[target_index] = new_row
-        save_inventory(base_name, rows)
+            update_inventory_row(base_name, target_index, new_row, row)
+            record_changes(base_name, [changefeed.edit_event(row, new_row)])
 
         # ★ メッセージは「戻り先の一覧」で出す
         flash(f"No.{no} の在庫を更新しました。", "success")
@@ -525,11 +1105,17 @@ def edit_inventory_row(base_name, no):
         if from_all:
             return redirect(url_for("inventory_all"))
         else:
-            return redirect(url_for("inventory", base_name=base_name))
+            return redirect(url_for("inventory", base_slug=base_slug))
 
     # GET: 編集フォーム表示
     from_all = (request.args.get("from_all") == "1")
 
+    # ID → 行位置 の索引で対象行を探す（No. は出庫でずれるので使わない）
+    row, _ = find_inventory_row(base_name, item_id)
+    if row is None:
+        return f"ID {item_id} の在庫が見つかりません", 404
+    no = row[0]
+
     row_dict = {
         "jigan":      row[2] if len(row) > 2 else "",
         "item":       row[3] if len(row) > 3 else "",
@@ -548,7 +1134,9 @@ def edit_inventory_row(base_name, no):
     return render_template(
         "inventory_edit.html",
         base_name=base_name,
+        base_slug=base_slug,
         no=no,
+        item_id=item_id,
         from_all=from_all,
         row=row_dict,
     )
@@ -556,23 +1144,19 @@ def edit_inventory_row(base_name, no):
 
 @app.route("/inventory_all")
 def inventory_all():
-    """全拠点の在庫を統合して表示（No.・出庫は画面には出さない）"""
-    all_rows = []
-
-    for base in BASE_NAMES:
-        rows = load_inventory(base)
-        for row in rows:
-            if len(row) < 15:
-                continue
-            # row:
-            # [No., 出庫, 地金, アイテム, 中石, サイズ, 品番,
-            #  上代, 下代, 脇石, チェーン長, 摘要, 入力者, 入庫日, 下代（数値）]
-            full_row = [base] + row   # 先頭に拠点名を追加
-            all_rows.append(full_row)
+    """
+    全拠点の在庫を統合して表示（No.・出庫は画面には出さない）
+    絞り込み・並べ替え・ページ分けはサーバー側で、拠点ごとに並べて行ってまとめる（crossbase.py）。
+    1ページ分だけ返す
+    """
+    q = query.parse_args(request.args)
+    # row（レコード）:
+    # [No., 出庫, 地金, アイテム, 中石, サイズ, 品番,
+    #  上代, 下代, 脇石, チェーン長, 摘要, 入力者, 入庫日, 下代（数値）, ID]
+    result = CROSSBASE.run(base_names(), q, base_totals, options=query.FILTER_FIELDS)
 
-    # 集計用：拠点列だけ除いた「元の形」を summarize_inventory に渡す
-    rows_for_summary = [r[1:] for r in all_rows]
-    summary, totals = summarize_inventory(rows_for_summary)
+    # 集計は絞り込んだ全件で
+    summary, totals = aggregates.display(result["totals"])
 
     headers = [
         "拠点", "地金", "アイテム", "中石", "サイズ", "品番",
@@ -582,15 +1166,148 @@ def inventory_all():
     return render_template(
         "inventory_all.html",
         headers=headers,
-        rows=all_rows,
+        sort_keys=("base",) + query.SORT_FIELDS[2:],
+        rows=[[base, *row] for base, row in result["entries"]],   # 先頭に拠点名を追加
         summary=summary,
         totals=totals,
         total_count=totals["count"],
         total_上代=totals["上代"],
         total_下代=totals["下代"],
+        all_count=result["count"],
+        query=q,
+        query_args=lambda **kw: query.to_args(q, **kw),
+        pager=result["pager"],
+        per_page_choices=query.PER_PAGE_CHOICES,
+        options=result["options"],
+    )
+
+
+def insert_stock_rows(base_name, new_rows):
+    """
+    入庫した行を並び順（アイテム → 地金 → 中石 → サイズ → 品番 → 上代）の位置に差し込んで保存する
+    既存の行のキーはキャッシュごとに1回だけ作って持っておき（_cached_sort_keys）、
+    新しい行のキーだけ計算して二分探索で位置を決める。既存の行はレコードのまま使い（コピーしない）、
+    差し込んだ位置より後ろの行だけ No. を振り直す。（編集などで並びが崩れていたときだけ、全体を並べ直す）
+    """
+    if not new_rows:
+        return
+    with STORAGE.lock_base(base_name):
+        cached = inventory_records(base_name)
+        keys, in_order = _cached_sort_keys(base_name, cached)
+
+        if not in_order:
+            order = sorted(range(len(cached)), key=keys.__getitem__)
+            rows = [list(cached[i]) for i in order]
+            keys = [keys[i] for i in order]
+            for row in new_rows:
+                key = intake.inventory_sort_key(row)
+                i = bisect_right(keys, key)
+                keys.insert(i, key)
+                rows.insert(i, row)
+            stamp = STORAGE.save_inventory(base_name, rows)
+            _after_write(base_name, stamp, rows, added=new_rows, sort_keys=(keys, True))
+            return
+
+        keys = list(keys)
+        rows = list(cached)  # 行はレコードのまま（リストの入れ物だけ作る）
+        positions = []
+        for row in new_rows:
+            key = intake.inventory_sort_key(row)
+            # 同じキーの既存行の後ろ（sorted() に追記して並べたときと同じ位置）
+            i = bisect_right(keys, key)
+            keys.insert(i, key)
+            rows.insert(i, row)
+            positions = [p + 1 if p >= i else p for p in positions]
+            positions.append(i)
+
+        stamp = STORAGE.insert_inventory_rows(base_name, rows, positions)
+        # No. は並び順の番号。差し込んだ位置から後ろだけ振り直す
+        for i in range(min(positions), len(rows)):
+            row = rows[i]
+            if isinstance(row, list):
+                row[0] = str(i + 1)
+            elif row[0] != str(i + 1):
+                rows[i] = row.with_no(str(i + 1))
+        _after_write(base_name, stamp, rows, added=new_rows, sort_keys=(keys, True))
+
+
+# === 入庫（フォーム・一括取り込み・/api/intake 共通） ===
+STOCK_FORM_ROWS = 20  # 入庫フォームの行数
+
+
+def _stock_form_records(form, fixed_base=None):
+    """
+    入庫フォームの POST → 入力行の dict のリスト（画面の再表示にもそのまま使う）
+    fixed_base があれば拠点はそれで固定（拠点別の入庫フォーム）
+    """
+    columns = {f: form.getlist(f"{f}[]") for f in ["branch"] + intake.STOCK_FIELDS}
+    count = max([STOCK_FORM_ROWS] + [len(v) for v in columns.values()])
+    records = []
+    for i in range(count):
+        values = {f: (v[i] if i < len(v) else "") for f, v in columns.items()}
+        if fixed_base:
+            values["branch"] = fixed_base
+        records.append(values)
+    return records
+
+
+def _empty_stock_form(fixed_base=None):
+    return [dict({f: "" for f in intake.STOCK_FIELDS}, branch=fixed_base or "")
+            for _ in range(STOCK_FORM_ROWS)]
+
+
+def commit_stock_intake(per_base):
+    """
+    検証済みの在庫行（{拠点名: [在庫行]}）を入庫する。
+    ID はまとめて払い出し、拠点ごとに1回だけ（並び順の位置に差し込んで）保存し、
+    入庫ログは全拠点分を1回で追記し、GAS への差分も拠点ごとに1回で送る。
+    戻り値: 入庫した件数
+    """
+    total = sum(len(rows) for rows in per_base.values())
+    ids = iter(new_item_ids(total))
+    log_rows = []
+    for base, new_rows in per_base.items():
+        for r in new_rows:
+            r[ID_COL] = next(ids)
+        insert_stock_rows(base, new_rows)
+        log_rows.extend(build_log_row(r, "入庫", base) for r in new_rows)
+    STORAGE.append_log(log_rows)
+    for base, new_rows in per_base.items():
+        record_changes(base, [changefeed.add_event(r) for r in new_rows])
+    return total
+
+
+def run_stock_intake(records, default_base=None):
+    """
+    入力行をまとめて検証し、エラーが無ければ入庫する（エラーがあれば1件も入れない）
+    records: [(行番号, 入力の dict)]
+    戻り値: ({拠点名: [在庫行]}, [エラーメッセージ])
+    """
+    # 入庫先の選択肢は使っている拠点だけだが、使っていない拠点の画面・ファイルからの入庫は受ける
+    per_base, errors = intake.validate_batch(records, all_base_names(), default_base)
+    if not errors and per_base:
+        commit_stock_intake(per_base)
+    return per_base, errors
+
+
+def _render_stock_form(rows_data, fixed_base=None, error=None):
+    return render_template(
+        "add_stock.html",
+        base_names=base_names(),
+        rows_data=rows_data,
+        error=error,
+        success=None,
+        fixed_base=fixed_base,   # ★ テンプレ側で「拠点固定」に使う
     )
 
 
+def _stock_form_error(errors):
+    """フォーム用のエラーメッセージ（最初の1件＋残りの件数）"""
+    if len(errors) == 1:
+        return errors[0]
+    return f"{errors[0]}（ほか {len(errors) - 1} 件）"
+
+
 @app.route("/add_stock_for_base/<base_slug>", methods=["GET", "POST"])
 def add_stock_for_base(base_slug):
     # スラッグから拠点名を取得
@@ -598,330 +1315,26 @@ def add_stock_for_base(base_slug):
     if not base_name:
         return "拠点が見つかりません", 404
 
-    error = None
-    success = None
-    ROW_COUNT = 20
-
     if request.method == "POST":
-        # ▼ 全拠点フォームと同じ項目を取得（branch は使わない）
-        _branches       = request.form.getlist("branch[]")  # 受け取るが使わない
-        jigan_list      = request.form.getlist("jigan[]")
-        item_list       = request.form.getlist("item[]")
-        chuseki_list    = request.form.getlist("chuseki[]")
-        size_list       = request.form.getlist("size[]")
-        hinban_list     = request.form.getlist("hinban[]")
-        uedai_list      = request.form.getlist("uedai[]")
-        gedai_list      = request.form.getlist("gedai[]")
-        wakishi_list    = request.form.getlist("wakishi[]")
-        chain_list      = request.form.getlist("chain_len[]")
-        tekiyo_list     = request.form.getlist("tekiyo[]")
-        input_user_list = request.form.getlist("input_user[]")
-        nyuko_date_list = request.form.getlist("nyuko_date[]")
-        gedai_num_list  = request.form.getlist("gedai_numeric[]")
-
-        # --- rows_data（エラー時の再表示用）を作成：branch は常に base_name で固定 ---
-        rows_data = []
-        max_len = max(
-            len(jigan_list),
-            len(item_list),
-            len(chuseki_list),
-            len(size_list),
-            len(hinban_list),
-            len(uedai_list),
-            len(gedai_list),
-            len(wakishi_list),
-            len(chain_list),
-            len(tekiyo_list),
-            len(input_user_list),
-            len(nyuko_date_list),
-            len(gedai_num_list),
-            ROW_COUNT
-        )
-        for i in range(max_len):
-            rows_data.append({
-                "branch":        base_name,                         # ★固定
-                "jigan":         jigan_list[i]      if i < len(jigan_list)      else "",
-                "item":          item_list[i]       if i < len(item_list)       else "",
-                "chuseki":       chuseki_list[i]    if i < len(chuseki_list)    else "",
-                "size":          size_list[i]       if i < len(size_list)       else "",
-                "hinban":        hinban_list[i]     if i < len(hinban_list)     else "",
-                "uedai":         uedai_list[i]      if i < len(uedai_list)      else "",
-                "gedai":         gedai_list[i]      if i < len(gedai_list)      else "",
-                "wakishi":       wakishi_list[i]    if i < len(wakishi_list)    else "",
-                "chain_len":     chain_list[i]      if i < len(chain_list)      else "",
-                "tekiyo":        tekiyo_list[i]     if i < len(tekiyo_list)     else "",
-                "input_user":    input_user_list[i] if i < len(input_user_list) else "",
-                "nyuko_date":    nyuko_date_list[i] if i < len(nyuko_date_list) else "",
-                "gedai_numeric": gedai_num_list[i]  if i < len(gedai_num_list)  else "",
-            })
-        if len(rows_data) < ROW_COUNT:
-            for _ in range(ROW_COUNT - len(rows_data)):
-                rows_data.append({
-                    "branch": base_name, "jigan": "", "item": "", "chuseki": "",
-                    "size": "", "hinban": "", "uedai": "", "gedai": "",
-                    "wakishi": "", "chain_len": "", "tekiyo": "",
-                    "input_user": "", "nyuko_date": "", "gedai_numeric": ""
-                })
-
-        # このフォームでは対象拠点は1つだけ
-        per_base_rows = {base_name: load_inventory(base_name)}
-        today_str_dash = datetime.date.today().strftime("%Y-%m-%d")
-
-        # ★GAS: 送信用バッファ
-        rows_to_send = []
-        payload_user = ""  # 最初の入力者をまとめ用に記録
-
-        # 単位正規化用：脇石(ct) / チェーン長(cm)
-        def normalize_ct(s: str) -> str:
-            s = s.strip()
-            if not s:
-                return ""
-            lower = s.lower()
-            if "ct" in lower or "ｃｔ" in lower:
-                s2 = re.sub(r"[ｃcＣC][ｔtＴT]", "ct", s, flags=re.IGNORECASE)
-                return s2
-            if re.fullmatch(r"[0-9]+(\.[0-9]+)?", s):
-                return f"{s}ct"
-            return s
-
-        def normalize_cm(s: str) -> str:
-            s = s.strip()
-            if not s:
-                return ""
-            s2 = re.sub(r"[cｃＣ][mｍＭ]|㎝", "cm", s, flags=re.IGNORECASE)
-            lower = s2.lower()
-            if "cm" in lower:
-                return s2
-            if re.fullmatch(r"[0-9]+(\.[0-9]+)?", s2):
-                return f"{s2}cm"
-            return s2
-
-        rows_added = 0
-
-        # --- 登録処理 & バリデーション ---
-        for i in range(ROW_COUNT):
-            # ★ 拠点は URL で固定
-            branch   = base_name
-            jigan    = jigan_list[i].strip()      if i < len(jigan_list)      else ""
-            item     = item_list[i].strip()       if i < len(item_list)       else ""
-            chuseki  = chuseki_list[i].strip()    if i < len(chuseki_list)    else ""
-            size     = size_list[i].strip()       if i < len(size_list)       else ""
-            hinban   = hinban_list[i].strip()     if i < len(hinban_list)     else ""
-            uedai    = uedai_list[i].strip()      if i < len(uedai_list)      else ""
-            gedai    = gedai_list[i].strip()      if i < len(gedai_list)      else ""
-            wakishi  = wakishi_list[i].strip()    if i < len(wakishi_list)    else ""
-            chain    = chain_list[i].strip()      if i < len(chain_list)      else ""
-            tekiyo   = tekiyo_list[i].strip()     if i < len(tekiyo_list)     else ""
-            input_usr= input_user_list[i].strip() if i < len(input_user_list) else ""
-            nyuko_dt = nyuko_date_list[i].strip() if i < len(nyuko_date_list) else ""
-            gedai_num= gedai_num_list[i].strip()  if i < len(gedai_num_list)  else ""
-
-            # 完全な空行はスキップ（branch は必ず入っているので他の項目で判定）
-            if not (jigan or item or chuseki or size or hinban or uedai or gedai or input_usr or nyuko_dt):
-                continue
+        # 全拠点フォームと同じ項目（branch は URL の拠点で固定）
+        rows_data = _stock_form_records(request.form, fixed_base=base_name)
+        per_base, errors = run_stock_intake(enumerate(rows_data, 1), base_name)
 
-            # 必須項目チェック（脇石 / チェーン長 / 摘要 以外）
-            required = {
-                "地金": jigan,
-                "アイテム": item,
-                "中石": chuseki,
-                "サイズ": size,
-                "品番": hinban,
-                "上代": uedai,
-                "暗号化下代": gedai,
-                "入力者": input_usr,
-            }
-            missing = [name for name, val in required.items() if not val]
-            if missing:
-                error = "必須項目が不足しています。"
-                break
-
-            # 入庫日：空なら今日。フォーマットを YYYY/MM/DD に変換
-            if not nyuko_dt:
-                nyuko_dt = today_str_dash
-            try:
-                d = datetime.datetime.strptime(nyuko_dt, "%Y-%m-%d")
-                nyuko_dt = d.strftime("%Y/%m/%d")
-            except ValueError:
-                nyuko_dt = nyuko_dt.replace("-", "/")
-
-            # 中石=ダイヤ のとき、サイズの数値 >=1 を CT 表記に変換
-            size_for_store = size
-            if chuseki == "ダイヤ" and re.fullmatch(r"[0-9]+(\.[0-9]+)?", size):
-                val = float(size)
-                if val == 1:
-                    size_for_store = "CT"
-                elif val > 1:
-                    size_for_store = f"{val:g}CT"
-
-            wakishi_clean = normalize_ct(wakishi)
-            chain_clean   = normalize_cm(chain)
-
-            row = [
-                "",             # No.
-                "",             # 出庫
-                jigan,
-                item,
-                chuseki,
-                size_for_store,
-                hinban,
-                uedai,
-                gedai,
-                wakishi_clean,
-                chain_clean,
-                tekiyo,
-                input_usr,
-                nyuko_dt,
-                gedai_num,
-            ]
-
-            per_base_rows[branch].append(row)
-            append_log(row, "入庫", branch)
-            rows_added += 1
-
-            # ★GAS: 送信用データもここで1行分作る
-            if not payload_user and input_usr:
-                payload_user = input_usr
-
-            rows_to_send.append({
-                "no": "",                     # No. はシート側で採番するなら空でOK
-                "metal": jigan,
-                "item": item,
-                "center_stone": chuseki,
-                "size": size_for_store,
-                "product_code": hinban,
-                "price": uedai,
-                "cost": gedai,
-                "side_stone": wakishi_clean,
-                "chain_length": chain_clean,
-                "note": tekiyo,
-                "stock_date": nyuko_dt,
-                "cost_numeric": gedai_num,
-            })
-
-        if error:
+        if errors:
+            error = _stock_form_error(errors)
             flash(error, "error")
-            return render_template(
-                "add_stock.html",
-                base_names=BASE_NAMES,
-                rows_data=rows_data,
-                error=error,
-                success=None,
-                fixed_base=base_name,   # ★ テンプレ側で「拠点固定」に使う
-            )
+            return _render_stock_form(rows_data, base_name, error)
 
-        if rows_added == 0:
+        if not per_base:
             flash("入庫対象の行がありませんでした。", "error")
-            return render_template(
-                "add_stock.html",
-                base_names=BASE_NAMES,
-                rows_data=rows_data,
-                error=None,
-                success=None,
-                fixed_base=base_name,
-            )
-
-        # --- 並べ替え（単一拠点のみ） ---
-        ITEM_ORDER = ["リング", "ペンダント", "バチカン", "チェーン", "その他"]
-        ITEM_RANK = {name: idx for idx, name in enumerate(ITEM_ORDER)}
-
-        JIGAN_ORDER = [
-            "Pt900",
-            "Pt850",
-            "K18",
-            "SV900(Pt)",
-            "Pt900/K18",
-            "Pt900/K18/K18WG",
-            "Pt900/K18/K18PG",
-            "K18WG",
-            "K18PG",
-        ]
-        JIGAN_RANK = {name: idx for idx, name in enumerate(JIGAN_ORDER)}
-
-        CHU_SEKI_ORDER = ["ダイヤ", "オーバル", "パール", "スクエア", "Free", "チェーン"]
-        CHU_SEKI_RANK = {name: idx for idx, name in enumerate(CHU_SEKI_ORDER)}
-
-        def item_rank(val):
-            return ITEM_RANK.get(val, len(ITEM_ORDER))
-
-        def jigan_rank(val):
-            return JIGAN_RANK.get(val, len(JIGAN_ORDER))
-
-        def chuseki_rank(val):
-            return CHU_SEKI_RANK.get(val, len(CHU_SEKI_ORDER))
-
-        def parse_size_for_sort(s):
-            if s is None:
-                return 0.0
-            t = str(s).strip()
-            if not t:
-                return 0.0
-            upper = t.upper()
-            if "CT" in upper:
-                m = re.search(r"([0-9]+(\.[0-9]+)?)", upper)
-                if m:
-                    return float(m.group(1))
-                return 1.0
-            try:
-                return float(t)
-            except ValueError:
-                return 0.0
-
-        def parse_price(s):
-            t = str(s).replace(",", "").strip()
-            try:
-                return float(t)
-            except:
-                return 0.0
-
-        def sort_rows(rows):
-            return sorted(
-                rows,
-                key=lambda r: (
-                    item_rank(r[3]),
-                    jigan_rank(r[2]),
-                    chuseki_rank(r[4]),
-                    parse_size_for_sort(r[5]),
-                    str(r[6]),
-                    parse_price(r[7]),
-                )
-            )
-
-        rows_sorted = sort_rows(per_base_rows[base_name])
-        save_inventory(base_name, rows_sorted)
-
-        # ★GAS: 行があれば送信（失敗してもアプリはそのまま）
-        if rows_to_send:
-            payload = {
-                "action": "add_stock",
-                "base": base_name,
-                "user": payload_user or "",
-                "rows": rows_to_send,
-            }
-            send_inventory_to_gas(payload)
+            return _render_stock_form(rows_data, base_name)
 
+        rows_added = len(per_base[base_name])
         flash(f"{rows_added} 件を {base_name} に入庫しました", "success")
         return redirect(url_for("add_stock_for_base", base_slug=base_slug))
 
     # GET（初回表示）: 全行 branch は固定拠点名で埋める
-    ROW_COUNT = 20
-    rows_data = []
-    for _ in range(ROW_COUNT):
-        rows_data.append({
-            "branch": base_name, "jigan": "", "item": "", "chuseki": "",
-            "size": "", "hinban": "", "uedai": "", "gedai": "",
-            "wakishi": "", "chain_len": "", "tekiyo": "",
-            "input_user": "", "nyuko_date": "", "gedai_numeric": ""
-        })
-
-    return render_template(
-        "add_stock.html",
-        base_names=BASE_NAMES,
-        rows_data=rows_data,
-        error=None,
-        success=None,
-        fixed_base=base_name,
-    )
+    return _render_stock_form(_empty_stock_form(base_name), base_name)
 
 
 
@@ -929,324 +1342,195 @@ def add_stock_for_base(base_slug):
 def add_stock():
     """
     全拠点共通の入庫フォーム（最大20行）。
-    （元の処理そのまま：拠点選択あり）
+    （拠点選択あり）
     """
-    error = None
-    success = None
-    ROW_COUNT = 20
-
     if request.method == "POST":
-        branches        = request.form.getlist("branch[]")
-        jigan_list      = request.form.getlist("jigan[]")
-        item_list       = request.form.getlist("item[]")
-        chuseki_list    = request.form.getlist("chuseki[]")
-        size_list       = request.form.getlist("size[]")
-        hinban_list     = request.form.getlist("hinban[]")
-        uedai_list      = request.form.getlist("uedai[]")
-        gedai_list      = request.form.getlist("gedai[]")
-        wakishi_list    = request.form.getlist("wakishi[]")
-        chain_list      = request.form.getlist("chain_len[]")
-        tekiyo_list     = request.form.getlist("tekiyo[]")
-        input_user_list = request.form.getlist("input_user[]")
-        nyuko_date_list = request.form.getlist("nyuko_date[]")
-        gedai_num_list  = request.form.getlist("gedai_numeric[]")
-
-        # --- 今回の入力内容を rows_data にまとめる（エラー時に再表示用） ---
-        rows_data = []
-        max_len = max(
-            len(branches),
-            len(jigan_list),
-            len(item_list),
-            len(chuseki_list),
-            len(size_list),
-            len(hinban_list),
-            len(uedai_list),
-            len(gedai_list),
-            len(wakishi_list),
-            len(chain_list),
-            len(tekiyo_list),
-            len(input_user_list),
-            len(nyuko_date_list),
-            len(gedai_num_list),
-            ROW_COUNT
-        )
-        for i in range(max_len):
-            rows_data.append({
-                "branch":        branches[i]        if i < len(branches)        else "",
-                "jigan":         jigan_list[i]      if i < len(jigan_list)      else "",
-                "item":          item_list[i]       if i < len(item_list)       else "",
-                "chuseki":       chuseki_list[i]    if i < len(chuseki_list)    else "",
-                "size":          size_list[i]       if i < len(size_list)       else "",
-                "hinban":        hinban_list[i]     if i < len(hinban_list)     else "",
-                "uedai":         uedai_list[i]      if i < len(uedai_list)      else "",
-                "gedai":         gedai_list[i]      if i < len(gedai_list)      else "",
-                "wakishi":       wakishi_list[i]    if i < len(wakishi_list)    else "",
-                "chain_len":     chain_list[i]      if i < len(chain_list)      else "",
-                "tekiyo":        tekiyo_list[i]     if i < len(tekiyo_list)     else "",
-                "input_user":    input_user_list[i] if i < len(input_user_list) else "",
-                "nyuko_date":    nyuko_date_list[i] if i < len(nyuko_date_list) else "",
-                "gedai_numeric": gedai_num_list[i]  if i < len(gedai_num_list)  else "",
-            })
-        if len(rows_data) < ROW_COUNT:
-            for _ in range(ROW_COUNT - len(rows_data)):
-                rows_data.append({
-                    "branch": "", "jigan": "", "item": "", "chuseki": "",
-                    "size": "", "hinban": "", "uedai": "", "gedai": "",
-                    "wakishi": "", "chain_len": "", "tekiyo": "",
-                    "input_user": "", "nyuko_date": "", "gedai_numeric": ""
-                })
-
-        # 在庫読み込み
-        per_base_rows = {base: load_inventory(base) for base in BASE_NAMES}
-        today_str_dash = datetime.date.today().strftime("%Y-%m-%d")
-
-        # 単位正規化用：脇石(ct) / チェーン長(cm)
-        def normalize_ct(s: str) -> str:
-            """脇石用：単位を ct に統一する"""
-            s = s.strip()
-            if not s:
-                return ""
-            lower = s.lower()
-            # すでに ct 系が入っていれば表記だけ揃える → "ct"
-            if "ct" in lower or "ｃｔ" in lower:
-                s2 = re.sub(r"[ｃcＣC][ｔtＴT]", "ct", s, flags=re.IGNORECASE)
-                return s2
-            # 数値だけなら "◯ct" を付与（例: "1.5" → "1.5ct"）
-            if re.fullmatch(r"[0-9]+(\.[0-9]+)?", s):
-                return f"{s}ct"
-            return s
-
-        def normalize_cm(s: str) -> str:
-            s = s.strip()
-            if not s:
-                return ""
-            # 各種 cm 表記を "cm" に揃える
-            s2 = re.sub(r"[cｃＣ][mｍＭ]|㎝", "cm", s, flags=re.IGNORECASE)
-            lower = s2.lower()
-            if "cm" in lower:
-                return s2
-            # 数値だけなら "◯cm" を付与
-            if re.fullmatch(r"[0-9]+(\.[0-9]+)?", s2):
-                return f"{s2}cm"
-            return s2
-
-        rows_added = 0  # 何件入庫したかカウント
-
-        # --- 登録処理 & バリデーション ---
-        for i in range(ROW_COUNT):
-            branch   = branches[i].strip()        if i < len(branches)        else ""
-            jigan    = jigan_list[i].strip()      if i < len(jigan_list)      else ""
-            item     = item_list[i].strip()       if i < len(item_list)       else ""
-            chuseki  = chuseki_list[i].strip()    if i < len(chuseki_list)    else ""
-            size     = size_list[i].strip()       if i < len(size_list)       else ""
-            hinban   = hinban_list[i].strip()     if i < len(hinban_list)     else ""
-            uedai    = uedai_list[i].strip()      if i < len(uedai_list)      else ""
-            gedai    = gedai_list[i].strip()      if i < len(gedai_list)      else ""
-            wakishi  = wakishi_list[i].strip()    if i < len(wakishi_list)    else ""
-            chain    = chain_list[i].strip()      if i < len(chain_list)      else ""
-            tekiyo   = tekiyo_list[i].strip()     if i < len(tekiyo_list)     else ""
-            input_usr= input_user_list[i].strip() if i < len(input_user_list) else ""
-            nyuko_dt = nyuko_date_list[i].strip() if i < len(nyuko_date_list) else ""
-            gedai_num= gedai_num_list[i].strip()  if i < len(gedai_num_list)  else ""
-
-            # 完全な空行はスキップ
-            if not (branch or jigan or item or chuseki or size or hinban or uedai or gedai or input_usr or nyuko_dt):
-                continue
+        # --- 今回の入力内容（エラー時にはそのまま再表示する） ---
+        rows_data = _stock_form_records(request.form)
+        per_base, errors = run_stock_intake(enumerate(rows_data, 1))
 
-            # 拠点チェック
-            if branch not in BASE_NAMES:
-                error = f"{i+1}行目：拠点が正しく選択されていません。"
-                break
-
-            # 必須項目チェック（脇石 / チェーン長 / 摘要 以外）
-            required = {
-                "地金": jigan,
-                "アイテム": item,
-                "中石": chuseki,
-                "サイズ": size,
-                "品番": hinban,
-                "上代": uedai,
-                "暗号化下代": gedai,
-                "入力者": input_usr,
-            }
-            missing = [name for name, val in required.items() if not val]
-            if missing:
-                error = "必須項目が不足しています。"
-                break
-
-            # 入庫日：空なら今日。フォーマットを YYYY/MM/DD に変換
-            if not nyuko_dt:
-                nyuko_dt = today_str_dash
-            try:
-                d = datetime.datetime.strptime(nyuko_dt, "%Y-%m-%d")
-                nyuko_dt = d.strftime("%Y/%m/%d")
-            except ValueError:
-                nyuko_dt = nyuko_dt.replace("-", "/")
-
-            # ★ 中石=ダイヤ のとき、サイズの数値 >=1 を CT 表記に変換
-            size_for_store = size
-            if chuseki == "ダイヤ" and re.fullmatch(r"[0-9]+(\.[0-9]+)?", size):
-                val = float(size)
-                if val == 1:
-                    size_for_store = "CT"
-                elif val > 1:
-                    # 1.0 → "1CT", 1.5 → "1.5CT"
-                    size_for_store = f"{val:g}CT"
-                # 1未満(0.9など)はそのまま size_for_store = size
-
-            # 脇石 / チェーン長 の単位を整える
-            wakishi_clean = normalize_ct(wakishi)
-            chain_clean   = normalize_cm(chain)
-
-            # 在庫CSV 1行分（HEADERS 準拠）
-            row = [
-                "",             # No.
-                "",             # 出庫
-                jigan,
-                item,
-                chuseki,
-                size_for_store,
-                hinban,
-                uedai,
-                gedai,          # 暗号化下代
-                wakishi_clean,
-                chain_clean,
-                tekiyo,
-                input_usr,
-                nyuko_dt,
-                gedai_num,
-            ]
-
-            per_base_rows[branch].append(row)
-            append_log(row, "入庫", branch)
-            rows_added += 1
-
-        # --- ここから結果判定＆レスポンス ---
-
-        if error:
+        if errors:
             # エラー時：flash して入力を保持したまま再表示
+            error = _stock_form_error(errors)
             flash(error, "error")
-            return render_template(
-                "add_stock.html",
-                base_names=BASE_NAMES,
-                rows_data=rows_data,
-                error=error,
-                success=None
-            )
+            return _render_stock_form(rows_data, error=error)
 
-        if rows_added == 0:
+        if not per_base:
             # 1件も有効行がなかった場合
             flash("入庫対象の行がありませんでした。", "error")
-            return render_template(
-                "add_stock.html",
-                base_names=BASE_NAMES,
-                rows_data=rows_data,
-                error=None,
-                success=None
-            )
+            return _render_stock_form(rows_data)
 
-        # --- 並べ替え（カスタムルール）---
-
-        ITEM_ORDER = ["リング", "ペンダント", "バチカン", "チェーン", "その他"]
-        ITEM_RANK = {name: idx for idx, name in enumerate(ITEM_ORDER)}
-
-        JIGAN_ORDER = [
-            "Pt900",
-            "Pt850",
-            "K18",
-            "SV900(Pt)",
-            "Pt900/K18",
-            "Pt900/K18/K18WG",
-            "Pt900/K18/K18PG",
-            "K18WG",
-            "K18PG",
-        ]
-        JIGAN_RANK = {name: idx for idx, name in enumerate(JIGAN_ORDER)}
-
-        CHU_SEKI_ORDER = ["ダイヤ", "オーバル", "パール", "スクエア", "Free", "チェーン"]
-        CHU_SEKI_RANK = {name: idx for idx, name in enumerate(CHU_SEKI_ORDER)}
-
-        def item_rank(val):
-            return ITEM_RANK.get(val, len(ITEM_ORDER))
-
-        def jigan_rank(val):
-            return JIGAN_RANK.get(val, len(JIGAN_ORDER))
-
-        def chuseki_rank(val):
-            return CHU_SEKI_RANK.get(val, len(CHU_SEKI_ORDER))
-
-        def parse_size_for_sort(s):
-            """サイズ（数値・CTを数値化）"""
-            if s is None:
-                return 0.0
-            t = str(s).strip()
-            if not t:
-                return 0.0
-            upper = t.upper()
-
-            if "CT" in upper:
-                m = re.search(r"([0-9]+(\.[0-9]+)?)", upper)
-                if m:
-                    return float(m.group(1))
-                return 1.0
-            try:
-                return float(t)
-            except ValueError:
-                return 0.0
-
-        def parse_price(s):
-            t = str(s).replace(",", "").strip()
-            try:
-                return float(t)
-            except:
-                return 0.0
-
-        def sort_rows(rows):
-            """最終ソートキー"""
-            return sorted(
-                rows,
-                key=lambda r: (
-                    item_rank(r[3]),             # アイテム
-                    jigan_rank(r[2]),            # 地金
-                    chuseki_rank(r[4]),          # 中石
-                    parse_size_for_sort(r[5]),   # サイズ
-                    str(r[6]),                   # 品番
-                    parse_price(r[7]),           # 上代
-                )
-            )
-
-        for base, rows in per_base_rows.items():
-            rows_sorted = sort_rows(rows)
-            save_inventory(base, rows_sorted)
-
-        # ★ 成功メッセージ（rows_added を使う！）
+        rows_added = sum(len(rows) for rows in per_base.values())
         flash(f"{rows_added} 件を入庫しました", "success")
         return redirect(url_for("add_stock"))
 
     # GET（初回表示）
-    ROW_COUNT = 20
-    rows_data = []
-    for _ in range(ROW_COUNT):
-        rows_data.append({
-            "branch": "", "jigan": "", "item": "", "chuseki": "",
-            "size": "", "hinban": "", "uedai": "", "gedai": "",
-            "wakishi": "", "chain_len": "", "tekiyo": "",
-            "input_user": "", "nyuko_date": "", "gedai_numeric": ""
-        })
+    return _render_stock_form(_empty_stock_form())
+
+
+@app.route("/api/intake", methods=["POST"])
+def api_intake():
+    """
+    入庫の JSON API（検品端末・取り込みスクリプト用）
+    リクエスト: {"base": "kobe"（省略可）, "rows": [{"jigan": ..., "item": ..., "branch": "神戸"（省略可）}, ...]}
+      行の項目名は入庫フォームと同じ（STOCK_FIELDS）。拠点は行の branch、無ければ base
+    レスポンス: {"ok": true, "count": 件数, "ids": {拠点名: [在庫 ID, ...]}}
+      エラーがあれば 400 で {"ok": false, "errors": [...]}（1件も入庫しない）
+    """
+    data = request.get_json(silent=True) or {}
+    rows = data.get("rows")
+    if not isinstance(rows, list) or not rows or not all(isinstance(r, dict) for r in rows):
+        return jsonify({"ok": False, "errors": ["rows をオブジェクトの配列で指定してください"]}), 400
+    default_base = None
+    if data.get("base"):
+        default_base = get_base_name_from_slug(data["base"])
+        if not default_base:
+            return jsonify({"ok": False, "errors": ["拠点が見つかりません"]}), 404
+
+    per_base, errors = run_stock_intake(enumerate(rows, 1), default_base)
+    if errors or not per_base:
+        return jsonify({"ok": False, "errors": errors or ["入庫対象の行がありませんでした。"]}), 400
+    return jsonify({
+        "ok": True,
+        "count": sum(len(r) for r in per_base.values()),
+        "ids": {base: [r[ID_COL] for r in new_rows] for base, new_rows in per_base.items()},
+    })
+
+
+# === 入庫の一括取り込み（CSV / XLSX） ===
+# 見出し行の名前 → 入庫の入力項目（見出しは NFKC で全角/半角をそろえて比べる）
+IMPORT_COLUMNS = {
+    "拠点": "branch",
+    "地金": "jigan",
+    "アイテム": "item",
+    "中石": "chuseki",
+    "サイズ": "size",
+    "品番": "hinban",
+    "上代": "uedai",
+    "下代": "gedai",
+    "暗号化下代": "gedai",
+    "脇石": "wakishi",
+    "チェーン長": "chain_len",
+    "摘要": "tekiyo",
+    "入力者": "input_user",
+    "入庫日": "nyuko_date",
+    "下代（数値）": "gedai_numeric",
+}
+_IMPORT_HEADER_MAP = {unicodedata.normalize("NFKC", k): v for k, v in IMPORT_COLUMNS.items()}
+_IMPORT_HEADER_MAP.update({f: f for f in intake.STOCK_FIELDS + ["branch"]})
+
+
+def _is_xlsx_upload(file):
+    return (file.filename or "").lower().endswith(".xlsx")
+
+
+def _iter_upload_rows(file):
+    """アップロードされた CSV / XLSX を1行ずつ読む（CSV は UTF-8(BOM可) か Shift_JIS）"""
+    if _is_xlsx_upload(file):
+        yield from xlsx_reader.iter_rows(file.stream)
+        return
+
+    stream = file.stream
+    head = stream.read(65536)
+    stream.seek(0)
+    try:
+        head.decode("utf-8")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError as e:
+        # 先頭 64KB の切れ目で文字が割れただけなら UTF-8
+        encoding = "utf-8-sig" if e.start >= len(head) - 3 else "cp932"
+    text = io.TextIOWrapper(stream, encoding=encoding, newline="")
+    try:
+        yield from csv.reader(text)
+    finally:
+        text.detach()
+
+
+def _import_records(rows, errors, serial_dates=False):
+    """
+    取り込むファイルの行 → (行番号, 入力の dict)
+    1行目（空行を除く）が見出し。見出しの問題は errors に足して止める
+    serial_dates: XLSX の行（入庫日が日付セルならシリアル値なので日付に直す。CSV の数字はそのまま）
+    """
+    columns = None
+    for line_no, row in enumerate(rows, 1):
+        if not any(str(v).strip() for v in row):
+            continue
+        if columns is None:
+            columns = [_IMPORT_HEADER_MAP.get(unicodedata.normalize("NFKC", str(h)).strip()) for h in row]
+            if "hinban" not in columns:
+                errors.append(f"{line_no}行目：見出し行に「品番」が見つかりません。")
+                return
+            continue
+
+        values = {}
+        for field, v in zip(columns, row):
+            if field:
+                values[field] = str(v).strip()
+
+        if serial_dates:
+            # XLSX の日付セル（シリアル値）
+            d = xlsx_reader.excel_serial_to_date(values.get("nyuko_date"))
+            if d is not None:
+                values["nyuko_date"] = d.strftime("%Y-%m-%d")
+        yield line_no, values
+
+    if columns is None:
+        errors.append("ファイルにデータがありません。")
+
+
+def parse_stock_import(rows, default_base=None, today=None, serial_dates=False):
+    """
+    取り込むファイルの行 → 拠点ごとの在庫行
+    拠点列が無い・空の行は default_base に入れる。serial_dates は XLSX から読んだ行のとき True。
+    全行を検証してから返すので、エラーは1回でまとめてわかる。
+    戻り値: ({拠点名: [在庫行]}, [エラーメッセージ])
+    """
+    header_errors = []
+    per_base, errors = intake.validate_batch(
+        _import_records(rows, header_errors, serial_dates), all_base_names(), default_base, today
+    )
+    return per_base, header_errors + errors
+
+
+@app.route("/import_stock", methods=["GET", "POST"])
+def import_stock():
+    """入庫の一括取り込み（見出しつきの CSV / XLSX。見出しは在庫表と同じ名前）"""
+    errors = []
+    default_base = request.values.get("base", "")
+
+    if request.method == "POST":
+        file = request.files.get("file")
+        if not file or not file.filename:
+            errors = ["ファイルを選んでください。"]
+        else:
+            try:
+                per_base, errors = parse_stock_import(
+                    _iter_upload_rows(file), default_base or None, serial_dates=_is_xlsx_upload(file))
+            except (csv.Error, ValueError) as e:
+                per_base, errors = {}, [f"ファイルを読み込めませんでした（{e}）"]
+            if not errors and not per_base:
+                errors = ["入庫対象の行がありませんでした。"]
+            if not errors:
+                count = commit_stock_intake(per_base)
+                detail = "、".join(f"{b} {len(r)}件" for b, r in per_base.items())
+                flash(f"{count} 件を入庫しました（{detail}）", "success")
+                return redirect(url_for("import_stock", base=default_base or None))
 
     return render_template(
-        "add_stock.html",
-        base_names=BASE_NAMES,
-        rows_data=rows_data,
-        error=None,
-        success=None
+        "import_stock.html",
+        base_names=base_names(),
+        default_base=default_base,
+        columns=list(IMPORT_COLUMNS),
+        errors=errors,
     )
 
 
 @app.route("/log_in")
 def log_in():
-    # "入庫" の行だけを新しい順で取得
-    rows = load_log_rows("入庫")
+    # "入庫" の行だけを新しい順で、1ページ分だけ取得
+    page = request.args.get("page", 1, type=int)
+    _, rows, pager = load_log_page("入庫", page)
 
     # テンプレ側で LOG_HEADERS から不要列を隠す
     return render_template(
@@ -1254,6 +1538,7 @@ def log_in():
         title="入庫ログ",
         headers=LOG_HEADERS,
         rows=rows,
+        pager=pager,
     )
 
 
@@ -1264,65 +1549,32 @@ def log_out():
         row_indices = request.form.getlist("row_index[]")
         memos       = request.form.getlist("memo[]")
 
-        if os.path.exists(LOG_FILE):
-            with open(LOG_FILE, newline="", encoding="utf-8") as f:
-                all_rows = list(csv.reader(f))
-
-            # 「メモ」列のインデックスを取得
+        updates = {}
+        for idx_str, memo in zip(row_indices, memos):
+            if not idx_str:
+                continue
             try:
-                memo_col = LOG_HEADERS.index("メモ")
+                key = STORAGE.parse_log_key(idx_str)
             except ValueError:
-                memo_col = None
-
-            if memo_col is not None:
-                for idx_str, memo in zip(row_indices, memos):
-                    if not idx_str:
-                        continue
-                    try:
-                        i = int(idx_str)
-                    except ValueError:
-                        continue
-
-                    if i < 0 or i >= len(all_rows):
-                        continue
-
-                    row = all_rows[i]
-
-                    # 行の長さが足りなければ埋めておく
-                    if len(row) < len(LOG_HEADERS):
-                        row = row + [""] * (len(LOG_HEADERS) - len(row))
-
-                    row[memo_col] = memo
-                    all_rows[i] = row
-
-                # ログを書き戻す
-                with open(LOG_FILE, "w", newline="", encoding="utf-8") as f:
-                    writer = csv.writer(f)
-                    writer.writerows(all_rows)
-
-        # 保存後は再読み込み
-        return redirect(url_for("log_out"))
-
-    # GET: 出庫ログを読み込み
-    display_rows = []
-    row_indices  = []
-
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, newline="", encoding="utf-8") as f:
-            all_rows = list(csv.reader(f))
-
-        # 先頭がヘッダーならスキップ
-        start_idx = 1 if all_rows and all_rows[0] == LOG_HEADERS else 0
+                continue
+            updates[key] = memo
+        changed = STORAGE.update_log_memos(updates)
+
+        # 変わったメモだけを拠点ごとに変更履歴へ
+        memo_events = defaultdict(list)
+        for key, log_row in changed.items():
+            memo_events[log_row[LOG_BASE_COL]].append(
+                changefeed.memo_event(key, log_row[LOG_ID_COL], log_row[LOG_MEMO_COL])
+            )
+        for base, events in memo_events.items():
+            record_changes(base, events)
 
-        for i in range(start_idx, len(all_rows)):
-            row = all_rows[i]
-            if row and row[0] == "出庫":
-                display_rows.append(row)
-                row_indices.append(i)
+        # 保存後は再読み込み（同じページに戻る）
+        return redirect(url_for("log_out", page=request.form.get("page", 1, type=int)))
 
-        # 新しいものを上にするため逆順に
-        display_rows = display_rows[::-1]
-        row_indices  = row_indices[::-1]
+    # GET: 出庫ログを新しい順で1ページ分だけ読み込み
+    page = request.args.get("page", 1, type=int)
+    row_indices, display_rows, pager = load_log_page("出庫", page)
 
     return render_template(
         "log_out.html",
@@ -1330,24 +1582,11 @@ def log_out():
         headers=LOG_HEADERS,
         rows=display_rows,
         row_indices=row_indices,
+        pager=pager,
     )
 
-from flask import request, render_template
-
-@app.route("/print_tags/<base_name>")
-def print_tags(base_name):
-    """拠点別在庫から、指定された No. の行だけ値札を作って表示"""
-
-    tag_type = request.args.get("type", "proper")  # 'proper' or 'event'
-    nos_param = request.args.get("nos", "")        # "1001,1002,1003" みたいな文字列
-
-    if not nos_param:
-        return "値札対象の行が指定されていません。", 400
-
-    target_nos = set(nos_param.split(","))
-
-    # いつも使っている在庫読み込み関数
-    rows = load_inventory(base_name)
+def _build_tags(selected, tag_type):
+    """在庫行のリストから値札データを作る"""
 
     # CSV構成（拠点在庫）の想定：
     # [0] No.
@@ -1359,24 +1598,17 @@ def print_tags(base_name):
     # [9] 脇石（ct 表示用）
     # [14] 下代（数値） …あれば使う
 
-    def to_int(val):
-        try:
-            return int(str(val).replace(",", ""))
-        except Exception:
-            return 0
-
-    selected = [row for row in rows if str(row[0]) in target_nos]
-
     tags = []
     for row in selected:
-        metal     = row[2]
-        size_code = row[5]
-        item_code = row[6]
-        price_code = row[8]          # 暗号化下代
-        ct_text   = row[9] or ""
+        rec = records.ensure(row)   # InventoryRecord でもスナップショットの行でも列位置で読む
+        metal     = rec[2]
+        size_code = rec[5]
+        item_code = rec[6]
+        price_code = rec[8]          # 暗号化下代
+        ct_text   = rec[9] or ""
 
         # 上代から税込/税抜きの表示価格を作る（ここはお好みで調整してOK）
-        price_incl_num = to_int(row[7])          # 税込上代（仮）
+        price_incl_num = rec.uedai_int           # 税込上代（仮）
         price_excl_num = int(round(price_incl_num / 1.1)) if price_incl_num else 0
 
         base_tag = {
@@ -1400,12 +1632,264 @@ def print_tags(base_name):
                 "price_tax_incl": f"{price_incl_num:,}" if price_incl_num else "",
                 "price_tax_excl": f"{price_excl_num:,}" if price_excl_num else "",
             })
+    return tags
+
+
+@app.route("/print_tags/<base_name>")
+def print_tags(base_name):
+    """拠点別在庫から、指定された在庫 ID の行だけ値札を作って表示"""
+
+    tag_type = request.args.get("type", "proper")  # 'proper' or 'event'
+    ids_param = request.args.get("ids", "")        # "S0001001,S0001002" みたいな文字列
+    nos_param = request.args.get("nos", "")        # 旧形式（No. 指定）
 
+    if not ids_param and not nos_param:
+        return "値札対象の行が指定されていません。", 400
+
+    if ids_param:
+        # ID → 行位置 の索引で引く（指定順を保つ）
+        rows, id_index = _load_cached(base_name)
+        # （スナップショットのときの id_index は BaseView なので、in・[] ではなく get で引く）
+        positions = (id_index.get(i) for i in ids_param.split(","))
+        selected = [rows[p] for p in positions if p is not None]
+    else:
+        target_nos = set(nos_param.split(","))
+        rows = load_inventory(base_name)
+        selected = [row for row in rows if str(row[0]) in target_nos]
+
+    tags = _build_tags(selected, tag_type)
+    if not tags:
+        return "値札対象がありません。", 400
+
+    return render_template("price_tags.html", tags=tags)
+
+
+@app.route("/print_tags_all")
+def print_tags_all():
+    """全拠点の在庫一覧から、指定された在庫 ID の行だけ値札を作って表示"""
+
+    tag_type = request.args.get("type", "proper")
+    ids_param = request.args.get("ids", "")
+    if not ids_param:
+        return "値札対象の行が指定されていません。", 400
+
+    selected = []
+    for item_id in ids_param.split(","):
+        _, row = find_item(item_id)
+        if row is not None:
+            selected.append(row)
+
+    tags = _build_tags(selected, tag_type)
     if not tags:
         return "値札対象がありません。", 400
 
     return render_template("price_tags.html", tags=tags)
 
+# === エクスポート（CSV / TSV / XLSX） ===
+# 行をまとめて溜めず、少しずつ書き出して送る（何年分のログでもメモリは一定）
+EXPORT_CHUNK_ROWS = 500
+
+# XLSX では数値セルにする列
+_XLSX_NUMERIC_HEADERS = ("上代", "下代", "下代（数値）")
+_NUMBER_RE = re.compile(r"^-?\d{1,3}(,\d{3})*$|^-?\d+$")
+
+
+def _export_stream(header, rows, delimiter, bom):
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=delimiter, lineterminator="\r\n")
+    if bom:
+        buf.write("\ufeff")  # Excel で文字化けしないように
+    writer.writerow(header)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def _xlsx_rows(header, rows):
+    """金額の列（"120,000" など）を数値にする"""
+    cols = [i for i, h in enumerate(header) if h in _XLSX_NUMERIC_HEADERS]
+    for row in rows:
+        row = list(row)
+        for i in cols:
+            if i < len(row) and _NUMBER_RE.match(row[i].strip()):
+                row[i] = _to_int(row[i])
+        yield row
+
+
+def _summary_sheet_rows(rows):
+    """summarize_inventory のアイテム別集計をシートの行にする"""
+    summary, totals = summarize_inventory(rows)
+    for c in ("リング", "ペンダント", "チェーン", "その他"):
+        yield [c, summary[c]["count"], _to_int(summary[c]["上代"]), _to_int(summary[c]["下代"])]
+    yield ["合計", totals["count"], _to_int(totals["上代"]), _to_int(totals["下代"])]
+
+
+def _export_response(name, header, rows, sheet_title="データ", extra_sheets=()):
+    """
+    ?format=csv|tsv|xlsx（既定 csv）、?bom=1 で BOM つき（csv/tsv）
+    extra_sheets: XLSX のときに後ろに足すシート [(シート名, 見出し, 行)]
+    """
+    fmt = request.args.get("format")
+    if fmt not in ("tsv", "xlsx"):
+        fmt = "csv"
+    filename = f"{name}_{date.today().strftime('%Y%m%d')}.{fmt}"
+    if fmt == "xlsx":
+        sheets = [(sheet_title, header, _xlsx_rows(header, rows))] + list(extra_sheets)
+        body = xlsx_writer.iter_xlsx(sheets)
+        mimetype = xlsx_writer.XLSX_MIMETYPE
+    else:
+        bom = request.args.get("bom") == "1"
+        body = _export_stream(header, rows, "\t" if fmt == "tsv" else ",", bom)
+        mimetype = "text/tab-separated-values" if fmt == "tsv" else "text/csv"
+    resp = Response(stream_with_context(body), mimetype=mimetype)
+    resp.headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(filename)}"
+    return resp
+
+
+@app.route("/export/inventory")
+@app.route("/export/inventory/<base_slug>")
+def export_inventory(base_slug=None):
+    """在庫のエクスポート（一覧と同じ絞り込み・並べ替えのクエリが使える。ページ分けはしない）"""
+    if base_slug is None:
+        bases, name, header = base_names(), "inventory_all", ["拠点"] + HEADERS
+    else:
+        base_name = get_base_name_from_slug(base_slug)
+        if not base_name:
+            return "拠点が見つかりません", 404
+        bases, name, header = [base_name], f"inventory_{base_slug}", HEADERS
+
+    q = query.parse_args(request.args)
+    q["per_page"] = 0
+
+    def entries():
+        # 拠点ごとに絞り込み・並べ替えてから、並びを崩さずにつなぐ（行はキャッシュを参照するだけ）
+        return CROSSBASE.entries(bases, q)
+
+    def rows():
+        for b, r in entries():
+            yield r if base_slug else (b, *r)
+
+    extra = []
+    if base_slug is None:
+        # 全拠点の XLSX にはアイテム別集計のシートを付ける（シートを書く時点で集計する）
+        extra.append(("集計", ["アイテム", "数量", "上代", "下代"],
+                      _summary_sheet_rows(r for _, r in entries())))
+    return _export_response(name, header, rows(), sheet_title="在庫", extra_sheets=extra)
+
+
+@app.route("/export/log")
+def export_log():
+    """
+    ログのエクスポート（古い順）
+    ?mode=入庫|出庫  ?from=2025-01-01&to=2025-12-31（出庫は出庫日、入庫は入庫日で絞り込み）
+    """
+    mode = request.args.get("mode") or None
+    if mode not in (None, "入庫", "出庫"):
+        return "mode は 入庫 か 出庫 を指定してください", 400
+    date_from = request.args.get("from") or None
+    date_to = request.args.get("to") or None
+    rows = (row for _, row in STORAGE.iter_log(mode, date_from, date_to))
+    name = "log" if not mode else f"log_{'in' if mode == '入庫' else 'out'}"
+    return _export_response(name, LOG_HEADERS, rows, sheet_title=f"{mode or '入出庫'}ログ")
+
+
+# === 管理コマンド ===
+@app.cli.command("migrate-sqlite")
+@click.option("--db", default=SQLITE_PATH, show_default=True, help="移行先の SQLite ファイル")
+def migrate_sqlite_command(db):
+    """data/*.csv と data/log/ のログを SQLite に移行する（flask --app app migrate-sqlite）"""
+    src = storage.CsvStorage(DATA_DIR, HEADERS, LOG_HEADERS)
+    dst = storage.SqliteStorage(db)
+    counts = storage.migrate_csv_to_sqlite(src, dst, all_base_names())
+    for name, n in counts.items():
+        click.echo(f"{name}: {n} 件")
+    click.echo(f"移行しました → {db}（STORAGE_BACKEND=sqlite で利用できます）")
+
+
+@app.cli.command("compact-log")
+def compact_log_command():
+    """先月以前のログを gzip に圧縮する（flask --app app compact-log）"""
+    if STORAGE.name != "csv":
+        click.echo("CSV 保存のときだけ使えます")
+        return
+    STORAGE.log.close_old_months()
+    for month, compressed in STORAGE.log.partitions():
+        click.echo(f"{month}: {'圧縮済み' if compressed else '追記中'}")
+
+
+@app.cli.command("gas-reconcile")
+@click.option("--base", "base_slug", default=None, help="拠点のスラッグ（省略時は全拠点）")
+def gas_reconcile_command(base_slug):
+    """GAS のシートと在庫を突き合わせ、違う塊だけ送り直す（flask --app app gas-reconcile）"""
+    bases = [get_base_name_from_slug(base_slug)] if base_slug else base_names()
+    if None in bases:
+        raise click.BadParameter(f"拠点が見つかりません: {base_slug}")
+    for base in bases:
+        diff = reconcile_gas(base)
+        if diff is None:
+            click.echo(f"{base}: 送信待ちがあるか GAS_ENDPOINT_URL が未設定なので見送りました")
+        else:
+            click.echo(f"{base}: {len(diff)} 個の塊を送り直します {' '.join(diff)}")
+    # 送信キューのワーカーはデーモンスレッドなので、ここで送り切る
+    GAS_OUTBOX.deliver_pending()
+
+
+def warm_up():
+    """
+    ワーカーの起動直後に呼ぶ（gunicorn.conf.py の post_fork）
+    最初に開いた人のページが遅くならないよう、在庫（スナップショット）・拠点の集計・検索と品番の索引・
+    ログの索引を読み、テンプレートをコンパイルしておく。
+    スナップショットが古い・無い拠点は、先に来たワーカーだけが読み直して書き、他のワーカーはそれを待って使う
+    """
+    started = time.time()
+    with FileLock(os.path.join(DATA_DIR, ".locks", "warm_up")):
+        for base in base_names():
+            base_totals(base)
+            recs = inventory_records(base)
+            SEARCH_INDEX.update_base(base, _cached_version(base), recs)
+            LOCATE_INDEX.update_base(base, _cached_version(base), recs)
+    STORAGE.read_log_page(None, 0, 1)
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    print(f"[warm_up] pid {os.getpid()}: {time.time() - started:.2f}s")
+
+
+@app.cli.command("snapshot")
+def snapshot_command():
+    """在庫のスナップショット（data/snapshot/）を今の在庫にそろえる（flask --app app snapshot）"""
+    if SNAPSHOT is None:
+        click.echo("INVENTORY_SNAPSHOT=0 なので使っていません")
+        return
+    for base in all_base_names():
+        # 古い拠点・無い拠点だけストレージから読んで書き直される
+        inventory_records(base)
+    status = SNAPSHOT.status()
+    for base, n in status["bases"].items():
+        click.echo(f"{base}: {n} 件")
+    click.echo(f"{len(status['bases'])} 拠点（{status['size']:,} バイト）")
+
+
+@app.cli.command("import-log")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def import_log_command(path):
+    """古いログ CSV（log_old.csv など、列が LOG_HEADERS の先頭と同じ並びのもの）を取り込む"""
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = [
+            (r + [""] * len(LOG_HEADERS))[:len(LOG_HEADERS)]
+            for r in csv.reader(f) if r and r[0] in ("入庫", "出庫")
+        ]
+    if STORAGE.name == "csv":
+        n = STORAGE.log.import_rows(rows)
+    else:
+        STORAGE.append_log(rows)
+        n = len(rows)
+    click.echo(f"{n} 件取り込みました")
+
+
 # === アプリ起動 ===
 if __name__ == "__main__":
     app.run(debug=True)
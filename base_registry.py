@@ -0,0 +1,107 @@
+"""
+拠点の一覧（bases.json）
+
+  {"bases": [
+    {"slug": "kobe", "name": "神戸", "label_entry": "神戸店", "label_inventory": "神戸店", "active": true},
+    ...
+  ]}
+
+  slug            : URL で使う名前（/inventory/kobe）
+  name            : 拠点名（在庫 CSV のファイル名・ログ・シートの拠点名にもなる。後から変えない）
+  label_entry     : 入庫メニューでの表示（省略すると name）
+  label_inventory : 在庫一覧メニューでの表示（省略すると label_entry）
+  active          : false にすると、トップのメニュー・全拠点の一覧・集計・検索・入庫先の選択に出さない
+                    （在庫は消さない。/inventory/<slug> などで直接開くことはできる）
+並び順は一覧・メニュー・全拠点の一覧の拠点の順になる。
+
+ファイルを書き換えれば、再起動しなくても反映される（CHECK_INTERVAL 秒ごとに stat で変更を見る）。
+書き換えたファイルが読めない・おかしいときは、前に読めた一覧を使い続ける。
+"""
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+
+Base = namedtuple("Base", "slug name label_entry label_inventory active")
+
+
+def _parse(data):
+    entries = data.get("bases") if isinstance(data, dict) else None
+    if not isinstance(entries, list):
+        raise ValueError('"bases" のリストがありません')
+    out = []
+    slugs, names = set(), set()
+    for e in entries:
+        slug, name = str(e.get("slug") or "").strip(), str(e.get("name") or "").strip()
+        if not slug or not name:
+            raise ValueError(f"slug と name は必須です: {e}")
+        if "/" in slug or "/" in name or name.startswith("."):
+            raise ValueError(f"slug・name に使えない文字があります: {e}")
+        if slug in slugs or name in names:
+            raise ValueError(f"slug か name が重複しています: {e}")
+        slugs.add(slug)
+        names.add(name)
+        label_entry = e.get("label_entry") or name
+        out.append(Base(slug, name, label_entry, e.get("label_inventory") or label_entry,
+                        bool(e.get("active", True))))
+    return out
+
+
+class BaseRegistry:
+
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stat = None
+        self._checked = 0.0
+        self._bases = []
+        self._by_slug = {}
+        self._by_name = {}
+        self._refresh(force=True)
+        if not self._bases:
+            raise RuntimeError(f"拠点の一覧（{path}）が読めません")
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.CHECK_INTERVAL:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                return
+            stat = (st.st_mtime_ns, st.st_size)
+            if stat == self._stat:
+                return
+            self._stat = stat
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    bases = _parse(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"[bases] {self.path} を読めません（前の一覧を使います）:", e)
+                return
+            self._bases = bases
+            self._by_slug = {b.slug: b for b in bases}
+            self._by_name = {b.name: b for b in bases}
+
+    def all(self):
+        """登録されている拠点すべて（使っていない拠点も）"""
+        self._refresh()
+        return self._bases
+
+    def active(self):
+        self._refresh()
+        return [b for b in self._bases if b.active]
+
+    def by_slug(self, slug):
+        self._refresh()
+        return self._by_slug.get(slug)
+
+    def by_name(self, name):
+        self._refresh()
+        return self._by_name.get(name)
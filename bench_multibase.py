@@ -0,0 +1,168 @@
+"""
+全拠点の一覧・集計（crossbase.py）が拠点の数に対してどう伸びるかを測る
+
+  python bench_multibase.py                      # 6, 12, 25, 50 拠点 × 1万行
+  python bench_multibase.py --bases 6,60 --rows 10000 --processes 4
+
+拠点ごとの在庫を一時ディレクトリに CSV とスナップショットで作り、次を比べる（ミリ秒、repeat 回の最小）。
+  load    : CSV を読んでレコードにする（キャッシュもスナップショットも無い、起動直後の読み込み）
+  page    : 絞り込みなしの1ページ目（集計は拠点の集計を足すだけ）
+  filter  : キーワードで絞り込み＋上代で並べ替えた1ページ目と、該当行の集計
+  export  : 地金で絞り込み＋入庫日で並べ替えた全件
+before は crossbase を使う前のやり方（全拠点の行を1つのリストにして query.run_query・filter_options）。
+serial は1スレッドで拠点を順に、threads はスレッドプール、processes は子プロセスで処理する。
+（threads・processes が速くなるかは CPU の数による。1 CPU では serial と同じか少し遅い）
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+import aggregates
+import crossbase
+import query
+import records
+import snapshot
+
+
+HEADERS = [
+    "No.", "出庫", "地金", "アイテム", "中石", "サイズ", "品番", "上代", "下代",
+    "脇石", "チェーン長", "摘要", "入力者", "入庫日", "下代（数値）", "ID",
+]
+ID_COL = 15
+
+
+def make_rows(rng, base_index, n):
+    rows = []
+    for i in range(n):
+        uedai = rng.choice([38000, 58000, 78000, 98000, 120000, 198000, 298000])
+        rows.append([
+            str(i + 1), "", rng.choice(["Pt900", "Pt850", "K18", "K18WG", "K18PG", "SV900(Pt)"]),
+            rng.choice(["リング", "ペンダント", "チェーン", "ピアス", "ブレスレット"]),
+            rng.choice(["ダイヤ", "ルビー", "サファイア", "エメラルド", ""]),
+            rng.choice(["0.1", "0.2", "0.3", "0.5", "1.0", "#11", "#13"]),
+            f"{rng.choice(['PT', 'KR', 'OPR', 'NX'])}-{rng.randrange(100000)}",
+            f"{uedai:,}", str(uedai // 4), rng.choice(["", "0.05ct", "0.1ct"]),
+            rng.choice(["", "40cm", "45cm"]), rng.choice(["", "", "", "お取り置き", "修理戻り"]),
+            rng.choice(["河野", "藤田", "田中", "u"]),
+            f"20{rng.randrange(20, 26)}/{rng.randrange(1, 13):02d}/{rng.randrange(1, 29):02d}",
+            "", f"S{base_index:03d}{i:06d}",
+        ])
+    return rows
+
+
+def best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t) * 1000)
+    return min(times)
+
+
+def run(n_bases, n_rows, repeat, threads, processes, workdir):
+    rng = random.Random(n_bases)
+    bases = [f"拠点{i:03d}" for i in range(n_bases)]
+    versions = {}
+    snap_path = os.path.join(workdir, f"snapshot_{n_bases}")
+    snap = snapshot.InventorySnapshot(snap_path, HEADERS, ID_COL)
+    updates = {}
+    for i, b in enumerate(bases):
+        if len(updates) == 10:
+            snap.publish(updates)  # 行をまとめて持ちすぎないよう 10 拠点ずつ書く
+            updates = {}
+        rows = make_rows(rng, i, n_rows)
+        path = os.path.join(workdir, f"{b}.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(HEADERS)
+            w.writerows(rows)
+        versions[b] = (n_bases, i)
+        updates[b] = (versions[b], rows)
+    snap.publish(updates)
+    del updates
+
+    def load_csv(b):
+        with open(os.path.join(workdir, f"{b}.csv"), newline="", encoding="utf-8") as f:
+            return records.build(list(csv.reader(f))[1:])
+
+    views = {b: snap.base(b, versions[b]) for b in bases}
+    totals = {b: aggregates.tally(views[b]) for b in bases}
+    snapshot_args = (snap_path, HEADERS, ID_COL)
+    engines = {
+        "serial": crossbase.CrossBaseEngine(views.__getitem__, threads=1),
+        "threads": crossbase.CrossBaseEngine(views.__getitem__, threads=threads),
+    }
+    if processes:
+        engines["processes"] = crossbase.CrossBaseEngine(
+            views.__getitem__, threads=threads, processes=processes, snapshot_args=snapshot_args)
+
+    page_q = query.parse_args({})
+    filter_q = query.parse_args({"q": "pt 0.1", "sort": "uedai", "desc": "1"})
+    export_q = dict(query.parse_args({"jigan": "K18", "sort": "nyuko_date"}), per_page=0)
+
+    def before(q, options=False):
+        entries = [(b, r) for b in bases for r in views[b]]
+        page, matched, _ = query.run_query(entries, q)
+        if query.is_filtered(q):
+            aggregates.tally(r for _, r in matched)
+        else:
+            aggregates.combine(totals[b] for b in bases)
+        if options:
+            query.filter_options(entries)
+        return page
+
+    out = {"load": {}}
+    load_engines = {
+        "serial": crossbase.CrossBaseEngine(load_csv, threads=1),
+        "threads": crossbase.CrossBaseEngine(load_csv, threads=threads),
+    }
+    for name, e in load_engines.items():
+        out["load"][name] = best(lambda: e._map(e.load, bases), 1)
+        e.shutdown()
+
+    out["page"] = {"before": best(lambda: before(page_q, options=True), repeat)}
+    out["filter"] = {"before": best(lambda: before(filter_q), repeat)}
+    out["export"] = {"before": best(lambda: len(before(export_q)), repeat)}
+    for name, e in engines.items():
+        e.run(bases, filter_q, totals.__getitem__)  # プールの起動を測らないように1回目は捨てる
+        out["page"][name] = best(
+            lambda: e.run(bases, page_q, totals.__getitem__, options=query.FILTER_FIELDS), repeat)
+        out["filter"][name] = best(
+            lambda: e.run(bases, filter_q, totals.__getitem__), repeat)
+        out["export"][name] = best(
+            lambda: sum(1 for _ in e.entries(bases, export_q)), repeat)
+        e.shutdown()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--bases", default="6,12,25,50", help="拠点の数（カンマ区切り）")
+    parser.add_argument("--rows", type=int, default=10000, help="1拠点の行数")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="子プロセスの数（0 なら測らない）")
+    args = parser.parse_args()
+
+    print(f"1拠点 {args.rows:,} 行 / threads={args.threads} processes={args.processes} "
+          f"/ CPU {os.cpu_count()} / Python {sys.version.split()[0]}")
+    modes = ("before", "serial", "threads", "processes")
+    print(f"{'拠点':>4} {'行':>9}  {'処理':<7} " + " ".join(f"{m:>10}" for m in modes))
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in (int(x) for x in args.bases.split(",")):
+            result = run(n, args.rows, args.repeat, args.threads, args.processes, workdir)
+            for task, by_mode in result.items():
+                cells = " ".join(
+                    f"{by_mode[m]:>8.0f}ms" if m in by_mode else f"{'-':>10}"
+                    for m in modes
+                )
+                print(f"{n:>4} {n * args.rows:>9,}  {task:<7} {cells}")
+
+
+if __name__ == "__main__":
+    main()
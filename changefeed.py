@@ -0,0 +1,227 @@
+"""
+在庫の変更履歴（拠点ごとの通し番号つき）と、GAS のシートとの突き合わせ用ハッシュ
+
+変更は data/changes/<拠点名>.jsonl に1行1件で追記する。
+  {"seq": 12, "at": "2025/01/31 10:00:00", "op": "add",      "id": "S0000123", "row": [...]}
+  {"seq": 13, "at": ...,                    "op": "checkout", "id": "S0000123"}
+  {"seq": 14, "at": ...,                    "op": "edit",     "id": "S0000124", "set": {"size": "12号"}}
+  {"seq": 15, "at": ...,                    "op": "memo",     "log": "2025-01:7", "id": "S0000100", "memo": "..."}
+seq は拠点ごとに 1 から増えるだけで戻らない（最後の値は <拠点名>.seq に保存。
+.jsonl に追記してから .seq を書くので、間で落ちたときは .jsonl の最後の行の seq から続ける）。
+GAS には seq つきの差分だけを送り、シート側は受け取った最後の seq を覚えておけばよい。
+履歴は KEEP 件を残して古いものから捨てる（それより前からの差分が要るときは突き合わせで直す）。
+
+突き合わせ：在庫 ID の番号で CHUNK 件ずつの塊に分け、塊ごとに行のハッシュを取る。
+シート側のハッシュと違う塊だけを送り直す。
+"""
+import datetime
+import hashlib
+import json
+import os
+
+from durable import FileLock, atomic_write
+from storage import INVENTORY_COLUMNS
+
+
+# シートに送る列（No. は出庫のたびに振り直されるので送らない。在庫 ID が先頭）
+SYNC_COLUMNS = ["item_id"] + [c for c in INVENTORY_COLUMNS if c not in ("no", "shukko", "item_id")]
+_SYNC_INDEX = [INVENTORY_COLUMNS.index(c) for c in SYNC_COLUMNS]
+_ID_INDEX = INVENTORY_COLUMNS.index("item_id")
+
+# 突き合わせの塊の大きさ（在庫 ID の番号で何件ずつか）
+CHUNK = 100
+
+
+def _cell(row, i):
+    return row[i] if i < len(row) else ""
+
+
+def sync_row(row):
+    """在庫行 → シートに送る値のリスト（SYNC_COLUMNS の並び）"""
+    return [_cell(row, i) for i in _SYNC_INDEX]
+
+
+# --- 変更イベント ---
+def add_event(row):
+    return {"op": "add", "id": _cell(row, _ID_INDEX), "row": sync_row(row)}
+
+
+def checkout_event(row):
+    return {"op": "checkout", "id": _cell(row, _ID_INDEX)}
+
+
+def edit_event(old, new):
+    """変わった列だけを持つ編集イベント。何も変わっていなければ None"""
+    changes = {
+        name: _cell(new, i)
+        for name, i in zip(SYNC_COLUMNS, _SYNC_INDEX)
+        if _cell(old, i) != _cell(new, i)
+    }
+    if not changes:
+        return None
+    return {"op": "edit", "id": _cell(new, _ID_INDEX), "set": changes}
+
+
+def memo_event(log_key, item_id, memo):
+    return {"op": "memo", "log": str(log_key), "id": item_id, "memo": memo}
+
+
+# --- 突き合わせ用のハッシュ ---
+def chunk_of(item_id):
+    """在庫 ID → 塊の名前（"S0000123" → "1"）。番号の無い ID は "x" にまとめる"""
+    digits = (item_id or "")[1:]
+    return str(int(digits) // CHUNK) if digits.isdigit() else "x"
+
+
+def _chunks(rows):
+    groups = {}
+    for row in rows:
+        item_id = _cell(row, _ID_INDEX)
+        if item_id:
+            groups.setdefault(chunk_of(item_id), []).append(sync_row(row))
+    for values in groups.values():
+        values.sort(key=lambda r: r[0])
+    return groups
+
+
+def chunk_hashes(rows):
+    """{塊の名前: ハッシュ}。行の並び順や No. の振り直しには左右されない"""
+    hashes = {}
+    for name, values in _chunks(rows).items():
+        h = hashlib.sha1()
+        for v in values:
+            h.update(json.dumps(v, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            h.update(b"\n")
+        hashes[name] = h.hexdigest()
+    return hashes
+
+
+def chunk_rows(rows, name):
+    """塊 name に入る行（シートに送る形・在庫 ID 順）"""
+    return _chunks(rows).get(name, [])
+
+
+class ChangeFeed:
+
+    # 残しておく履歴の件数（この倍を超えたら切り詰める）
+    KEEP = 10000
+
+    def __init__(self, changes_dir):
+        self.changes_dir = changes_dir
+        os.makedirs(changes_dir, exist_ok=True)
+
+    def _path(self, base_name, ext):
+        return os.path.join(self.changes_dir, f"{base_name}{ext}")
+
+    def _read_state(self, base_name):
+        try:
+            with open(self._path(base_name, ".seq"), encoding="utf-8") as f:
+                state = json.load(f)
+            return int(state.get("seq", 0)), int(state.get("lines", 0))
+        except (FileNotFoundError, ValueError, AttributeError):
+            return 0, 0
+
+    def _write_state(self, base_name, seq, lines):
+        with atomic_write(self._path(base_name, ".seq"), encoding="utf-8") as f:
+            json.dump({"seq": seq, "lines": lines}, f)
+
+    # 最後の行を探すのに末尾から読む大きさ（1行はこれより十分短い）
+    TAIL_BYTES = 64 * 1024
+
+    def _read_tail(self, base_name):
+        """
+        .jsonl の最後の（書き終わった）行の seq と、末尾の書きかけの行のバイト数
+        戻り値: (seq（無ければ 0）, 書きかけのバイト数)
+        """
+        try:
+            with open(self._path(base_name, ".jsonl"), "rb") as f:
+                size = f.seek(0, os.SEEK_END)
+                start = max(size - self.TAIL_BYTES, 0)
+                f.seek(start)
+                data = f.read()
+        except FileNotFoundError:
+            return 0, 0
+        end = data.rfind(b"\n") + 1
+        partial = len(data) - end
+        for line in reversed(data[:end].splitlines()):
+            try:
+                return int(json.loads(line).get("seq", 0)), partial
+            except (ValueError, AttributeError):
+                continue  # 読み始めの途中の行・壊れた行
+        return 0, partial
+
+    def last_seq(self, base_name):
+        return max(self._read_state(base_name)[0], self._read_tail(base_name)[0])
+
+    def record(self, base_name, events):
+        """
+        events に seq と時刻を付けて追記する（複数ワーカーでも番号が重ならないようロックする）
+        戻り値: seq を付けたイベントのリスト
+        """
+        events = [e for e in events if e]
+        if not events:
+            return []
+        at = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
+        with FileLock(self._path(base_name, ".lock")):
+            seq, lines = self._read_state(base_name)
+            tail_seq, partial = self._read_tail(base_name)
+            if tail_seq > seq:
+                # 前回 .jsonl に書いたあと .seq を書く前に落ちた → 書いた分の番号は使用済み
+                lines += tail_seq - seq
+                seq = tail_seq
+            if partial:
+                # 書きかけで落ちた行は、つなげて壊さないよう切り捨てる（まだ誰にも返していない）
+                path = self._path(base_name, ".jsonl")
+                with open(path, "r+b") as f:
+                    f.truncate(os.path.getsize(path) - partial)
+            stamped = []
+            for e in events:
+                seq += 1
+                stamped.append(dict({"seq": seq, "at": at}, **e))
+            with open(self._path(base_name, ".jsonl"), "a", encoding="utf-8") as f:
+                for e in stamped:
+                    f.write(json.dumps(e, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            lines += len(stamped)
+            if lines > self.KEEP * 2:
+                lines = self._trim(base_name)
+            self._write_state(base_name, seq, lines)
+        return stamped
+
+    def _trim(self, base_name):
+        """古い履歴を捨てて新しい KEEP 件だけにする（ロックを持って呼ぶ）"""
+        path = self._path(base_name, ".jsonl")
+        with open(path, encoding="utf-8") as f:
+            kept = f.readlines()[-self.KEEP:]
+        with atomic_write(path, encoding="utf-8") as f:
+            f.writelines(kept)
+        return len(kept)
+
+    def since(self, base_name, seq=0, limit=1000):
+        """
+        seq より後の変更を古い順に最大 limit 件
+        戻り値: {"seq": 最新の seq, "events": [...], "more": まだ続きがあるか,
+                 "complete": seq の直後から欠けずに残っているか（False なら突き合わせが必要）}
+        """
+        last = self.last_seq(base_name)
+        events, first, more = [], None, False
+        try:
+            with open(self._path(base_name, ".jsonl"), encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                    except ValueError:
+                        continue  # 書きかけの行
+                    if first is None:
+                        first = e.get("seq", 0)
+                    if e.get("seq", 0) <= seq:
+                        continue
+                    if len(events) >= limit:
+                        more = True
+                        break
+                    events.append(e)
+        except FileNotFoundError:
+            pass
+        complete = seq >= last or (first is not None and first <= seq + 1)
+        return {"seq": last, "events": events, "more": more, "complete": complete}
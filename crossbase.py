@@ -0,0 +1,228 @@
+"""
+全拠点にまたがる一覧・集計・書き出し（/inventory_all・/api/inventory_all・/export/inventory）
+
+拠点ごとに「読み込み → 絞り込み → 並べ替え → 集計」まで済ませた部分結果（Partial）を作り、
+最後にまとめる。
+  - 部分結果は行そのものではなく、拠点の行シーケンスの中の位置で持つ
+  - 並べ替えは拠点ごとに済んでいるので、まとめるときは heapq.merge でつなぐだけ。
+    ページ分けなら先頭から必要な件数だけ取り出す（同じ値どうしの並びは query.run_query と同じ：
+    拠点の順 → 拠点の中の行の順）
+  - 集計は拠点ごとの集計（aggregates の形）を足す。絞り込んでいなければ保存してある拠点の集計を使う
+  - プルダウンの候補は拠点ごとの値の集合を合わせる
+
+拠点ごとの処理はスレッドプールで並べて行う（ストレージ・mmap の読み込みの待ちが重なる）。
+拠点・行が多く Python の処理（GIL）が詰まるときはプロセスプールも使える：子プロセスは
+スナップショット（snapshot.py）を自分で mmap して絞り込み・並べ替え・集計を行い、
+該当行の位置と集計だけを返す（行は送らない）。スナップショットに無い拠点・バージョンが
+合わない拠点は、このプロセスで処理する。
+"""
+import heapq
+import itertools
+import multiprocessing
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import aggregates
+import query
+import snapshot
+
+
+class Partial:
+    """拠点1つ分の結果"""
+
+    __slots__ = ("base", "rows", "positions", "totals", "options")
+
+    def __init__(self, base, rows, positions, totals=None, options=None):
+        self.base = base
+        self.rows = rows            # 拠点の行シーケンス
+        self.positions = positions  # 該当行の位置（並べ替え済み。全行そのままなら range）
+        self.totals = totals        # 該当行の集計（絞り込んでいなければ None）
+        self.options = options      # {列: 値の集合}（プルダウンの候補。求められなければ None）
+
+    def entries(self):
+        base, rows = self.base, self.rows
+        return ((base, rows[i]) for i in self.positions)
+
+
+def scan(base, rows, q, options=()):
+    """拠点1つ分の絞り込み・並べ替え・集計。options: 候補を集める列"""
+    filters = q["filters"]
+    words = query.keywords(q)
+    filtered = bool(filters or words)
+    if filters.get("base", base) != base:
+        positions = []
+    elif filtered:
+        positions = [i for i, row in enumerate(rows) if query.matches(base, row, filters, words)]
+    else:
+        positions = range(len(rows))
+    if q["sort"] and positions:
+        field = q["sort"]
+        positions = sorted(positions, key=lambda i: query.sort_key(base, rows[i], field),
+                           reverse=q["desc"])
+    totals = aggregates.tally(rows[i] for i in positions) if filtered else None
+
+    values = {f: _distinct(base, rows, f) for f in options} if options else None
+    return Partial(base, rows, positions, totals, values)
+
+
+def _distinct(base, rows, field):
+    """プルダウンの候補：拠点の行の field の値（空は除く）"""
+    if field == "base":
+        return {base} if rows else set()
+    c = query.COLUMN_INDEX[field]
+    if isinstance(rows, snapshot.BaseView):
+        found = rows.distinct(c)  # 種類の少ない列は値の一覧から作るだけ
+    else:
+        found = {row[c] for row in rows if c < len(row)}
+    found.discard("")
+    return found
+
+
+def merged_entries(partials, q):
+    """部分結果を一覧の並び（query.run_query と同じ）でつないだ (拠点名, 行) のイテレータ"""
+    streams = [p.entries() for p in partials]
+    if not q["sort"]:
+        return itertools.chain.from_iterable(streams)
+    field = q["sort"]
+    return heapq.merge(*streams, key=lambda e: query.sort_key(e[0], e[1], field), reverse=q["desc"])
+
+
+# --- プロセスプールの子 ---
+_child_snapshot = None
+_child_views = {}  # 拠点名 → BaseView（バージョンが変われば作り直す）
+
+
+def _child_init(path, headers, id_col):
+    global _child_snapshot
+    _child_snapshot = snapshot.InventorySnapshot(path, headers, id_col)
+
+
+def _child_scan(base, version, q, options):
+    """子プロセスで拠点1つ分を処理する。スナップショットが version でなければ None"""
+    view = _child_views.get(base)
+    if view is None or view.version != snapshot.version_key(version):
+        view = _child_snapshot.base(base, version)
+        if view is None:
+            _child_views.pop(base, None)
+            return None
+        _child_views[base] = view
+    p = scan(base, view, q, options)
+    return array("I", p.positions).tobytes(), p.totals, p.options
+
+
+class CrossBaseEngine:
+
+    def __init__(self, load, threads=4, processes=0, snapshot_args=None):
+        """
+        load          : 拠点名 → 拠点の行シーケンス
+        threads       : 拠点を並べて処理するスレッド数（1 なら順に処理する）
+        processes     : プロセスプールの大きさ（0 なら使わない）
+        snapshot_args : (スナップショットのパス, HEADERS, ID の列)。子プロセスが開く
+        """
+        self.load = load
+        self.threads = threads
+        self.processes = processes if snapshot_args else 0
+        self.snapshot_args = snapshot_args
+        self._lock = threading.Lock()
+        self._thread_pool = None
+        self._process_pool = None
+
+    def _threads(self):
+        with self._lock:
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(self.threads, thread_name_prefix="crossbase")
+            return self._thread_pool
+
+    def _processes(self):
+        with self._lock:
+            if self._process_pool is None:
+                # gunicorn のワーカーはスレッドを持っているので fork ではなく spawn で起こす
+                self._process_pool = ProcessPoolExecutor(
+                    self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_child_init,
+                    initargs=self.snapshot_args,
+                )
+            return self._process_pool
+
+    def _map(self, fn, bases):
+        if self.threads <= 1 or len(bases) <= 1:
+            return [fn(b) for b in bases]
+        return list(self._threads().map(fn, bases))
+
+    def scan(self, bases, q, options=()):
+        """拠点ごとの部分結果（bases の順）"""
+        if not self.processes or len(bases) <= 1:
+            return self._map(lambda b: scan(b, self.load(b), q, options), bases)
+
+        rows_list = self._map(self.load, bases)
+        pool = self._processes()
+        futures = [
+            pool.submit(_child_scan, b, rows.version, q, options)
+            if isinstance(rows, snapshot.BaseView) else None
+            for b, rows in zip(bases, rows_list)
+        ]
+        partials = []
+        for b, rows, future in zip(bases, rows_list, futures):
+            got = future.result() if future is not None else None
+            if got is None:
+                partials.append(scan(b, rows, q, options))
+                continue
+            positions, totals, values = got
+            partials.append(Partial(b, rows, array("I", positions), totals, values))
+        return partials
+
+    def run(self, bases, q, totals_of, options=()):
+        """
+        一覧1ページ分
+        totals_of : 拠点名 → 保存してある拠点の集計（絞り込んでいないときに使う）
+        戻り値: {"entries": ページ分の (拠点名, 行), "pager": query.paginate の pager,
+                 "totals": 該当行の集計（aggregates の形）, "options": {列: 候補（昇順）},
+                 "count": 拠点の全行数}
+        """
+        partials = self.scan(bases, q, options)
+        total = sum(len(p.positions) for p in partials)
+        start, stop, pager = query.paginate(total, q)
+        if q["sort"]:
+            page = list(itertools.islice(merged_entries(partials, q), start, stop))
+        else:
+            page = _slice(partials, start, stop)
+        totals = aggregates.combine(
+            p.totals if p.totals is not None else totals_of(p.base) for p in partials
+        )
+        values = {f: set() for f in options}
+        for p in partials:
+            for f, found in (p.options or {}).items():
+                values[f] |= found
+        return {
+            "entries": page,
+            "pager": pager,
+            "totals": totals,
+            "options": {f: sorted(v) for f, v in values.items()},
+            "count": sum(len(p.rows) for p in partials),
+        }
+
+    def entries(self, bases, q):
+        """該当する全行を一覧の並びで（書き出し用）"""
+        return merged_entries(self.scan(bases, q), q)
+
+    def shutdown(self):
+        with self._lock:
+            for pool in (self._thread_pool, self._process_pool):
+                if pool is not None:
+                    pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = self._process_pool = None
+
+
+def _slice(partials, start, stop):
+    """並べ替えないとき：拠点の順につないだ start〜stop 件目（使わない拠点の行は触らない）"""
+    out = []
+    for p in partials:
+        n = len(p.positions)
+        if start < n and stop > 0:
+            base, rows = p.base, p.rows
+            out.extend((base, rows[i]) for i in p.positions[max(start, 0):stop])
+        start -= n
+        stop -= n
+    return out
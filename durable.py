@@ -0,0 +1,155 @@
+"""
+ファイルの安全な書き込みと、プロセスをまたぐロック（gunicorn の複数ワーカー・スレッド用）
+
+  atomic_write : 一時ファイルに書いて fsync してから rename で置き換える
+                 （途中で落ちても、元のファイルか新しいファイルのどちらかが丸ごと残る）
+  FileLock     : flock によるロック。同じスレッドからは入れ子で取れる
+  GroupCommit  : 同時に来た書き込みを1回の書き込み（fsync 1回）にまとめる
+"""
+import contextlib
+import fcntl
+import os
+import threading
+
+
+def fsync_dir(path):
+    """rename した結果をディレクトリごと確定させる"""
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # ディレクトリの fsync ができないファイルシステム
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode="w", **kwargs):
+    """
+    with atomic_write(path, newline="", encoding="utf-8") as f: ... で path を丸ごと書き換える
+    例外で抜けたときは一時ファイルを消し、path は元のまま
+    """
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    fsync_dir(os.path.dirname(path))
+
+
+class FileLock:
+    """
+    ロックファイルへの排他ロック（fcntl.flock）
+    取るたびにファイルを開き直すので、同じプロセスの別スレッドとも、別ワーカーとも排他になる。
+    同じスレッドが持っている間に取り直しても止まらない（出たときに外す）。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def acquire(self, blocking=True, shared=False):
+        """
+        blocking=False なら、他が持っているときは待たずに False を返す
+        shared=True なら共有ロック（読むだけの側。共有同士は同時に持てる）
+        """
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            d = os.path.dirname(self.path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            f = open(self.path, "a")
+            try:
+                flag = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                fcntl.flock(f, flag if blocking else flag | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return False
+            except BaseException:
+                f.close()
+                raise
+            self._local.file = f
+        self._local.depth = depth + 1
+        return True
+
+    def release(self):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            f = self._local.file
+            self._local.file = None
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+
+    @contextlib.contextmanager
+    def shared(self):
+        """
+        with lock.shared(): ... で共有ロックを持つ（このスレッドが既に持っていればそのまま）
+        共有で持っている間に同じロックを排他で取り直さないこと（持ち替えはしない）
+        """
+        self.acquire(shared=True)
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def held(self):
+        """このスレッドが持っているか"""
+        return getattr(self._local, "depth", 0) > 0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class GroupCommit:
+    """
+    submit(items) を同時に呼んだスレッドの分をまとめて flush(全部の items) 1回で書く。
+    先に来たスレッドが書いている間に来た分は、次の1回にまとめて書く（書き終わるまで待つ）。
+    flush が失敗したら、その回に含まれていた submit はすべて同じ例外を投げる。
+    """
+
+    def __init__(self, flush):
+        self._flush = flush
+        self._cond = threading.Condition()
+        self._pending = []
+        self._writing = False
+
+    def submit(self, items):
+        entry = {"items": list(items), "done": False, "error": None}
+        with self._cond:
+            self._pending.append(entry)
+            while not entry["done"]:
+                if self._writing:
+                    self._cond.wait()
+                    continue
+                batch, self._pending = self._pending, []
+                self._writing = True
+                self._cond.release()
+                error = None
+                try:
+                    self._flush([x for e in batch for x in e["items"]])
+                except BaseException as e:
+                    error = e
+                finally:
+                    self._cond.acquire()
+                    self._writing = False
+                    for e in batch:
+                        e["done"] = True
+                        e["error"] = error
+                    self._cond.notify_all()
+        if entry["error"] is not None:
+            raise entry["error"]
@@ -0,0 +1,269 @@
+"""
+GAS（Google Apps Script）への送信キュー
+
+入庫の画面は送信を待たずに返し、バックグラウンドのスレッドが送る。
+  - 送る内容は data/gas_outbox/ に1件1ファイルで置く（落ちても次の起動で送り直せる）
+  - 同じ拠点・同じ action の rows つき payload がたまっていれば、1回の POST にまとめる
+  - 失敗したら間隔を倍々にあけて（上限あり）送り直す
+  - HTTP の接続は requests.Session で使い回す
+  - 複数ワーカー（gunicorn）でも送るのは同時に1プロセスだけ（ロックファイル）
+  - add_periodic() で登録した処理（シートとの突き合わせなど）もこのスレッドで定期的に動かす
+"""
+import json
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from durable import FileLock, atomic_write
+
+
+class GasOutbox:
+
+    # 1回の POST にまとめる payload の上限
+    MAX_BATCH = 50
+    # 送り直しの間隔（秒）：BASE_DELAY, ×2, ×4 … MAX_DELAY まで
+    BASE_DELAY = 2.0
+    MAX_DELAY = 300.0
+    TIMEOUT = 10
+
+    def __init__(self, outbox_dir, endpoint_url, session=None):
+        self.outbox_dir = outbox_dir
+        self.endpoint_url = endpoint_url
+        self.lock = FileLock(os.path.join(outbox_dir, ".lock"))
+        os.makedirs(outbox_dir, exist_ok=True)
+
+        self._session = session
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._state_lock = threading.Lock()
+        self._seq = 0
+        self._failures = 0        # 続けて失敗した回数
+        self._next_at = 0.0       # 次に送ってよい時刻（time.monotonic）
+        self._last_error = None
+        self._last_sent_at = None
+        self._sent = 0
+        self._periodic = []       # [(名前, 間隔（秒）, 関数)]
+
+    # --- 送信 ---
+    def session(self):
+        if self._session is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2, max_retries=0)
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            self._session = s
+        return self._session
+
+    def call(self, payload):
+        """キューを通さずにすぐ POST して、返ってきた JSON を返す（突き合わせの問い合わせ用）"""
+        res = self.session().post(self.endpoint_url, json=payload, timeout=self.TIMEOUT)
+        res.raise_for_status()
+        return res.json()
+
+    def _pending_files(self):
+        return sorted(n for n in os.listdir(self.outbox_dir) if n.endswith(".json"))
+
+    def depth(self):
+        """送信待ちの件数"""
+        return len(self._pending_files())
+
+    def enqueue(self, payload):
+        """payload をキューに入れる（ファイルに書いてからワーカーを起こす）"""
+        with self._state_lock:
+            self._seq += 1
+            name = f"{time.time_ns():020d}-{os.getpid()}-{self._seq:06d}.json"
+        with atomic_write(os.path.join(self.outbox_dir, name), encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+        self.ensure_worker()
+        self._wake.set()
+
+    def _load(self, names):
+        items = []
+        for name in names:
+            path = os.path.join(self.outbox_dir, name)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    items.append((path, json.load(f)))
+            except FileNotFoundError:
+                continue  # 別プロセスが送信済み
+            except ValueError:
+                # 壊れたファイルは送れないので脇へよける
+                os.replace(path, path + ".bad")
+        return items
+
+    # 中身をまるごと置き換える action（同じ塊なら最新の1つだけ送ればよい）
+    REPLACE_ACTIONS = ("replace_chunk",)
+
+    @staticmethod
+    def _batch_key(payload):
+        if isinstance(payload, dict) and isinstance(payload.get("rows"), list):
+            # 塊ごとの送り直し（replace_chunk）は塊が違えば別々に送る
+            return (payload.get("action"), payload.get("base"), payload.get("chunk"))
+        return None
+
+    def _coalesce(self, items):
+        """
+        [(path, payload)] → [(paths, payload)]
+        同じ (action, base, chunk) の rows つき payload は、古い順に rows をつなげて1つにする
+        置き換え（REPLACE_ACTIONS）は最新の payload だけを残し、古いファイルは一緒に送信済みにする
+        """
+        batches = []
+        open_batches = {}
+        for path, payload in items:
+            key = self._batch_key(payload)
+            batch = open_batches.get(key) if key else None
+            if batch is not None and key[0] in self.REPLACE_ACTIONS:
+                # 古い方は送らない。後から来た追加分を上書きしないよう、送る位置も新しい方に合わせる
+                batches.remove(batch)
+                batch = (batch[0] + [path], payload)
+                batches.append(batch)
+                open_batches[key] = batch
+                continue
+            if batch is not None and len(batch[0]) < self.MAX_BATCH:
+                batch[0].append(path)
+                batch[1]["rows"].extend(payload["rows"])
+                if not batch[1].get("user") and payload.get("user"):
+                    batch[1]["user"] = payload["user"]
+                continue
+            batch = ([path], dict(payload, rows=list(payload["rows"])) if key else payload)
+            batches.append(batch)
+            if key:
+                open_batches[key] = batch
+        return batches
+
+    def deliver_pending(self):
+        """
+        たまっている分を送る。戻り値: 送れた payload（ファイル）の数
+        失敗したらそこで止め、残りは次回（バックオフ後）に回す
+        """
+        if not self.endpoint_url:
+            return 0
+        if not self.lock.acquire(blocking=False):
+            return 0  # 別プロセスが送信中
+        try:
+            sent = 0
+            for paths, payload in self._coalesce(self._load(self._pending_files())):
+                try:
+                    res = self.session().post(self.endpoint_url, json=payload, timeout=self.TIMEOUT)
+                    res.raise_for_status()
+                except requests.RequestException as e:
+                    self._record_failure(e)
+                    break
+                # 送れた記録を先に付ける（キューが空に見えた時点で失敗回数は戻っている）
+                self._record_success(len(paths))
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                sent += len(paths)
+            return sent
+        finally:
+            self.lock.release()
+
+    def _record_success(self, count):
+        with self._state_lock:
+            self._failures = 0
+            self._next_at = 0.0
+            self._sent += count
+            self._last_sent_at = time.time()
+
+    def _record_failure(self, error):
+        with self._state_lock:
+            self._failures += 1
+            delay = min(self.BASE_DELAY * 2 ** (self._failures - 1), self.MAX_DELAY)
+            delay *= random.uniform(0.8, 1.2)  # 複数台が同時に再送しないように少しずらす
+            self._next_at = time.monotonic() + delay
+            self._last_error = str(error)[:200]
+        print("[gas_outbox] send failed:", self._last_error)
+
+    # --- 定期処理 ---
+    def add_periodic(self, name, interval, fn):
+        """
+        fn() を interval 秒ごとに呼ぶ（送信キューのワーカーから）。
+        最後に動かした時刻はファイルに残すので、複数プロセスでも間隔ごとに1回だけ動く
+        """
+        if interval > 0:
+            self._periodic.append((name, interval, fn))
+
+    def _run_periodic(self):
+        for name, interval, fn in self._periodic:
+            marker = os.path.join(self.outbox_dir, f".{name}")
+            if not self.lock.acquire(blocking=False):
+                return
+            try:
+                try:
+                    last = os.path.getmtime(marker)
+                except OSError:
+                    last = 0.0
+                if time.time() - last < interval:
+                    continue
+                with open(marker, "w"):
+                    pass  # 失敗しても次は interval 後（失敗のたびに問い合わせ続けない）
+            finally:
+                self.lock.release()
+            try:
+                fn()
+            except Exception as e:
+                print(f"[gas_outbox] {name} failed:", str(e)[:200])
+
+    # --- バックグラウンドのワーカー ---
+    def ensure_worker(self):
+        """このプロセスでワーカーが動いていなければ起動する（fork 後の子プロセスでも）"""
+        if not self.endpoint_url:
+            return
+        pid = os.getpid()
+        if self._thread is not None and self._thread_pid == pid and self._thread.is_alive():
+            return
+        with self._state_lock:
+            if self._thread is not None and self._thread_pid == pid and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="gas-outbox", daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            wait = self._next_at - time.monotonic()
+            if wait > 0:
+                # バックオフ中：待つ（新しい payload が来ても時間までは送らない）
+                self._stop.wait(wait)
+                continue
+            if self.depth():
+                try:
+                    self.deliver_pending()
+                except OSError as e:
+                    self._record_failure(e)
+                if self._next_at > time.monotonic():
+                    continue
+            self._run_periodic()
+            # 他プロセスのキュー分も拾えるよう、何も無くてもときどき見に行く
+            self._wake.wait(30)
+            self._wake.clear()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def status(self):
+        """キューの状態（/api/gas_outbox 用）"""
+        with self._state_lock:
+            retry_in = max(self._next_at - time.monotonic(), 0.0)
+            return {
+                "enabled": bool(self.endpoint_url),
+                "pending": self.depth(),
+                "sent": self._sent,
+                "failures": self._failures,
+                "retry_in": round(retry_in, 1),
+                "last_error": self._last_error,
+                "last_sent_at": self._last_sent_at,
+                "worker_alive": bool(self._thread and self._thread.is_alive()
+                                     and self._thread_pid == os.getpid()),
+            }
@@ -0,0 +1,18 @@
+"""
+gunicorn の設定（gunicorn は起動したディレクトリの gunicorn.conf.py を自動で読む）
+
+ワーカーを起動したら、最初のリクエストを待たずに在庫などを読み込んでおく（app.warm_up）。
+WARM_UP=0 で行わない。ワーカー数・ポートはこれまでどおり WEB_CONCURRENCY・PORT で指定する。
+"""
+import os
+
+
+def post_fork(server, worker):
+    if os.environ.get("WARM_UP", "1") == "0":
+        return
+    try:
+        import app
+        app.warm_up()
+    except Exception:
+        # 読み込みに失敗しても、ワーカーは起動させる（最初のリクエストで読み直す）
+        server.log.exception("warm up failed")
@@ -0,0 +1,231 @@
+"""
+入庫の共通処理（入庫フォーム・拠点別入庫フォーム・一括取り込み・/api/intake）
+
+入力1行分は STOCK_FIELDS（＋拠点 "branch"）をキーにした dict。
+validate_batch() でまとめて検証・正規化し、拠点ごとの在庫行（HEADERS 準拠）にする。
+保存・入庫ログ・GAS への差分は app.commit_stock_intake() が拠点ごとに1回で行う。
+
+正規表現はモジュールの読み込み時に1回だけコンパイルし、
+脇石・チェーン長・サイズ・入庫日の正規化は同じ値の結果を使い回す（lru_cache）。
+"""
+import datetime
+import re
+from functools import lru_cache
+
+
+_NUMBER_ONLY_RE = re.compile(r"[0-9]+(\.[0-9]+)?")
+_CT_RE = re.compile(r"[ｃcＣC][ｔtＴT]", flags=re.IGNORECASE)
+_CM_RE = re.compile(r"[cｃＣ][mｍＭ]|㎝", flags=re.IGNORECASE)
+_SIZE_NUMBER_RE = re.compile(r"([0-9]+(\.[0-9]+)?)")
+_DATE_RE = re.compile(r"(\d{4})-(\d{1,2})-(\d{1,2})")
+
+# 同じ値（"0.1" や "45" など）は何度も出てくるので、正規化の結果を覚えておく
+_MEMO_SIZE = 4096
+
+
+@lru_cache(maxsize=_MEMO_SIZE)
+def normalize_ct(s: str) -> str:
+    """脇石用：単位を ct に統一する"""
+    s = s.strip()
+    if not s:
+        return ""
+    lower = s.lower()
+    # すでに ct 系が入っていれば表記だけ揃える → "ct"
+    if "ct" in lower or "ｃｔ" in lower:
+        return _CT_RE.sub("ct", s)
+    # 数値だけなら "◯ct" を付与（例: "1.5" → "1.5ct"）
+    if _NUMBER_ONLY_RE.fullmatch(s):
+        return f"{s}ct"
+    return s
+
+
+@lru_cache(maxsize=_MEMO_SIZE)
+def normalize_cm(s: str) -> str:
+    """チェーン長用：単位を cm に統一する"""
+    s = s.strip()
+    if not s:
+        return ""
+    # 各種 cm 表記を "cm" に揃える
+    s2 = _CM_RE.sub("cm", s)
+    if "cm" in s2.lower():
+        return s2
+    # 数値だけなら "◯cm" を付与
+    if _NUMBER_ONLY_RE.fullmatch(s2):
+        return f"{s2}cm"
+    return s2
+
+
+@lru_cache(maxsize=_MEMO_SIZE)
+def normalize_size(chuseki, size):
+    """中石=ダイヤ のとき、サイズの数値 >=1 を CT 表記に変換（1 → "CT"、1.5 → "1.5CT"。1未満はそのまま）"""
+    if chuseki == "ダイヤ" and _NUMBER_ONLY_RE.fullmatch(size):
+        val = float(size)
+        if val == 1:
+            return "CT"
+        if val > 1:
+            return f"{val:g}CT"
+    return size
+
+
+def format_nyuko_date(s, today=None):
+    """入庫日：空なら今日。YYYY-MM-DD を YYYY/MM/DD に変換"""
+    s = s.strip()
+    if not s:
+        return (today or datetime.date.today()).strftime("%Y/%m/%d")
+    return _format_date(s)
+
+
+@lru_cache(maxsize=_MEMO_SIZE)
+def _format_date(s):
+    m = _DATE_RE.fullmatch(s)
+    if m:
+        try:
+            return datetime.date(*map(int, m.groups())).strftime("%Y/%m/%d")
+        except ValueError:
+            pass
+    return s.replace("-", "/")
+
+
+# 入庫の入力項目（フォームの name と同じ）と、必須項目の表示名
+STOCK_FIELDS = [
+    "jigan", "item", "chuseki", "size", "hinban", "uedai", "gedai",
+    "wakishi", "chain_len", "tekiyo", "input_user", "nyuko_date", "gedai_numeric",
+]
+REQUIRED_STOCK_FIELDS = {
+    "jigan": "地金",
+    "item": "アイテム",
+    "chuseki": "中石",
+    "size": "サイズ",
+    "hinban": "品番",
+    "uedai": "上代",
+    "gedai": "暗号化下代",
+    "input_user": "入力者",
+}
+
+
+def _text(value):
+    """入力値 → 前後の空白を取った文字列（JSON の数値もそのまま受ける）"""
+    return "" if value is None else str(value).strip()
+
+
+# 空行の判定に使う項目。脇石・チェーン長・摘要・下代（数値）だけが入った行も空行として飛ばす
+BLANK_CHECK_FIELDS = [
+    "jigan", "item", "chuseki", "size", "hinban", "uedai", "gedai", "input_user", "nyuko_date",
+]
+
+
+def is_blank(values):
+    """入力項目が全部空の行（フォームの未入力行など）"""
+    return not any(_text(values.get(f)) for f in BLANK_CHECK_FIELDS)
+
+
+def build_stock_row(values, today=None):
+    """
+    入庫1行分の入力（STOCK_FIELDS の dict）→ 在庫行（HEADERS 準拠。No.・ID は空）
+    戻り値: (row, 不足している必須項目の表示名のリスト)。不足があれば row は None
+    """
+    v = {f: _text(values.get(f)) for f in STOCK_FIELDS}
+    missing = [label for f, label in REQUIRED_STOCK_FIELDS.items() if not v[f]]
+    if missing:
+        return None, missing
+    row = [
+        "",             # No.
+        "",             # 出庫
+        v["jigan"],
+        v["item"],
+        v["chuseki"],
+        normalize_size(v["chuseki"], v["size"]),
+        v["hinban"],
+        v["uedai"],
+        v["gedai"],     # 暗号化下代
+        normalize_ct(v["wakishi"]),
+        normalize_cm(v["chain_len"]),
+        v["tekiyo"],
+        v["input_user"],
+        format_nyuko_date(v["nyuko_date"], today),
+        v["gedai_numeric"],
+        "",             # 在庫 ID
+    ]
+    return row, []
+
+
+def validate_batch(records, base_names, default_base=None, today=None):
+    """
+    入力行をまとめて検証・正規化する（1件でもエラーがあれば呼び出し側は何も保存しない）
+    records : [(行番号, 入力の dict)]。拠点は "branch"、無ければ default_base
+    戻り値  : ({拠点名: [在庫行]}, [エラーメッセージ])。全部空の行は飛ばす
+    """
+    per_base = {}
+    errors = []
+    for line_no, values in records:
+        if is_blank(values):
+            continue
+        base = _text(values.get("branch")) or default_base
+        if base not in base_names:
+            errors.append(f"{line_no}行目：拠点「{base or ''}」がありません。")
+            continue
+        row, missing = build_stock_row(values, today)
+        if missing:
+            errors.append(f"{line_no}行目：必須項目が不足しています（{'・'.join(missing)}）。")
+            continue
+        per_base.setdefault(base, []).append(row)
+    return per_base, errors
+
+
+# --- 在庫の並び順（入庫後に並べ替える） ---
+ITEM_ORDER = ["リング", "ペンダント", "バチカン", "チェーン", "その他"]
+ITEM_RANK = {name: idx for idx, name in enumerate(ITEM_ORDER)}
+
+JIGAN_ORDER = [
+    "Pt900",
+    "Pt850",
+    "K18",
+    "SV900(Pt)",
+    "Pt900/K18",
+    "Pt900/K18/K18WG",
+    "Pt900/K18/K18PG",
+    "K18WG",
+    "K18PG",
+]
+JIGAN_RANK = {name: idx for idx, name in enumerate(JIGAN_ORDER)}
+
+CHU_SEKI_ORDER = ["ダイヤ", "オーバル", "パール", "スクエア", "Free", "チェーン"]
+CHU_SEKI_RANK = {name: idx for idx, name in enumerate(CHU_SEKI_ORDER)}
+
+
+def parse_size_for_sort(s):
+    """サイズ（数値・CTを数値化）"""
+    if s is None:
+        return 0.0
+    t = str(s).strip()
+    if not t:
+        return 0.0
+    upper = t.upper()
+    if "CT" in upper:
+        m = _SIZE_NUMBER_RE.search(upper)
+        if m:
+            return float(m.group(1))
+        return 1.0
+    try:
+        return float(t)
+    except ValueError:
+        return 0.0
+
+
+def parse_price(s):
+    t = str(s).replace(",", "").strip()
+    try:
+        return float(t)
+    except ValueError:
+        return 0.0
+
+
+def inventory_sort_key(r):
+    return (
+        ITEM_RANK.get(r[3], len(ITEM_ORDER)),           # アイテム
+        JIGAN_RANK.get(r[2], len(JIGAN_ORDER)),         # 地金
+        CHU_SEKI_RANK.get(r[4], len(CHU_SEKI_ORDER)),   # 中石
+        parse_size_for_sort(r[5]),                      # サイズ
+        str(r[6]),                                      # 品番
+        parse_price(r[7]),                              # 上代
+    )
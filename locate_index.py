@@ -0,0 +1,73 @@
+"""
+品番がどの拠点に何点あるかの索引（プロセス内。/api/locate・入庫フォームの他拠点在庫）
+
+(品番, サイズ, 地金) → {拠点名: 在庫 ID の集合} を持つ。品番は search_index.normalize で
+全角/半角・大文字/小文字をそろえたものでも引けるようにしておく（引くときは辞書を見るだけ）。
+
+拠点ごとのバージョン管理と差し替え（update_base・apply）は search_index.VersionedIndex と共通。
+入庫・出庫・編集のように増えた行・減った行が分かる書き込みは apply() でその分だけ足し引きする。
+"""
+from search_index import VersionedIndex, normalize
+
+
+class SkuLocateIndex(VersionedIndex):
+
+    def __init__(self, hinban_col, size_col, jigan_col, id_col):
+        super().__init__(id_col)
+        self.hinban_col = hinban_col
+        self.size_col = size_col
+        self.jigan_col = jigan_col
+        self._skus = {}       # SKU (品番, サイズ, 地金) → {拠点名: 在庫 ID の集合}
+        self._by_hinban = {}  # 正規化した品番 → SKU の集合
+
+    # --- 更新 ---
+    def _value(self, row):
+        """行の SKU (品番, サイズ, 地金)。品番が空の行は索引に入れない"""
+        def cell(c):
+            return row[c].strip() if c < len(row) and row[c] else ""
+        sku = cell(self.hinban_col), cell(self.size_col), cell(self.jigan_col)
+        return sku if sku[0] else None
+
+    def _index(self, base_name, item_id, sku):
+        per_base = self._skus.get(sku)
+        if per_base is None:
+            per_base = self._skus[sku] = {}
+            self._by_hinban.setdefault(normalize(sku[0]), set()).add(sku)
+        per_base.setdefault(base_name, set()).add(item_id)
+
+    def _unindex(self, base_name, item_id, sku):
+        per_base = self._skus.get(sku, {})
+        ids = per_base.get(base_name)
+        if ids is not None:
+            ids.discard(item_id)
+            if not ids:
+                del per_base[base_name]
+        if not per_base and sku in self._skus:
+            del self._skus[sku]
+            key = normalize(sku[0])
+            skus = self._by_hinban.get(key, set())
+            skus.discard(sku)
+            if not skus:
+                self._by_hinban.pop(key, None)
+
+    # --- 引く ---
+    def lookup(self, hinban, size=None, jigan=None):
+        """
+        品番（全角/半角・大文字/小文字は問わない、完全一致）の在庫の場所
+        size・jigan を渡せばその SKU だけ（同じく正規化して比べる。size は候補の集合でもよい）
+        戻り値: [((品番, サイズ, 地金), {拠点名: [在庫 ID（昇順）]})]（SKU の昇順）
+        """
+        if isinstance(size, str):
+            size = [size]
+        sizes = {normalize(s).strip() for s in size or () if s} or None
+        jigan = normalize(jigan).strip() if jigan else None
+        out = []
+        with self._lock:
+            for sku in self._by_hinban.get(normalize(hinban).strip(), ()):
+                if sizes is not None and normalize(sku[1]) not in sizes:
+                    continue
+                if jigan is not None and normalize(sku[2]) != jigan:
+                    continue
+                out.append((sku, {b: sorted(ids) for b, ids in self._skus[sku].items()}))
+        out.sort(key=lambda e: e[0])
+        return out
@@ -0,0 +1,686 @@
+"""
+出庫・入庫ログの読み書き
+
+ログは月ごとのファイル（パーティション）に分けて data/log/ に置く。
+  data/log/2025-11.csv     … 今月（追記中）。行位置の索引 2025-11.csv.idx つき
+  data/log/2025-10.csv.gz  … 締めた月は gzip で圧縮し、以後は書き換えない
+  data/log/manifest.json   … 締めた月ごとの件数と日付（入庫日/出庫日）の範囲
+  data/log/memo.csv        … 出庫ログのメモ（キー,メモ を追記。同じキーは後の行が優先）
+
+行のキーは "YYYY-MM:行番号"（パーティション内の行番号）。
+「新しい順に N 件」は今月分なら索引から位置を引いて該当行だけ読み、
+日付範囲の検索は範囲が重なるパーティションだけを開く。
+
+索引ファイル（.idx）の形式:
+  先頭 16 バイト : b"LIDX" + 形式バージョン(uint32) + 索引済みのログのバイト数(uint64)
+  以降 9 バイトずつ : 行の開始位置(uint64) + 処理種別コード(uint8)
+"""
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import struct
+import threading
+from array import array
+
+from durable import FileLock, atomic_write
+
+
+_HEADER = struct.Struct("<4sIQ")
+_RECORD = struct.Struct("<QB")
+_MAGIC = b"LIDX"
+_VERSION = 1
+
+# 処理種別 → コード（索引に1バイトで持つ）
+MODE_CODES = {"入庫": 1, "出庫": 2}
+_SKIP = 255  # ヘッダー行など、一覧に出さない行
+
+
+def _split_rows(data, start):
+    """
+    CSV のバイト列を行ごとに区切り、(開始位置, 行のバイト列) を返す。
+    クォート内の改行は行の区切りにしない（" の数が奇数の間は次の改行まで続ける）
+    """
+    pos = 0
+    row_start = 0
+    in_quotes = False
+    n = len(data)
+    while pos < n:
+        nl = data.find(b"\n", pos)
+        if nl < 0:
+            break
+        if data.count(b'"', pos, nl) % 2:
+            in_quotes = not in_quotes
+        pos = nl + 1
+        if not in_quotes:
+            yield start + row_start, data[row_start:pos]
+            row_start = pos
+
+
+def _parse(raw):
+    rows = list(csv.reader(io.StringIO(raw.decode("utf-8"), newline="")))
+    return rows[0] if rows else []
+
+
+class MemoStore:
+    """
+    ログのメモ（キー → メモ）を追記専用の CSV に持つ。
+    上書きされた古い行が溜まってきたら、最新の値だけに詰め直す（コンパクション）。
+    """
+
+    # 有効なメモの件数に対して、ファイルの行数がこれを超えたら詰め直す
+    COMPACT_RATIO = 2
+    COMPACT_MIN_LINES = 200
+
+    def __init__(self, path):
+        self.path = path
+        self._memos = {}
+        self._lines = 0
+        self._size = 0
+
+    def _sync(self):
+        """ファイルの続き（他のワーカーが追記した分など）を読む"""
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            self._memos, self._lines, self._size = {}, 0, 0
+            return
+        if size == self._size:
+            return
+        if size < self._size:
+            # 詰め直された → 最初から読み直す
+            self._memos, self._lines, self._size = {}, 0, 0
+        with open(self.path, "rb") as f:
+            f.seek(self._size)
+            data = f.read(size - self._size)
+        consumed = 0
+        for offset, raw in _split_rows(data, 0):
+            row = _parse(raw)
+            if len(row) >= 2:
+                self._memos[row[0]] = row[1]
+            self._lines += 1
+            consumed = offset + len(raw)
+        self._size += consumed
+
+    def get_all(self):
+        self._sync()
+        return self._memos
+
+    def set_many(self, memos):
+        """memos: {キー(str): メモ}。1回の追記で書く"""
+        if not memos:
+            return
+        self._sync()
+        buf = io.StringIO()
+        csv.writer(buf).writerows([k, v] for k, v in memos.items())
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(buf.getvalue().encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        self._sync()
+        if self._lines > max(len(self._memos) * self.COMPACT_RATIO, self.COMPACT_MIN_LINES):
+            self.compact()
+
+    def compact(self):
+        """最新の値だけを書いたファイルを作って差し替える"""
+        self._sync()
+        with atomic_write(self.path, newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(self._memos.items())
+        self._lines = len(self._memos)
+        self._size = os.path.getsize(self.path)
+
+
+class IndexedLogFile:
+    """追記専用のログ CSV 1つ ＋ 行位置の索引"""
+
+    def __init__(self, log_file, log_headers):
+        self.log_file = log_file
+        self.log_headers = log_headers
+        self.index_file = log_file + ".idx"
+        self._reset()
+
+    def _reset(self):
+        self._end = 0                # 索引済みのログのバイト数
+        self._offsets = array("Q")   # 行番号 → 開始位置
+        self._modes = bytearray()    # 行番号 → 処理種別コード
+        self._by_mode = {}           # コード → 行番号の一覧（古い順）
+        self._visible = array("I")   # 一覧に出す行の行番号（古い順）
+        self._index_size = None      # 読み込んだ時点の索引ファイルのサイズ
+
+    def _mode_code(self, row):
+        if row == self.log_headers:
+            return _SKIP
+        return MODE_CODES.get(row[0], 0) if row else _SKIP
+
+    def _add(self, offset, code):
+        n = len(self._offsets)
+        self._offsets.append(offset)
+        self._modes.append(code)
+        if code != _SKIP:
+            self._visible.append(n)
+            self._by_mode.setdefault(code, array("I")).append(n)
+
+    # --- 索引の読み込み・更新 ---
+    def _load_index_file(self):
+        """索引ファイルの続き（まだメモリに無い分）を読む"""
+        try:
+            size = os.path.getsize(self.index_file)
+        except FileNotFoundError:
+            self._reset()
+            return
+        if size == self._index_size:
+            return
+        with open(self.index_file, "rb") as f:
+            head = f.read(_HEADER.size)
+            if len(head) < _HEADER.size:
+                self._reset()
+                return
+            magic, version, end = _HEADER.unpack(head)
+            if magic != _MAGIC or version != _VERSION:
+                self._reset()
+                return
+            if self._index_size is None or size < self._index_size:
+                self._reset()
+            f.seek(_HEADER.size + len(self._offsets) * _RECORD.size)
+            data = f.read()
+        usable = len(data) - len(data) % _RECORD.size
+        for offset, code in _RECORD.iter_unpack(data[:usable]):
+            self._add(offset, code)
+        # 読むだけの側（sync(write_index=False)）はファイルより先までメモリに持っていることがある
+        self._end = max(self._end, end)
+        self._index_size = size - len(data) % _RECORD.size
+
+    def _write_index(self, new_records, rebuild=False):
+        """索引ファイルに追記し、先頭の「索引済みバイト数」を更新する"""
+        mode = "wb" if rebuild or not os.path.exists(self.index_file) else "r+b"
+        with open(self.index_file, mode) as f:
+            if mode == "wb":
+                f.write(_HEADER.pack(_MAGIC, _VERSION, 0))
+                records = zip(self._offsets, self._modes)
+            else:
+                records = new_records
+            f.seek(0, os.SEEK_END)
+            f.write(b"".join(_RECORD.pack(o, c) for o, c in records))
+            f.seek(0)
+            f.write(_HEADER.pack(_MAGIC, _VERSION, self._end))
+        self._index_size = _HEADER.size + len(self._offsets) * _RECORD.size
+
+    def sync(self, write_index=True):
+        """
+        索引がログに追いついていなければ、足りない部分だけ読んで索引する
+        write_index=False ならメモリ上だけ（共有ロックで読む側。索引ファイルは排他ロックの側が書く）
+        """
+        self._load_index_file()
+        try:
+            size = os.path.getsize(self.log_file)
+        except FileNotFoundError:
+            if self._offsets:
+                self._reset()
+                if os.path.exists(self.index_file):
+                    os.remove(self.index_file)
+            return
+
+        rebuild = size < self._end
+        if rebuild:
+            # ログが書き直された（短くなった）ので作り直し
+            self._reset()
+        if size == self._end and not rebuild:
+            return
+
+        with open(self.log_file, "rb") as f:
+            f.seek(self._end)
+            data = f.read(size - self._end)
+        before = len(self._offsets)
+        consumed = 0
+        for offset, raw in _split_rows(data, self._end):
+            self._add(offset, self._mode_code(_parse(raw)))
+            consumed = offset - self._end + len(raw)
+        self._end += consumed
+        if write_index:
+            new = list(zip(self._offsets[before:], self._modes[before:]))
+            self._write_index(new, rebuild=rebuild or before == 0)
+
+    # --- 書き込み ---
+    def append(self, log_rows):
+        """ログをまとめて追記し、索引にも行位置を追記する"""
+        if not log_rows:
+            return
+        chunks = []
+        for row in log_rows:
+            buf = io.StringIO()
+            csv.writer(buf).writerow(row)
+            chunks.append((buf.getvalue().encode("utf-8"), self._mode_code(row)))
+
+        self.sync()
+        with open(self.log_file, "ab") as f:
+            start = f.seek(0, os.SEEK_END)
+            f.write(b"".join(raw for raw, _ in chunks))
+        if start != self._end:
+            # 索引の外で誰かが書いていた → 次回の sync で拾う
+            return
+        before = len(self._offsets)
+        pos = start
+        for raw, code in chunks:
+            self._add(pos, code)
+            pos += len(raw)
+        self._end = pos
+        self._write_index(list(zip(self._offsets[before:], self._modes[before:])))
+
+    # --- 読み込み（呼ぶ前に sync() しておくこと） ---
+    def count(self, mode=None):
+        if mode:
+            return len(self._by_mode.get(MODE_CODES.get(mode, -1), ()))
+        return len(self._visible)
+
+    def row_count(self):
+        return len(self._offsets)
+
+    def read_numbers(self, numbers):
+        """行番号のリスト → [(行番号, 行)]（指定順のまま）"""
+        result = []
+        if not numbers:
+            return result
+        with open(self.log_file, "rb") as f:
+            for n in numbers:
+                start = self._offsets[n]
+                end = self._offsets[n + 1] if n + 1 < len(self._offsets) else self._end
+                f.seek(start)
+                result.append((n, _parse(f.read(end - start))))
+        return result
+
+    def read_page(self, mode=None, offset=0, limit=100):
+        """新しい順に offset 件目から limit 件。戻り値: [(行番号, 行)]"""
+        if mode:
+            numbers = self._by_mode.get(MODE_CODES.get(mode, -1), array("I"))
+        else:
+            numbers = self._visible
+        hi = len(numbers) - offset
+        lo = max(hi - limit, 0)
+        page = list(reversed(numbers[lo:hi])) if hi > 0 else []
+        return self.read_numbers(page)
+
+
+_PARTITION_RE = re.compile(r"^(\d{4}-\d{2})\.csv(\.gz)?$")
+_KEY_RE = re.compile(r"^(\d{4}-\d{2}):(\d+)$")
+_DATE_RE = re.compile(r"^\s*(\d{4})[/-](\d{1,2})[/-](\d{1,2})")
+
+
+def normalize_date(s):
+    """'2025-3-5' / '2025/03/05' などを '2025/03/05' にそろえる（読めなければ空文字）"""
+    m = _DATE_RE.match(s or "")
+    if not m:
+        return ""
+    return f"{m.group(1)}/{int(m.group(2)):02d}/{int(m.group(3)):02d}"
+
+
+class PartitionedLogStore:
+    """月別パーティションに分けたログ"""
+
+    def __init__(self, log_dir, log_headers, legacy_file=None):
+        self.log_dir = log_dir
+        self.log_headers = log_headers
+        self.memo_col = log_headers.index("メモ")
+        self.in_date_col = log_headers.index("入庫日")
+        self.out_date_col = log_headers.index("出庫日")
+        self.manifest_file = os.path.join(log_dir, "manifest.json")
+        self.memos = MemoStore(os.path.join(log_dir, "memo.csv"))
+        self._files = {}  # 月 → IndexedLogFile（圧縮前のパーティション）
+        # 索引・メモ・マニフェストを書き換えるので、別ワーカーとも排他にする（data/log/.lock）
+        # 読むだけなら共有ロック（lock.shared()）。同じプロセスのスレッド同士は _read_lock で順番に
+        self.lock = FileLock(os.path.join(log_dir, ".lock"))
+        self._read_lock = threading.Lock()
+
+        if legacy_file and os.path.exists(legacy_file) and not os.path.isdir(log_dir):
+            # data/log/ ができる前なので、移行のロックはその外に置く。取れたら移行済みでないか見直す
+            with FileLock(log_dir + ".migrate.lock"):
+                if os.path.exists(legacy_file) and not os.path.isdir(log_dir):
+                    self.migrate_legacy(legacy_file)
+        os.makedirs(log_dir, exist_ok=True)
+
+    # --- パーティション ---
+    @staticmethod
+    def current_month():
+        return datetime.date.today().strftime("%Y-%m")
+
+    def _plain_path(self, month):
+        return os.path.join(self.log_dir, f"{month}.csv")
+
+    def _gz_path(self, month):
+        return os.path.join(self.log_dir, f"{month}.csv.gz")
+
+    def partitions(self):
+        """[(月, 圧縮済みか)] を古い順で返す"""
+        found = {}
+        if os.path.isdir(self.log_dir):
+            for name in os.listdir(self.log_dir):
+                m = _PARTITION_RE.match(name)
+                if m:
+                    # 圧縮の途中で両方ある場合は元のファイルを正とする
+                    found[m.group(1)] = found.get(m.group(1), True) and bool(m.group(2))
+        return sorted(found.items())
+
+    def _file(self, month, write_index=True):
+        f = self._files.get(month)
+        if f is None:
+            f = self._files[month] = IndexedLogFile(self._plain_path(month), self.log_headers)
+        f.sync(write_index)
+        return f
+
+    def active_file(self):
+        """いま追記先になっているファイルのパス"""
+        return self._plain_path(self.current_month())
+
+    def event_date(self, row):
+        """行の日付（出庫なら出庫日、それ以外は入庫日）"""
+        col = self.out_date_col if row and row[0] == "出庫" else self.in_date_col
+        return normalize_date(row[col]) if len(row) > col else ""
+
+    def version(self):
+        """キャッシュ検証用：ログのファイル（パーティション・メモ）の (名前, mtime_ns, size) の組"""
+        stamps = []
+        for name in sorted(os.listdir(self.log_dir)):
+            if _PARTITION_RE.match(name) or name == "memo.csv":
+                try:
+                    st = os.stat(os.path.join(self.log_dir, name))
+                except FileNotFoundError:
+                    continue
+                stamps.append((name, st.st_mtime_ns, st.st_size))
+        return tuple(stamps)
+
+    # --- マニフェスト（締めた月の件数・日付範囲） ---
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_file, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        with atomic_write(self.manifest_file, encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+
+    def _stats(self, rows):
+        modes = {}
+        dates = []
+        for row in rows:
+            if not row or row == self.log_headers:
+                continue
+            modes[row[0]] = modes.get(row[0], 0) + 1
+            d = self.event_date(row)
+            if d:
+                dates.append(d)
+        return {
+            "rows": sum(modes.values()),
+            "modes": modes,
+            "min": min(dates) if dates else "",
+            "max": max(dates) if dates else "",
+            "undated": sum(modes.values()) - len(dates),
+        }
+
+    def close_month(self, month):
+        """月を締める：gzip に圧縮し、件数と日付範囲をマニフェストに残す"""
+        plain = self._plain_path(month)
+        if not os.path.exists(plain):
+            return
+        with open(plain, newline="", encoding="utf-8") as f:
+            stats = self._stats(csv.reader(f))
+        with open(plain, "rb") as src, atomic_write(self._gz_path(month), "wb") as raw, \
+                gzip.GzipFile(fileobj=raw, mode="wb") as dst:
+            while True:
+                chunk = src.read(1 << 20)
+                if not chunk:
+                    break
+                dst.write(chunk)
+
+        manifest = self._load_manifest()
+        manifest[month] = stats
+        self._save_manifest(manifest)
+
+        os.remove(plain)
+        if os.path.exists(plain + ".idx"):
+            os.remove(plain + ".idx")
+        self._files.pop(month, None)
+
+    def close_old_months(self):
+        """今月より前の、まだ圧縮していないパーティションを締める"""
+        current = self.current_month()
+        with self.lock:
+            for month, compressed in self.partitions():
+                if month < current and not compressed:
+                    self.close_month(month)
+
+    # --- 読み込み ---
+    def _iter_partition(self, month, compressed):
+        """パーティションの (行番号, 行) を古い順にストリームで返す"""
+        if compressed:
+            f = gzip.open(self._gz_path(month), "rt", newline="", encoding="utf-8")
+        else:
+            f = open(self._plain_path(month), newline="", encoding="utf-8")
+        with f:
+            for n, row in enumerate(csv.reader(f)):
+                if row and row != self.log_headers:
+                    yield n, row
+
+    def _join_memos(self, entries):
+        """メモの別ファイルの値を行に差し込む"""
+        memos = self.memos.get_all()
+        if not memos:
+            return entries
+        for key, row in entries:
+            memo = memos.get(key)
+            if memo is not None:
+                if len(row) <= self.memo_col:
+                    row.extend([""] * (self.memo_col + 1 - len(row)))
+                row[self.memo_col] = memo
+        return entries
+
+    def read_page(self, mode=None, offset=0, limit=100):
+        """
+        新しい順に offset 件目から limit 件。
+        戻り値: ([(キー, 行)], 該当件数)
+        今月分は索引で該当行だけ読み、締めた月は件数（マニフェスト）で丸ごと飛ばせる分は開かない
+        （書き込みとだけ待ち合う共有ロックで読む。ほかのワーカーの一覧表示とは同時に読める）
+        """
+        with self.lock.shared(), self._read_lock:
+            manifest = self._load_manifest()
+            parts = []
+            for month, compressed in reversed(self.partitions()):
+                if compressed and month in manifest:
+                    stats = manifest[month]
+                    count = stats["modes"].get(mode, 0) if mode else stats["rows"]
+                    parts.append((month, compressed, None, count))
+                elif compressed:
+                    rows = [r for _, r in self._iter_partition(month, True)]
+                    stats = self._stats(rows)
+                    manifest[month] = stats
+                    count = stats["modes"].get(mode, 0) if mode else stats["rows"]
+                    parts.append((month, compressed, None, count))
+                else:
+                    f = self._file(month, write_index=False)
+                    parts.append((month, compressed, f, f.count(mode)))
+            total = sum(p[3] for p in parts)
+
+            entries = []
+            skip = offset
+            need = limit
+            for month, compressed, f, count in parts:
+                if need <= 0:
+                    break
+                if skip >= count:
+                    skip -= count
+                    continue
+                if f is not None:
+                    got = f.read_page(mode, skip, need)
+                else:
+                    rows = [(n, r) for n, r in self._iter_partition(month, True)
+                            if not mode or r[0] == mode]
+                    rows.reverse()
+                    got = rows[skip:skip + need]
+                entries.extend((f"{month}:{n}", row) for n, row in got)
+                need -= len(got)
+                skip = 0
+            return self._join_memos(entries), total
+
+    def iter_rows(self, mode=None, date_from=None, date_to=None):
+        """
+        (キー, 行) を古い順にストリームで返す（全履歴でもメモリに溜めない）
+        date_from / date_to を指定すると、日付（出庫なら出庫日、それ以外は入庫日）で絞り込み、
+        範囲が重ならない締めた月のファイルは開かない。
+        """
+        date_from = normalize_date(date_from) if date_from else ""
+        date_to = normalize_date(date_to) if date_to else ""
+        with self.lock.shared(), self._read_lock:
+            manifest = self._load_manifest()
+            parts = self.partitions()
+            memos = dict(self.memos.get_all())
+        for month, compressed in parts:
+            stats = manifest.get(month) if compressed else None
+            if stats and not stats.get("undated"):
+                if date_from and stats["max"] and stats["max"] < date_from:
+                    continue
+                if date_to and stats["min"] and stats["min"] > date_to:
+                    continue
+            if not compressed and not os.path.exists(self._plain_path(month)):
+                continue
+            for n, row in self._iter_partition(month, compressed):
+                if mode and row[0] != mode:
+                    continue
+                if date_from or date_to:
+                    d = self.event_date(row)
+                    if (date_from and d < date_from) or (date_to and d > date_to):
+                        continue
+                key = f"{month}:{n}"
+                memo = memos.get(key)
+                if memo is not None:
+                    if len(row) <= self.memo_col:
+                        row.extend([""] * (self.memo_col + 1 - len(row)))
+                    row[self.memo_col] = memo
+                yield key, row
+
+    def load_all(self):
+        """(キー, 行) のリストを古い順で返す"""
+        return list(self.iter_rows())
+
+    # --- メモ ---
+    def parse_key(self, value):
+        if not _KEY_RE.match(value):
+            raise ValueError(value)
+        return value
+
+    def update_memos(self, memos):
+        """
+        memos: {キー: メモ}。ログ本体は書き直さず、変わったメモだけを別ファイルに追記する
+        （メモ画面はページ内の全メモを送ってくるので、変更の無いものは書かない）
+        戻り値: {キー: メモを差し替えたログ行}（変わったものだけ）
+        """
+        if not memos:
+            return {}
+        by_month = {}
+        for key in memos:
+            m = _KEY_RE.match(key)
+            if m:
+                by_month.setdefault(m.group(1), set()).add(int(m.group(2)))
+
+        with self.lock:
+            parts = dict(self.partitions())
+            current = []
+            for month, numbers in by_month.items():
+                if month not in parts:
+                    continue
+                if parts[month]:
+                    got = [(n, r) for n, r in self._iter_partition(month, True) if n in numbers]
+                else:
+                    f = self._file(month)
+                    got = f.read_numbers(sorted(n for n in numbers if n < f.row_count()))
+                current.extend((f"{month}:{n}", r) for n, r in got)
+
+            changed = {}
+            for key, row in self._join_memos(current):
+                old = row[self.memo_col] if len(row) > self.memo_col else ""
+                if memos[key] != old:
+                    row = list(row)
+                    if len(row) <= self.memo_col:
+                        row.extend([""] * (self.memo_col + 1 - len(row)))
+                    row[self.memo_col] = memos[key]
+                    changed[key] = row
+            self.memos.set_many({k: r[self.memo_col] for k, r in changed.items()})
+            return changed
+
+    # --- 移行・取り込み ---
+    def _month_of(self, row, fallback):
+        d = self.event_date(row)
+        return d[:7].replace("/", "-") if d else fallback
+
+    def migrate_legacy(self, legacy_file):
+        """
+        1ファイルだった log.csv を月別パーティションに分ける（初回だけ。移行のロックを持って呼ぶ）。
+        行は日付（出庫なら出庫日、それ以外は入庫日）の月に振り分け、メモのキーも付け替える。
+        元のファイルは .migrated を付けて残す。
+        """
+        fallback = datetime.date.fromtimestamp(os.path.getmtime(legacy_file)).strftime("%Y-%m")
+        with open(legacy_file, newline="", encoding="utf-8") as f:
+            all_rows = list(csv.reader(f))
+
+        legacy_memo_file = os.path.join(os.path.dirname(legacy_file), "log_memo.csv")
+        legacy_memos = MemoStore(legacy_memo_file).get_all()
+
+        groups = {}
+        new_memos = {}
+        for i, row in enumerate(all_rows):
+            if not row or row == self.log_headers:
+                continue
+            month = self._month_of(row, fallback)
+            rows = groups.setdefault(month, [])
+            if str(i) in legacy_memos:
+                new_memos[f"{month}:{len(rows)}"] = legacy_memos[str(i)]
+            rows.append(row)
+
+        tmp_dir = self.log_dir + ".tmp"
+        # 途中で落ちた前回の移行の残り（移行のロックを持って呼ぶので、ほかのワーカーの分ではない）
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for month, rows in groups.items():
+            with open(os.path.join(tmp_dir, f"{month}.csv"), "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(rows)
+        if new_memos:
+            with open(os.path.join(tmp_dir, "memo.csv"), "w", newline="", encoding="utf-8") as f:
+                csv.writer(f).writerows(new_memos.items())
+        os.replace(tmp_dir, self.log_dir)
+
+        os.replace(legacy_file, legacy_file + ".migrated")
+        if os.path.exists(legacy_memo_file):
+            os.replace(legacy_memo_file, legacy_memo_file + ".migrated")
+        self.close_old_months()
+
+    def import_rows(self, rows):
+        """
+        別ファイルの古い履歴（log_old.csv など）を取り込む。
+        行は日付の月に振り分ける。締めた月に入る分は、その月を展開して足し、圧縮し直す。
+        戻り値: 取り込んだ件数
+        """
+        current = self.current_month()
+        groups = {}
+        for row in rows:
+            if row and row != self.log_headers:
+                groups.setdefault(self._month_of(row, current), []).append(row)
+
+        with self.lock:
+            parts = dict(self.partitions())
+            for month, month_rows in sorted(groups.items()):
+                if parts.get(month):
+                    # 締めた月：元に戻して追記 → 圧縮し直す
+                    with gzip.open(self._gz_path(month), "rb") as src, \
+                            open(self._plain_path(month), "wb") as dst:
+                        dst.write(src.read())
+                    os.remove(self._gz_path(month))
+                self._file(month).append(month_rows)
+                if month < current:
+                    self.close_month(month)
+        return sum(len(r) for r in groups.values())
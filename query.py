@@ -0,0 +1,188 @@
+"""
+在庫一覧の絞り込み・並べ替え・ページ分け（サーバー側）
+
+/inventory_all と /inventory/<base_slug> はクエリ文字列で条件を受け取り、
+該当する行のうち1ページ分だけを HTML にする。集計は絞り込んだ全件で出す。
+
+  base / jigan / item / chuseki : プルダウンの絞り込み（完全一致）
+  q        : キーワード（空白区切りで AND。大文字小文字・カンマは無視）
+  sort     : 並べ替える列（INVENTORY_COLUMNS の名前、または base）
+  desc=1   : 降順
+  page     : ページ番号（1〜）
+  per_page : 1ページの件数（0 = すべて）
+
+行は (拠点名, 在庫行) の組で扱う。在庫行は HEADERS と同じ並び。
+"""
+import os
+
+from storage import INVENTORY_COLUMNS
+
+
+# 列名 → 在庫行の位置
+COLUMN_INDEX = {name: i for i, name in enumerate(INVENTORY_COLUMNS)}
+
+# プルダウンで絞り込める列
+FILTER_FIELDS = ("base", "jigan", "item", "chuseki")
+
+# 並べ替えできる列（画面に出している列）
+SORT_FIELDS = ("base", "no") + tuple(INVENTORY_COLUMNS[2:14])
+
+# キーワード検索の対象（画面に出している列）
+_SEARCH_COLUMNS = (0,) + tuple(range(2, 14))
+
+# 1ページの件数
+PAGE_SIZE = int(os.environ.get("INVENTORY_PAGE_SIZE", "200"))
+PER_PAGE_CHOICES = (100, 200, 500, 0)
+
+
+def _int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_args(args, fields=FILTER_FIELDS):
+    """request.args → 検索条件の dict"""
+    filters = {}
+    for f in fields:
+        v = (args.get(f) or "").strip()
+        if v:
+            filters[f] = v
+    sort = args.get("sort") or ""
+    per_page = _int(args.get("per_page"), PAGE_SIZE)
+    return {
+        "filters": filters,
+        "q": (args.get("q") or "").strip(),
+        "sort": sort if sort in SORT_FIELDS else "",
+        "desc": args.get("desc") == "1",
+        "page": max(_int(args.get("page"), 1), 1),
+        "per_page": max(per_page, 0),
+    }
+
+
+def to_args(query, **changes):
+    """検索条件 → url_for に渡すクエリ引数（既定値のものは省く）。changes で一部を差し替える"""
+    args = dict(query["filters"])
+    if query["q"]:
+        args["q"] = query["q"]
+    if query["sort"]:
+        args["sort"] = query["sort"]
+        if query["desc"]:
+            args["desc"] = 1
+    if query["page"] > 1:
+        args["page"] = query["page"]
+    if query["per_page"] != PAGE_SIZE:
+        args["per_page"] = query["per_page"]
+    for k, v in changes.items():
+        if v is None or v == "":
+            args.pop(k, None)
+        else:
+            args[k] = v
+    return args
+
+
+def cell(base, row, field):
+    if field == "base":
+        return base
+    i = COLUMN_INDEX[field]
+    return row[i] if i < len(row) else ""
+
+
+def _search_text(base, row):
+    parts = [base] + [row[i] for i in _SEARCH_COLUMNS if i < len(row)]
+    return " ".join(parts).lower().replace(",", "")
+
+
+def _sort_key(value):
+    """数値として読めるものは数値で、それ以外は文字列で比べる（数値が先）"""
+    v = value.replace(",", "").strip()
+    try:
+        return (0, float(v), "")
+    except ValueError:
+        return (1, 0.0, v)
+
+
+def sort_key(base, row, field):
+    """並べ替えのキー（field の列の値）"""
+    return _sort_key(cell(base, row, field))
+
+
+def is_filtered(query):
+    """絞り込み（プルダウン・キーワード）の条件があるか"""
+    return bool(query["filters"] or query["q"].split())
+
+
+def keywords(query):
+    """キーワードを語に分ける（小文字・カンマなし）"""
+    return [w.replace(",", "") for w in query["q"].lower().split()]
+
+
+def matches(base, row, filters, words):
+    """行が絞り込みの条件（プルダウン filters・キーワード words）に合うか"""
+    if any(cell(base, row, f) != v for f, v in filters.items()):
+        return False
+    if words:
+        text = _search_text(base, row)
+        return all(w in text for w in words)
+    return True
+
+
+def filter_rows(entries, query):
+    """条件に合う (拠点名, 在庫行) だけを返す（並びはそのまま）"""
+    filters = query["filters"]
+    words = keywords(query)
+    if not filters and not words:
+        return list(entries)
+    return [(base, row) for base, row in entries if matches(base, row, filters, words)]
+
+
+def paginate(total, query):
+    """
+    該当 total 件のうち、表示するページの範囲
+    戻り値: (開始位置, 終了位置, pager)。開始・終了はスライスの位置（0始まり）
+    """
+    per_page = query["per_page"]
+    if per_page:
+        pages = max((total + per_page - 1) // per_page, 1)
+        page = min(query["page"], pages)
+        start = (page - 1) * per_page
+        stop = min(start + per_page, total)
+    else:
+        pages, page, start, stop = 1, 1, 0, total
+    pager = {
+        "page": page,
+        "pages": pages,
+        "total": total,
+        "per_page": per_page,
+        "start": start + 1 if stop > start else 0,
+        "end": stop,
+    }
+    return start, stop, pager
+
+
+def run_query(entries, query):
+    """
+    絞り込み → 並べ替え → ページ分け
+    戻り値: (ページ分の行, 絞り込んだ全行, pager)
+      pager : {"page", "pages", "total", "per_page", "start", "end"}
+              start/end は画面に出す「何件目〜何件目」（1始まり）
+    """
+    matched = filter_rows(entries, query)
+    if query["sort"]:
+        field = query["sort"]
+        matched.sort(key=lambda e: sort_key(e[0], e[1], field), reverse=query["desc"])
+
+    start, stop, pager = paginate(len(matched), query)
+    return matched[start:stop], matched, pager
+
+
+def filter_options(entries, fields=FILTER_FIELDS):
+    """プルダウンの候補（絞り込み前の全件から）"""
+    values = {f: set() for f in fields}
+    for base, row in entries:
+        for f in fields:
+            v = cell(base, row, f)
+            if v:
+                values[f].add(v)
+    return {f: sorted(v) for f, v in values.items()}
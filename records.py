@@ -0,0 +1,337 @@
+"""
+在庫1行分のレコード（プロセス内のキャッシュ用）
+
+CSV / SQLite から読んだ行（文字列のリスト）を読み込み時に1回だけ解釈して持つ。
+  - 上代・下代は数値にしておく（集計・値札で毎回パースしない）
+  - 入庫日は date、並び順のキー（intake.inventory_sort_key）も作っておく
+  - 地金・アイテム・中石・入力者は種類が少ないので、文字列ではなく番号で持つ（辞書符号化）
+  - 上代・サイズ・入庫日など値の重なりが多い列は、同じ文字列・同じ数値のオブジェクトを共有する
+__slots__ なので1行あたりのメモリも少ない。
+
+行と同じように row[i]・len(row)・list(row) が使える（i は HEADERS の列位置）。
+テンプレートや query.py などは今までどおり行として扱えばよい。
+"""
+import datetime
+import sys
+import threading
+from functools import lru_cache
+
+import intake
+
+
+class CodeTable:
+    """文字列 ↔ 番号（同じ文字列は同じ番号。番号から文字列へはリストを引くだけ）"""
+
+    __slots__ = ("_codes", "_values", "_lock")
+
+    def __init__(self):
+        self._codes = {}
+        self._values = []
+        self._lock = threading.Lock()
+
+    def encode(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(value)
+                if code is None:
+                    code = len(self._values)
+                    self._values.append(value)
+                    self._codes[value] = code
+        return code
+
+    def decode(self, code):
+        return self._values[code]
+
+    def __len__(self):
+        return len(self._values)
+
+
+# 全拠点で共通の符号表
+JIGAN = CodeTable()
+ITEM = CodeTable()
+CHUSEKI = CodeTable()
+USER = CodeTable()
+
+# 集計のアイテム区分（アイテム名に含まれていれば該当。どれでもなければ「その他」）
+CATEGORIES = ["リング", "ペンダント", "チェーン", "その他"]
+_category_by_item = {}  # アイテムの番号 → 区分
+
+
+def _category(item_code):
+    cat = _category_by_item.get(item_code)
+    if cat is None:
+        item = ITEM.decode(item_code)
+        cat = next((c for c in CATEGORIES[:-1] if c in item), CATEGORIES[-1])
+        _category_by_item[item_code] = cat
+    return cat
+
+
+@lru_cache(maxsize=8192)
+def parse_number(value):
+    """"120,000" → 120000、"1.5" → 1.5、空 → 0、数値でなければ None"""
+    s = value.replace(",", "").strip()
+    if not s:
+        return 0
+    try:
+        return int(s)
+    except ValueError:
+        pass
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=8192)
+def parse_date(value):
+    """"2025/01/31"（"-" 区切りも可）→ date。読めなければ None"""
+    parts = value.strip().replace("-", "/").split("/")
+    if len(parts) != 3:
+        return None
+    try:
+        return datetime.date(int(parts[0]), int(parts[1]), int(parts[2]))
+    except ValueError:
+        return None
+
+
+class RecordBase:
+    """
+    在庫1行として使えるものの共通部分（InventoryRecord・RowRecord と、スナップショットの行 snapshot.SnapshotRow）
+    下位クラスは __iter__・__getitem__（int）を持つ。
+    item_id・uedai_value・gedai_value・category・sort_key は、下位クラスが値を持っていなければ
+    そのつど列の値から作る（数値の解釈はキャッシュつき）
+    """
+
+    __slots__ = ()
+    WIDTH = 16
+
+    @property
+    def item_id(self):
+        return self[15]
+
+    @property
+    def uedai_value(self):
+        return parse_number(self[7])
+
+    @property
+    def gedai_value(self):
+        return parse_number(self[8])
+
+    @property
+    def category(self):
+        return category_of(self[3])
+
+    @property
+    def sort_key(self):
+        return intake.inventory_sort_key(tuple(self))
+
+    def __len__(self):
+        return self.WIDTH
+
+    def __eq__(self, other):
+        if isinstance(other, (RecordBase, list, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self)!r})"
+
+    @property
+    def uedai_int(self):
+        """値札用の上代（整数で書かれていなければ 0）"""
+        return self.uedai_value if type(self.uedai_value) is int else 0
+
+    def with_no(self, no):
+        """No. だけ違うレコード（入庫で後ろの行の No. がずれたとき。ほかの列は読み直さない）"""
+        return NumberedRecord(self, no)
+
+    def same_values(self, row):
+        """No. 以外の列が row と同じか"""
+        return len(row) >= self.WIDTH and tuple(self)[1:] == tuple(row[1:self.WIDTH])
+
+
+def category_of(item):
+    """アイテム名 → 集計のアイテム区分"""
+    return _category(ITEM.encode(item))
+
+
+class InventoryRecord(RecordBase):
+
+    # 在庫行の列（HEADERS の並び）。地金・アイテム・中石・入力者は番号で持つ
+    __slots__ = (
+        "no", "shukko", "jigan_code", "item_code", "chuseki_code", "size", "hinban",
+        "uedai", "gedai", "wakishi", "chain_len", "tekiyo", "user_code", "nyuko_date",
+        "gedai_numeric", "item_id",
+        # 読み込み時に解釈した値
+        "uedai_value", "gedai_value", "nyuko", "sort_key",
+    )
+
+    @classmethod
+    def from_row(cls, row):
+        """在庫行（文字列のリスト）→ レコード（足りない列は空、余分な列は捨てる）"""
+        v = [("" if x is None else str(x)) for x in row[:cls.WIDTH]]
+        if len(v) < cls.WIDTH:
+            v += [""] * (cls.WIDTH - len(v))
+        intern = sys.intern
+        self = cls.__new__(cls)
+        self.no = v[0]
+        self.shukko = intern(v[1])
+        self.jigan_code = JIGAN.encode(v[2])
+        self.item_code = ITEM.encode(v[3])
+        self.chuseki_code = CHUSEKI.encode(v[4])
+        self.size = intern(v[5])
+        self.hinban = v[6]
+        self.uedai = intern(v[7])
+        self.gedai = intern(v[8])
+        self.wakishi = intern(v[9])
+        self.chain_len = intern(v[10])
+        self.tekiyo = v[11]
+        self.user_code = USER.encode(v[12])
+        self.nyuko_date = intern(v[13])
+        self.gedai_numeric = intern(v[14])
+        self.item_id = v[15]
+        self.uedai_value = parse_number(v[7])
+        self.gedai_value = parse_number(v[8])
+        self.nyuko = parse_date(v[13])
+        self.sort_key = intake.inventory_sort_key(v)
+        return self
+
+    def with_no(self, no):
+        """No. だけ違うコピー（出庫で振り直したとき。ほかの列は解釈し直さない）"""
+        other = InventoryRecord.__new__(InventoryRecord)
+        for name in self.__slots__:
+            setattr(other, name, getattr(self, name))
+        other.no = no
+        return other
+
+    # --- 番号で持っている列 ---
+    @property
+    def jigan(self):
+        return JIGAN.decode(self.jigan_code)
+
+    @property
+    def item(self):
+        return ITEM.decode(self.item_code)
+
+    @property
+    def chuseki(self):
+        return CHUSEKI.decode(self.chuseki_code)
+
+    @property
+    def input_user(self):
+        return USER.decode(self.user_code)
+
+    @property
+    def category(self):
+        """集計のアイテム区分（リング / ペンダント / チェーン / その他）"""
+        return _category(self.item_code)
+
+    # --- 行として使う ---
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return tuple(self)[i]
+        return _GETTERS[i](self)
+
+    def __iter__(self):
+        return iter((
+            self.no, self.shukko, JIGAN.decode(self.jigan_code), ITEM.decode(self.item_code),
+            CHUSEKI.decode(self.chuseki_code), self.size, self.hinban, self.uedai, self.gedai,
+            self.wakishi, self.chain_len, self.tekiyo, USER.decode(self.user_code),
+            self.nyuko_date, self.gedai_numeric, self.item_id,
+        ))
+
+
+class RowRecord(RecordBase):
+    """
+    在庫行（文字列）をそのまま持つレコード。読み込み時の解釈をしないので作るのが安い
+    （スナップショットを使うとき、書いた直後からスナップショットを書き終えるまでの間のキャッシュ用）
+    """
+
+    __slots__ = ("_values",)
+
+    def __init__(self, row):
+        v = tuple(row)
+        if len(v) != self.WIDTH or not all(type(x) is str for x in v):
+            v = tuple(("" if x is None else str(x)) for x in v[:self.WIDTH])
+            v += ("",) * (self.WIDTH - len(v))
+        self._values = v
+
+    def __getitem__(self, i):
+        return self._values[i]
+
+    def __iter__(self):
+        return iter(self._values)
+
+
+class NumberedRecord(RecordBase):
+    """No. だけ差し替えたレコード（No. 以外は元のレコードを読む）"""
+
+    __slots__ = ("_record", "_no")
+
+    def __init__(self, record, no):
+        self._record = record
+        self._no = no
+
+    def __getitem__(self, i):
+        if i == 0:
+            return self._no
+        if isinstance(i, slice):
+            return tuple(self)[i]
+        return self._record[i]
+
+    def __iter__(self):
+        values = iter(self._record)
+        next(values, None)
+        yield self._no
+        yield from values
+
+    def with_no(self, no):
+        return NumberedRecord(self._record, no)
+
+
+_GETTERS = [
+    lambda r: r.no,
+    lambda r: r.shukko,
+    lambda r: JIGAN.decode(r.jigan_code),
+    lambda r: ITEM.decode(r.item_code),
+    lambda r: CHUSEKI.decode(r.chuseki_code),
+    lambda r: r.size,
+    lambda r: r.hinban,
+    lambda r: r.uedai,
+    lambda r: r.gedai,
+    lambda r: r.wakishi,
+    lambda r: r.chain_len,
+    lambda r: r.tekiyo,
+    lambda r: USER.decode(r.user_code),
+    lambda r: r.nyuko_date,
+    lambda r: r.gedai_numeric,
+    lambda r: r.item_id,
+]
+
+
+def ensure(row):
+    """行でもレコードでも受けて、レコード（RecordBase）にする"""
+    return row if isinstance(row, RecordBase) else InventoryRecord.from_row(row)
+
+
+def build(rows, previous=()):
+    """
+    行のリスト → レコードのタプル
+    previous（前回のレコード）に同じ在庫 ID で同じ値の行があれば、解釈し直さずに使い回す
+    （出庫で No. だけ変わった行も、No. を差し替えるだけ）
+    """
+    by_id = {r.item_id: r for r in previous if isinstance(r, InventoryRecord) and r.item_id}
+    out = []
+    for row in rows:
+        if isinstance(row, InventoryRecord):
+            out.append(row)
+            continue
+        old = by_id.get(row[15]) if len(row) > 15 else None
+        if old is not None and old.same_values(row):
+            out.append(old if old.no == row[0] else old.with_no(row[0]))
+        else:
+            out.append(InventoryRecord.from_row(row))
+    return tuple(out)
@@ -0,0 +1,196 @@
+"""
+在庫のキーワード検索用の転置インデックス（プロセス内）
+
+品番・摘要・脇石・サイズ・入力者の文字を空白で区切った語 → 在庫 ID の集合 を持つ。
+語は NFKC 正規化（全角英数→半角、半角カナ→全角）して小文字にそろえる。
+語の一覧を並べて持っているので、前方一致は二分探索で範囲を取るだけで済む。
+
+拠点ごとに「どのバージョンの在庫から作ったか」を覚えておき、
+バージョンが変わったときだけ、その拠点の変わった行の分を差し替える（VersionedIndex。locate_index も使う）。
+"""
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+
+def normalize(text):
+    """全角/半角・大文字/小文字の違いをなくす（カンマも取る：金額の "10,000" 対策）"""
+    return unicodedata.normalize("NFKC", text or "").lower().replace(",", "")
+
+
+def tokenize(text):
+    return normalize(text).split()
+
+
+class VersionedIndex:
+    """
+    拠点ごとの在庫から作る索引の共通部分（在庫 ID → (拠点名, 行から取り出した値)）
+
+    拠点ごとに「どのバージョンの在庫から作ったか」を覚えておく。
+      - update_base(): バージョンが変わった拠点の、値が変わった行・増えた行・消えた行だけを差し替える
+      - apply(): 増えた行・減った行が分かる書き込みは、その分だけ足し引きする
+    サブクラスは _value(row)（索引に入れないなら None）・_index()・_unindex() を用意する
+    """
+
+    def __init__(self, id_col):
+        self.id_col = id_col
+        self._lock = threading.Lock()
+        self._stamps = {}     # 拠点名 → 索引に反映済みのバージョン
+        self._docs = {}       # 在庫 ID → (拠点名, 値)
+        self._by_base = {}    # 拠点名 → 在庫 ID の集合
+
+    def version(self, base_name):
+        return self._stamps.get(base_name)
+
+    def bases(self):
+        """索引に入っている拠点"""
+        return list(self._stamps)
+
+    # --- サブクラスで用意する ---
+    def _value(self, row):
+        raise NotImplementedError
+
+    def _index(self, base_name, item_id, value):
+        raise NotImplementedError
+
+    def _unindex(self, base_name, item_id, value):
+        raise NotImplementedError
+
+    # --- 更新 ---
+    def _remove_doc(self, item_id):
+        base_name, value = self._docs.pop(item_id)
+        self._by_base.get(base_name, set()).discard(item_id)
+        self._unindex(base_name, item_id, value)
+
+    def _put_row(self, base_name, row):
+        """行を索引に入れる（同じ値で入っていれば何もしない）。戻り値: 在庫 ID（無ければ None）"""
+        if len(row) <= self.id_col or not row[self.id_col]:
+            return None
+        item_id = row[self.id_col]
+        value = self._value(row)
+        doc = self._docs.get(item_id)
+        if doc != (base_name, value):
+            if doc is not None:
+                self._remove_doc(item_id)
+            if value is not None:
+                self._docs[item_id] = (base_name, value)
+                self._by_base.setdefault(base_name, set()).add(item_id)
+                self._index(base_name, item_id, value)
+        return item_id
+
+    def update_base(self, base_name, stamp, rows):
+        """
+        拠点の在庫を索引に反映する。stamp が前回と同じなら何もしない。
+        値が変わった行・増えた行・消えた行だけを差し替える。
+        """
+        with self._lock:
+            if stamp is not None and self._stamps.get(base_name) == stamp:
+                return
+            seen = set()
+            for row in rows:
+                item_id = self._put_row(base_name, row)
+                if item_id is not None:
+                    seen.add(item_id)
+            for item_id in self._by_base.get(base_name, set()) - seen:
+                # 出庫などで無くなった行（別拠点へ移った行は上で付け替え済み）
+                if self._docs.get(item_id, (None,))[0] == base_name:
+                    self._remove_doc(item_id)
+            self._stamps[base_name] = stamp
+
+    def apply(self, base_name, old_stamp, new_stamp, added=(), removed=()):
+        """
+        書き込みの差分（増えた行・減った行）だけ反映する。
+        索引がその拠点の old_stamp のときだけ。反映できなければ False（次に引くとき update_base で合わせる）
+        """
+        with self._lock:
+            if old_stamp is None or self._stamps.get(base_name) != old_stamp:
+                return False
+            for row in removed:
+                if len(row) > self.id_col and self._docs.get(row[self.id_col], (None,))[0] == base_name:
+                    self._remove_doc(row[self.id_col])
+            for row in added:
+                self._put_row(base_name, row)
+            self._stamps[base_name] = new_stamp
+            return True
+
+    def drop_base(self, base_name):
+        with self._lock:
+            for item_id in list(self._by_base.pop(base_name, ())):
+                if self._docs.get(item_id, (None,))[0] == base_name:
+                    self._remove_doc(item_id)
+            self._stamps.pop(base_name, None)
+
+
+class InventorySearchIndex(VersionedIndex):
+
+    def __init__(self, columns, id_col):
+        super().__init__(id_col)
+        self.columns = columns  # 検索対象の列位置（在庫行）
+        self._postings = {}   # 語 → 在庫 ID の集合
+        self._terms = []      # 語の一覧（昇順。前方一致用）
+
+    # --- 更新 ---
+    def _value(self, row):
+        """対象列の値（値が同じ行は語を作り直さない）"""
+        return tuple(row[c] if c < len(row) else "" for c in self.columns)
+
+    @staticmethod
+    def _terms_of(values):
+        terms = set()
+        for v in values:
+            terms.update(tokenize(v))
+        return terms
+
+    def _index(self, base_name, item_id, values):
+        for t in self._terms_of(values):
+            self._add_term(t, item_id)
+
+    def _unindex(self, base_name, item_id, values):
+        for t in self._terms_of(values):
+            self._remove_term(t, item_id)
+
+    def _add_term(self, term, item_id):
+        ids = self._postings.get(term)
+        if ids is None:
+            ids = self._postings[term] = set()
+            insort(self._terms, term)
+        ids.add(item_id)
+
+    def _remove_term(self, term, item_id):
+        ids = self._postings.get(term)
+        if ids is None:
+            return
+        ids.discard(item_id)
+        if not ids:
+            del self._postings[term]
+            i = bisect_left(self._terms, term)
+            if i < len(self._terms) and self._terms[i] == term:
+                del self._terms[i]
+
+    # --- 検索 ---
+    def _prefix(self, word):
+        """word で始まる語すべての在庫 ID（和集合）"""
+        i = bisect_left(self._terms, word)
+        result = set()
+        while i < len(self._terms) and self._terms[i].startswith(word):
+            result |= self._postings[self._terms[i]]
+            i += 1
+        return result
+
+    def search(self, q):
+        """
+        q を空白で区切り、各語に前方一致する在庫の積（AND）を返す
+        戻り値: [(在庫 ID, 拠点名)]（ID 順）
+        """
+        words = tokenize(q)
+        if not words:
+            return []
+        with self._lock:
+            # 候補の少ない語から絞っていく
+            sets = sorted((self._prefix(w) for w in words), key=len)
+            hits = set(sets[0])
+            for s in sets[1:]:
+                if not hits:
+                    break
+                hits &= s
+            return [(i, self._docs[i][0]) for i in sorted(hits)]
@@ -0,0 +1,381 @@
+"""
+在庫のスナップショット（data/snapshot/<拠点名>.snap）
+
+ワーカー（gunicorn）ごとに CSV を読んでレコードを持つと、ワーカーの数だけメモリを使い、
+起動したばかりのワーカーは CSV をパースし直すことになる。そこで拠点ごとに在庫を列ごとのバイナリに
+まとめたファイルを置き、各ワーカーは読み取り専用で mmap して使う。中身は OS のページキャッシュを
+共有するので、ワーカーを増やしてもメモリはほとんど増えない。
+
+  - ファイルは拠点ごと。書いた時点の在庫のバージョン（storage の inventory_version）を持つ。
+    いまのバージョンと違う拠点は使わない（ストレージから読んで、その拠点のファイルだけ書き直す）
+  - 書き直すときは一時ファイル＋rename。ロックも拠点ごとなので、書くのはその拠点の分だけで、
+    他の拠点の書き込み・読み込みを待たせない
+  - 入庫・出庫・編集の後の書き直しは publish_later() でバックグラウンドのスレッドに任せる
+    （書き込みのリクエストは待たない。間に合う前に読んだワーカーはストレージから読む）
+  - 読む側はファイルが置き換わったら（stat で分かる）新しいファイルを mmap し直す
+  - 形式バージョンか列の並び（HEADERS）が今のプログラムと違うファイルは使わない（作り直す）
+
+ファイルの形式:
+  先頭 16 バイト : b"ISNP" + 形式バージョン(uint32) + 目次の長さ(uint32) + 予備(uint32)
+  目次（JSON）   : {"byteorder": "little", "headers": [列名, ...],
+                    "version": ..., "rows": 行数, "columns": [...], "ids": ブロック}
+  以降           : ブロック（8 バイト境界にそろえる）。目次ではブロックを [開始位置, 長さ] で指す
+                   （開始位置は目次の後ろ＝データ部の先頭から）
+  列の持ち方:
+    {"kind": "text", "ends": ..., "blob": ...}  行ごとの終わり位置（uint32、行数+1 個）＋ UTF-8 をつなげたもの
+    {"kind": "dict", "ends": ..., "blob": ..., "codes": ...}
+        値の種類が少ない列。値の一覧（text と同じ形）＋行ごとの値の番号（uint32）
+  ids : 在庫 ID の順に並べた行番号（uint32）。ID → 行 を二分探索で引く
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+
+import records
+from durable import FileLock, atomic_write
+from storage import version_key
+
+
+_HEADER = struct.Struct("<4sIII")
+_MAGIC = b"ISNP"
+_FORMAT = 3
+_ALIGN = 8
+
+
+def _aligned(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class _Builder:
+    """データ部を組み立てる"""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def add(self, raw):
+        """ブロックを足して [開始位置, 長さ] を返す"""
+        self.data.extend(b"\0" * (_aligned(len(self.data)) - len(self.data)))
+        start = len(self.data)
+        self.data.extend(raw)
+        return [start, len(raw)]
+
+    def add_text(self, values):
+        ends = array("I", [0])
+        parts = []
+        pos = 0
+        for v in values:
+            b = v.encode("utf-8")
+            parts.append(b)
+            pos += len(b)
+            ends.append(pos)
+        return {"ends": self.add(ends.tobytes()), "blob": self.add(b"".join(parts))}
+
+
+def _cells(row, width):
+    v = [("" if x is None else str(x)) for x in list(row)[:width]]
+    if len(v) < width:
+        v += [""] * (width - len(v))
+    return v
+
+
+def _encode_base(builder, version, rows, width, id_col):
+    """拠点の行をデータ部に書き、目次（拠点の分）を返す"""
+    table = [_cells(r, width) for r in rows]
+    n = len(table)
+    columns = []
+    for c in range(width):
+        values = [r[c] for r in table]
+        distinct = {}
+        for v in values:
+            distinct.setdefault(v, len(distinct))
+        if len(distinct) * 2 <= n:
+            # 同じ値が多い列は番号で持つ
+            col = builder.add_text(list(distinct))
+            col["kind"] = "dict"
+            col["codes"] = builder.add(array("I", [distinct[v] for v in values]).tobytes())
+        else:
+            col = builder.add_text(values)
+            col["kind"] = "text"
+        columns.append(col)
+    order = sorted(range(n), key=lambda i: table[i][id_col])
+    return {
+        "version": version_key(version),
+        "rows": n,
+        "columns": columns,
+        "ids": builder.add(array("I", order).tobytes()),
+    }
+
+
+class _TextColumn:
+    __slots__ = ("ends", "blob")
+
+    def __init__(self, data, col):
+        s, n = col["ends"]
+        self.ends = data[s:s + n].cast("I")
+        s, n = col["blob"]
+        self.blob = data[s:s + n]
+
+    def __len__(self):
+        return len(self.ends) - 1
+
+    def __getitem__(self, i):
+        return str(self.blob[self.ends[i]:self.ends[i + 1]], "utf-8")
+
+
+def _dict_column(data, col):
+    """
+    値の種類が少ない列は、このプロセスで行ごとの値のリストに広げる
+    （文字列は種類の数だけで、全行で共有する。増えるのは1行あたりポインタ1つ分）
+    """
+    text = _TextColumn(data, col)
+    values = [sys.intern(text[i]) for i in range(len(text))]
+    s, n = col["codes"]
+    return [values[code] for code in data[s:s + n].cast("I")]
+
+
+class BaseView:
+    """
+    スナップショットの拠点1つ分。行（SnapshotRow）のシーケンスとして使える。
+    値の種類が多い列（品番・摘要・ID など）はアクセスしたときに mmap から読む
+    （このプロセスに在庫全体のコピーは作らない）
+    get(在庫ID) で行位置を引ける（在庫キャッシュの ID 索引の代わり）
+    """
+
+    def __init__(self, data, meta, width, id_col):
+        self.version = meta["version"]
+        self.width = width
+        self._n = meta["rows"]
+        self._columns = [
+            _dict_column(data, col) if col["kind"] == "dict" else _TextColumn(data, col)
+            for col in meta["columns"]
+        ]
+        self._id_column = self._columns[id_col]
+        s, n = meta["ids"]
+        self._ids = data[s:s + n].cast("I")
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [SnapshotRow(self, j) for j in range(self._n)[i]]
+        if i < 0:
+            i += self._n
+        if not 0 <= i < self._n:
+            raise IndexError(i)
+        return SnapshotRow(self, i)
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield SnapshotRow(self, i)
+
+    def row(self, i):
+        return tuple(col[i] for col in self._columns)
+
+    def distinct(self, c):
+        """列 c に出てくる値の集合"""
+        return set(self._columns[c]) if self._n else set()
+
+    def get(self, item_id, default=None):
+        """在庫 ID → 行位置（無ければ default）"""
+        if not item_id:
+            return default
+        ids, id_column = self._ids, self._id_column
+        lo, hi = 0, len(ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if id_column[ids[mid]] < item_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(ids) and id_column[ids[lo]] == item_id:
+            return ids[lo]
+        return default
+
+
+class SnapshotRow(records.RecordBase):
+    """
+    スナップショットの在庫1行。行と同じく row[i]・len(row)・list(row) が使える
+    上代・下代・区分・並べ替えキーは、そのつど列の値から作る（records.RecordBase）
+    """
+
+    __slots__ = ("_view", "_i")
+
+    def __init__(self, view, i):
+        self._view = view
+        self._i = i
+
+    def __getitem__(self, c):
+        if c.__class__ is int:
+            return self._view._columns[c][self._i]
+        return self._view.row(self._i)[c]
+
+    def __iter__(self):
+        return iter(self._view.row(self._i))
+
+
+class InventorySnapshot:
+
+    def __init__(self, path, headers, id_col, is_current=None, on_published=None):
+        """
+        path         : スナップショットを置くディレクトリ
+        is_current   : (拠点名, バージョン) → まだ在庫がそのバージョンか。
+                       publish_later() で書く前に確かめる（古くなっていれば書かない）
+        on_published : (拠点名, バージョン) を受ける。publish_later() で書き終えたときに呼ぶ
+        """
+        self.path = path
+        self.headers = list(headers)
+        self.width = len(self.headers)
+        self.id_col = id_col
+        self.is_current = is_current
+        self.on_published = on_published
+        self._lock = threading.Lock()
+        self._files = {}        # 拠点名 → (stat, データ部の memoryview, 目次)
+        self._locks = {}        # 拠点名 → FileLock
+        self._pending = {}      # 拠点名 → (バージョン, 行)。バックグラウンドで書く分
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+
+    def file_path(self, base_name):
+        return os.path.join(self.path, base_name + ".snap")
+
+    def lock(self, base_name):
+        """拠点のファイルを書くときのロック（プロセスをまたぐ）"""
+        with self._lock:
+            lock = self._locks.get(base_name)
+            if lock is None:
+                lock = self._locks[base_name] = FileLock(
+                    os.path.join(self.path, ".locks", base_name + ".lock"))
+            return lock
+
+    def _open(self, path):
+        """ファイルを mmap して (データ部, 目次) を返す。使えないファイルなら None"""
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None  # 無い・空
+        if len(mm) < _HEADER.size:
+            return None
+        magic, fmt, dir_len, _ = _HEADER.unpack_from(mm, 0)
+        if magic != _MAGIC or fmt != _FORMAT:
+            return None
+        try:
+            meta = json.loads(mm[_HEADER.size:_HEADER.size + dir_len])
+        except ValueError:
+            return None
+        if meta.get("byteorder") != sys.byteorder or meta.get("headers") != self.headers:
+            return None
+        return memoryview(mm)[_aligned(_HEADER.size + dir_len):], meta
+
+    def _current(self, base_name):
+        """拠点のファイルの (データ部, 目次)。置き換わっていれば開き直す。無い・使えなければ None"""
+        path = self.file_path(base_name)
+        try:
+            st = os.stat(path)
+            stat = (st.st_ino, st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stat = None
+        with self._lock:
+            cached = self._files.get(base_name)
+            if cached is not None and cached[0] == stat:
+                return cached[1]
+        # 古いファイルの mmap は、それを使っている BaseView が無くなれば解放される
+        opened = self._open(path) if stat is not None else None
+        with self._lock:
+            self._files[base_name] = (stat, opened)
+        return opened
+
+    def base(self, base_name, version):
+        """
+        在庫が version のときの拠点の BaseView。スナップショットに無い・古ければ None
+        （ここでは BaseView を持っておかない。使う側がキャッシュし、捨てればその拠点の分のメモリが空く）
+        """
+        opened = self._current(base_name)
+        if opened is None or opened[1]["version"] != version_key(version):
+            return None
+        data, meta = opened
+        return BaseView(data, meta, self.width, self.id_col)
+
+    def publish(self, updates, is_current=None):
+        """
+        updates: {拠点名: (バージョン, 行)}。その拠点のファイルを書き直す
+        （拠点ごとにロックする。待っている間に他のワーカーが同じバージョンを書いていれば書かない。
+          is_current が偽を返す拠点も、在庫がもう変わっているので書かない）
+        """
+        os.makedirs(self.path, exist_ok=True)
+        for name, (version, rows) in updates.items():
+            with self.lock(name):
+                opened = self._current(name)
+                if opened is not None and opened[1]["version"] == version_key(version):
+                    continue
+                if is_current is not None and not is_current(name, version):
+                    continue
+                builder = _Builder()
+                meta = _encode_base(builder, version, rows, self.width, self.id_col)
+                directory = json.dumps(
+                    dict(meta, byteorder=sys.byteorder, headers=self.headers),
+                    ensure_ascii=False,
+                ).encode("utf-8")
+                head = _HEADER.pack(_MAGIC, _FORMAT, len(directory), 0) + directory
+                with atomic_write(self.file_path(name), "wb") as f:
+                    f.write(head)
+                    f.write(b"\0" * (_aligned(len(head)) - len(head)))
+                    f.write(builder.data)
+
+    # --- バックグラウンドで書く ---
+    def publish_later(self, base_name, version, rows):
+        """
+        拠点のファイルの書き直しをバックグラウンドのスレッドに任せる（すぐ戻る）
+        同じ拠点がまだ書かれていなければ、新しいほうだけ書く
+        """
+        with self._lock:
+            self._pending[base_name] = (version, rows)
+        self._ensure_worker()
+        self._wake.set()
+
+    def _ensure_worker(self):
+        """このプロセスでスレッドが動いていなければ起動する（fork 後の子プロセスでも）"""
+        pid = os.getpid()
+        with self._lock:
+            if self._thread is not None and self._thread_pid == pid and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="snapshot", daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            for name, (version, rows) in pending.items():
+                try:
+                    self.publish({name: (version, rows)}, self.is_current)
+                except OSError as e:
+                    print("[snapshot] publish failed:", name, e)
+                    continue
+                if self.on_published is not None:
+                    self.on_published(name, version)
+
+    def status(self):
+        """{"bases": {拠点名: 行数}, "size": ファイルの合計バイト数}"""
+        bases, size = {}, 0
+        try:
+            names = sorted(f for f in os.listdir(self.path) if f.endswith(".snap"))
+        except FileNotFoundError:
+            names = []
+        for f in names:
+            base_name = f[:-len(".snap")]
+            opened = self._current(base_name)
+            if opened is None:
+                continue
+            bases[base_name] = opened[1]["rows"]
+            size += os.path.getsize(self.file_path(base_name))
+        return {"bases": bases, "size": size}
@@ -0,0 +1,642 @@
+"""
+在庫・ログの保存先（ストレージエンジン）
+
+- CsvStorage    : 従来どおり data/<拠点名>.csv に保存。ログは data/log/ に月別（締めた月は gzip）
+- SqliteStorage : ローカルの SQLite（WAL モード）に保存。1行の編集や出庫は行単位の UPDATE/DELETE
+
+どちらも同じメソッドを持つので、app.py からは STORAGE 経由で同じように呼べる。
+行データはどちらも「CSV と同じ並びの文字列リスト」でやりとりする。
+
+在庫1点ごとに、再利用しない ID（HEADERS の末尾「ID」列）を振る。
+No. は並び順の連番なので出庫のたびにずれるが、ID は変わらない。
+
+複数ワーカー（gunicorn）で動かしてよいように：
+  - 拠点ごとのロック lock_base(拠点名)。読み込み → 書き換え → 保存はこの中で行う
+  - CSV の書き込みは一時ファイル＋fsync＋rename（途中で落ちても書きかけのファイルは残らない）
+  - CSV のログ追記は、同時に来た分をジャーナル経由で1回の書き込みにまとめる
+"""
+import csv
+import json
+import os
+import sqlite3
+import threading
+
+from durable import FileLock, GroupCommit, atomic_write, fsync_dir
+from logstore import PartitionedLogStore, normalize_date
+
+
+# HEADERS / LOG_HEADERS と同じ並びの SQL 列名（フォームの name と揃えてある）
+INVENTORY_COLUMNS = [
+    "no", "shukko", "jigan", "item", "chuseki", "size", "hinban",
+    "uedai", "gedai", "wakishi", "chain_len", "tekiyo", "input_user", "nyuko_date", "gedai_numeric",
+    "item_id",
+]
+
+LOG_COLUMNS = [
+    "mode", "base",
+    "no", "jigan", "item", "chuseki", "size", "hinban",
+    "uedai", "gedai", "wakishi", "chain_len", "tekiyo", "input_user",
+    "nyuko_date", "shukko_date", "memo", "gedai_numeric",
+    "item_id",
+]
+
+# 在庫 ID の書式（No. の連番と見分けがつくよう先頭に S を付ける）
+ITEM_ID_FORMAT = "S{:07d}"
+
+
+def item_id_number(item_id):
+    """在庫 ID の番号（"S0000123" → 123）。形が違えば 0"""
+    item_id = item_id or ""
+    return int(item_id[1:]) if item_id[:1] == "S" and item_id[1:].isdigit() else 0
+
+
+class BaseLocks:
+    """拠点ごとの FileLock（lock_dir/<拠点名>.lock）"""
+
+    def __init__(self, lock_dir):
+        self.lock_dir = lock_dir
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def __call__(self, base_name):
+        with self._guard:
+            lock = self._locks.get(base_name)
+            if lock is None:
+                lock = self._locks[base_name] = FileLock(os.path.join(self.lock_dir, f"{base_name}.lock"))
+        return lock
+
+
+def version_key(version):
+    """inventory_version の値を JSON に通しても比べられる形にする（CSV の (inode, mtime_ns, size) はリストに）"""
+    return list(version) if isinstance(version, (tuple, list)) else version
+
+
+def _fit(row, width):
+    """列数を width に揃える（足りなければ空文字で埋め、多ければ切る）"""
+    row = ["" if v is None else str(v) for v in row[:width]]
+    if len(row) < width:
+        row += [""] * (width - len(row))
+    return row
+
+
+class CsvStorage:
+    """拠点ごとの CSV ＋ 月別のログ（data/log/）"""
+
+    name = "csv"
+
+    def __init__(self, data_dir, headers, log_headers):
+        self.data_dir = data_dir
+        self.headers = headers
+        self.log_headers = log_headers
+        self.log = PartitionedLogStore(
+            os.path.join(data_dir, "log"), log_headers,
+            legacy_file=os.path.join(data_dir, "log.csv"),
+        )
+        self.item_seq_file = os.path.join(data_dir, "item_seq.txt")
+        self.journal_file = os.path.join(data_dir, "checkout.journal")
+        lock_dir = os.path.join(data_dir, ".locks")
+        self.lock_base = BaseLocks(lock_dir)
+        self._seq_lock = FileLock(os.path.join(lock_dir, "item_seq.lock"))
+        # ログ（とジャーナル）はログ側のロックで守る。同時に来た追記は1回にまとめて書く
+        self._log_lock = self.log.lock
+        self._log_commit = GroupCommit(self._write_log_batch)
+        self.recover()
+
+    # --- 在庫 ID ---
+    def allocate_item_ids(self, count):
+        """新しい在庫 ID を count 個払い出す（採番済みの最大値をファイルに保存）"""
+        if count <= 0:
+            return []
+        with self._seq_lock:
+            last = self.last_item_seq()
+            os.makedirs(self.data_dir, exist_ok=True)
+            with atomic_write(self.item_seq_file, encoding="utf-8") as f:
+                f.write(str(last + count))
+        return [ITEM_ID_FORMAT.format(n) for n in range(last + 1, last + count + 1)]
+
+    def last_item_seq(self):
+        """払い出し済みの在庫 ID の最大の番号（data/item_seq.txt。無ければ 0）"""
+        try:
+            with open(self.item_seq_file, encoding="utf-8") as f:
+                text = f.read().strip()
+        except FileNotFoundError:
+            return 0
+        return int(text) if text.isdigit() else 0
+
+    # --- 在庫 ---
+    def inventory_path(self, base_name):
+        return os.path.join(self.data_dir, f"{base_name}.csv")
+
+    def inventory_version(self, base_name):
+        """
+        キャッシュ検証用の (inode, mtime_ns, size)。ファイルがなければ None
+        保存は rename で差し替えるので、同じ mtime・同じサイズで書き直されても inode で見分けられる
+        """
+        self._check_journal()
+        try:
+            st = os.stat(self.inventory_path(base_name))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def load_inventory(self, base_name):
+        self._check_journal()  # 落ちたワーカーの出庫を反映してから読む
+        path = self.inventory_path(base_name)
+        if not os.path.exists(path):
+            return []
+        with open(path, newline="", encoding="utf-8") as f:
+            return list(csv.reader(f))[1:]  # ヘッダー行除外
+
+    def _write_inventory(self, path, rows, sync=False):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.headers)
+            for i, row in enumerate(rows, start=1):
+                row[0] = str(i)  # No. を振り直す
+                writer.writerow(row)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def save_inventory(self, base_name, rows):
+        """全行書き込み（一時ファイルに書いて置き換える）。書き込み後のバージョンを返す"""
+        os.makedirs(self.data_dir, exist_ok=True)
+        with self.lock_base(base_name):
+            path = self.inventory_path(base_name)
+            tmp_path = path + ".tmp"
+            self._write_inventory(tmp_path, rows, sync=True)
+            os.replace(tmp_path, path)
+            fsync_dir(self.data_dir)
+            return self.inventory_version(base_name)
+
+    def update_inventory_row(self, base_name, rows, index):
+        """
+        rows[index] を書き換えた後に呼ぶ。CSV は全体を書き直すしかない
+        （ほかの行はレコードのままでよい。書くときだけリストにする）
+        """
+        return self.save_inventory(base_name, [list(r) for r in rows])
+
+    def insert_inventory_rows(self, base_name, rows, positions):
+        """
+        rows[i]（i in positions）を差し込んだ後に呼ぶ。CSV は全体を書き直すしかない
+        （rows の既存の行はレコードのままでよい。書くときだけリストにする。No. は呼び出し側で振り直す）
+        """
+        return self.save_inventory(base_name, [list(r) for r in rows])
+
+    def commit_checkout(self, base_name, rows, removed, log_rows):
+        """
+        出庫：在庫の書き換えとログの追記を1つの単位でコミットする。
+        rows は出庫後の在庫一覧、removed は出庫した行、log_rows は追記するログ。
+
+        1) 出庫後の在庫を一時ファイルに書く
+        2) ジャーナルに「追記前のログサイズ」と追記内容を書く
+        3) ログにまとめて追記
+        4) 一時ファイルを在庫ファイルに置き換える（rename なので一瞬で切り替わる）
+        5) ジャーナルを消す
+        途中で落ちても、次に在庫を読む・書くワーカー（か次回起動時の recover()）がジャーナルから 3)〜5) をやり直す。
+        """
+        os.makedirs(self.data_dir, exist_ok=True)
+        with self.lock_base(base_name):
+            # 落ちたワーカーの一時ファイルを上書きする前に、その出庫を反映しておく
+            self._check_journal()
+            path = self.inventory_path(base_name)
+            tmp_path = path + ".tmp"
+            self._write_inventory(tmp_path, rows, sync=True)
+            with self._log_lock:
+                self._commit_journal(log_rows, inventory=path, tmp=tmp_path)
+            return self.inventory_version(base_name)
+
+    def _commit_journal(self, log_rows, **extra):
+        """
+        ジャーナル（追記前のログサイズ＋追記内容。出庫なら在庫の置き換えも）を書いてから反映する
+        ログのロックを持って呼ぶ。落ちたワーカーのジャーナルが残っていれば、上書きする前にやり直す
+        """
+        self._recover_locked()
+        log_file = self.log.active_file()
+        log_size = os.path.getsize(log_file) if os.path.exists(log_file) else 0
+        journal = dict(extra, log=log_file, log_size=log_size, log_rows=log_rows)
+        with open(self.journal_file, "w", encoding="utf-8") as f:
+            json.dump(journal, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._apply_journal(journal)
+        self.log.close_old_months()
+
+    def _apply_journal(self, journal):
+        # ログは「追記前のサイズ」まで戻してから追記するので、何度やり直しても二重にならない
+        with open(journal["log"], "a+b") as f:
+            f.truncate(journal["log_size"])
+        with open(journal["log"], "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(journal["log_rows"])
+            f.flush()
+            os.fsync(f.fileno())
+        if journal.get("tmp") and os.path.exists(journal["tmp"]):
+            os.replace(journal["tmp"], journal["inventory"])
+            fsync_dir(os.path.dirname(journal["inventory"]))
+        os.remove(self.journal_file)
+
+    def recover(self):
+        """前回の出庫・ログ追記が途中で止まっていたら、ジャーナルから最後までやり直す"""
+        with self._log_lock:
+            self._recover_locked()
+
+    def _recover_locked(self):
+        """
+        ログのロックを持って呼ぶ。ジャーナルは書いたワーカーがロックを持ったまま消すので、
+        ロックを取れた時点で残っているのは途中で落ちたワーカーの分
+        """
+        if not os.path.exists(self.journal_file):
+            return
+        try:
+            with open(self.journal_file, encoding="utf-8") as f:
+                journal = json.load(f)
+        except ValueError:
+            # ジャーナル自体が書きかけ＝まだ何も反映していないので捨てる
+            os.remove(self.journal_file)
+            return
+        self._apply_journal(journal)
+
+    def _check_journal(self):
+        """
+        他のワーカーが途中で落ちてジャーナルが残っていれば、ここでやり直す
+        （在庫を読む前に出庫を最後まで反映しておく。残っていなければ stat 1回だけ）
+        """
+        if os.path.exists(self.journal_file):
+            self.recover()
+
+    # --- ログ ---
+    def append_log(self, log_rows):
+        """追記が終わる（fsync する）まで待つ。同時に来た追記とまとめて1回で書く"""
+        if log_rows:
+            self._log_commit.submit(log_rows)
+
+    def _write_log_batch(self, log_rows):
+        with self._log_lock:
+            self._commit_journal(log_rows)
+
+    def log_version(self):
+        """キャッシュ検証用のログのバージョン"""
+        return self.log.version()
+
+    def load_log(self):
+        """(キー, 行) のリストを書き込み順で返す。キーは YYYY-MM:行番号（月別ファイル内の行番号）"""
+        return self.log.load_all()
+
+    def iter_log(self, mode=None, date_from=None, date_to=None):
+        """(キー, 行) を古い順にストリームで返す。日付は出庫なら出庫日、それ以外は入庫日"""
+        return self.log.iter_rows(mode, date_from, date_to)
+
+    def read_log_page(self, mode=None, offset=0, limit=100):
+        """新しい順に1ページ分。戻り値: ([(キー, 行)], 該当件数)"""
+        return self.log.read_page(mode, offset, limit)
+
+    def update_log_memos(self, memos):
+        """memos: {キー: メモ}。戻り値: {キー: メモを差し替えたログ行}（変わったものだけ）"""
+        return self.log.update_memos(memos)
+
+    def parse_log_key(self, value):
+        return self.log.parse_key(value)
+
+
+class SqliteStorage:
+    """SQLite（WAL）に在庫とログをまとめて保存する"""
+
+    name = "sqlite"
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        d = os.path.dirname(db_path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        # 1回の書き込みは SQLite のトランザクションで守られる。
+        # 読み込み → 書き換え → 保存をまたいで他のワーカーを待たせるときに使う
+        self.lock_base = BaseLocks(os.path.join(d, ".locks"))
+        self._init_schema()
+
+    def _conn(self):
+        # sqlite3 の接続はスレッドをまたげないので、スレッドごとに持つ
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        inv_cols = ", ".join(f"{c} TEXT NOT NULL DEFAULT ''" for c in INVENTORY_COLUMNS[1:])
+        log_cols = ", ".join(f"{c} TEXT NOT NULL DEFAULT ''" for c in LOG_COLUMNS)
+        conn = self._conn()
+        with conn:
+            # 古いスキーマで作った DB には後から増えた列を足す
+            for table, columns in (("inventory", INVENTORY_COLUMNS[1:]), ("log", LOG_COLUMNS)):
+                have = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+                if have:
+                    for c in columns:
+                        if c not in have:
+                            conn.execute(f"ALTER TABLE {table} ADD COLUMN {c} TEXT NOT NULL DEFAULT ''")
+            conn.executescript(f"""
+                CREATE TABLE IF NOT EXISTS inventory (
+                    id   INTEGER PRIMARY KEY,
+                    base TEXT NOT NULL,
+                    pos  INTEGER NOT NULL,
+                    {inv_cols}
+                );
+                CREATE INDEX IF NOT EXISTS idx_inventory_base_pos ON inventory(base, pos);
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_item_id
+                    ON inventory(item_id) WHERE item_id != '';
+                CREATE INDEX IF NOT EXISTS idx_inventory_hinban   ON inventory(hinban);
+                CREATE INDEX IF NOT EXISTS idx_inventory_nyuko    ON inventory(nyuko_date);
+                CREATE INDEX IF NOT EXISTS idx_inventory_item     ON inventory(item);
+
+                CREATE TABLE IF NOT EXISTS log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    {log_cols}
+                );
+                CREATE INDEX IF NOT EXISTS idx_log_mode   ON log(mode, id);
+                CREATE INDEX IF NOT EXISTS idx_log_base   ON log(base);
+                CREATE INDEX IF NOT EXISTS idx_log_hinban ON log(hinban);
+                CREATE INDEX IF NOT EXISTS idx_log_nyuko  ON log(nyuko_date);
+                CREATE INDEX IF NOT EXISTS idx_log_shukko ON log(shukko_date);
+
+                CREATE TABLE IF NOT EXISTS versions (
+                    name    TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                );
+            """)
+
+    def _bump(self, conn, name):
+        conn.execute(
+            "INSERT INTO versions(name, version) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+            (name,),
+        )
+
+    def _version(self, conn, name):
+        r = conn.execute("SELECT version FROM versions WHERE name = ?", (name,)).fetchone()
+        return r[0] if r else 0
+
+    # --- 在庫 ID ---
+    def allocate_item_ids(self, count):
+        if count <= 0:
+            return []
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO versions(name, version) VALUES ('item_id_seq', ?) "
+                "ON CONFLICT(name) DO UPDATE SET version = version + ?",
+                (count, count),
+            )
+            last = self._version(conn, "item_id_seq")
+        return [ITEM_ID_FORMAT.format(n) for n in range(last - count + 1, last + 1)]
+
+    # --- 在庫 ---
+    def inventory_version(self, base_name):
+        return self._version(self._conn(), f"inventory:{base_name}")
+
+    def load_inventory(self, base_name):
+        cols = ", ".join(INVENTORY_COLUMNS[1:])
+        cur = self._conn().execute(
+            f"SELECT {cols} FROM inventory WHERE base = ? ORDER BY pos", (base_name,)
+        )
+        # No. は並び順から振る（CSV の「保存時に振り直す」と同じ結果になる）
+        return [[str(i)] + list(r) for i, r in enumerate(cur, start=1)]
+
+    def save_inventory(self, base_name, rows):
+        width = len(INVENTORY_COLUMNS)
+        cols = ", ".join(INVENTORY_COLUMNS[1:])
+        marks = ", ".join("?" for _ in INVENTORY_COLUMNS[1:])
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM inventory WHERE base = ?", (base_name,))
+            params = []
+            for i, row in enumerate(rows, start=1):
+                row[0] = str(i)  # No. を振り直す
+                params.append([base_name, i] + _fit(row, width)[1:])
+            conn.executemany(
+                f"INSERT INTO inventory(base, pos, {cols}) VALUES (?, ?, {marks})", params
+            )
+            self._bump(conn, f"inventory:{base_name}")
+            return self._version(conn, f"inventory:{base_name}")
+
+    def update_inventory_row(self, base_name, rows, index):
+        """在庫 ID で rows[index] の1行だけ UPDATE（ファイル全体の書き直しはしない。ほかの行は見ない）"""
+        width = len(INVENTORY_COLUMNS)
+        sets = ", ".join(f"{c} = ?" for c in INVENTORY_COLUMNS[1:])
+        row = _fit(rows[index], width)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                f"UPDATE inventory SET {sets} WHERE base = ? AND item_id = ?",
+                row[1:] + [base_name, row[-1]],
+            )
+            self._bump(conn, f"inventory:{base_name}")
+            return self._version(conn, f"inventory:{base_name}")
+
+    def insert_inventory_rows(self, base_name, rows, positions):
+        """
+        入庫：rows（差し込んだ後の全行。既存の行はレコードのままでよい）のうち positions の行だけを INSERT する。
+        後ろの行の pos を1つずつずらして場所を空ける（出庫で pos に隙間があっても並びは保たれる）
+        """
+        width = len(INVENTORY_COLUMNS)
+        id_col = width - 1
+        cols = ", ".join(INVENTORY_COLUMNS[1:])
+        marks = ", ".join("?" for _ in INVENTORY_COLUMNS[1:])
+        new = set(positions)
+        conn = self._conn()
+        with conn:
+            for i in sorted(positions):
+                # 差し込む位置の直後にある既存の行（無ければ末尾に足す）
+                anchor = next((j for j in range(i + 1, len(rows)) if j not in new), None)
+                found = None
+                if anchor is not None:
+                    found = conn.execute(
+                        "SELECT pos FROM inventory WHERE base = ? AND item_id = ?",
+                        (base_name, rows[anchor][id_col]),
+                    ).fetchone()
+                if found is None:
+                    pos = conn.execute(
+                        "SELECT COALESCE(MAX(pos), 0) + 1 FROM inventory WHERE base = ?", (base_name,)
+                    ).fetchone()[0]
+                else:
+                    pos = found[0]
+                    conn.execute(
+                        "UPDATE inventory SET pos = pos + 1 WHERE base = ? AND pos >= ?", (base_name, pos)
+                    )
+                conn.execute(
+                    f"INSERT INTO inventory(base, pos, {cols}) VALUES (?, ?, {marks})",
+                    [base_name, pos] + _fit(rows[i], width)[1:],
+                )
+            # No. は読み込み時に並び順から振り直される（rows の No. は呼び出し側で振り直す）
+            self._bump(conn, f"inventory:{base_name}")
+            return self._version(conn, f"inventory:{base_name}")
+
+    def commit_checkout(self, base_name, rows, removed, log_rows):
+        """出庫：出庫した行だけ在庫 ID で DELETE し、ログの INSERT と同じトランザクションでコミット"""
+        id_col = len(INVENTORY_COLUMNS) - 1
+        width = len(LOG_COLUMNS)
+        cols = ", ".join(LOG_COLUMNS)
+        marks = ", ".join("?" for _ in LOG_COLUMNS)
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "DELETE FROM inventory WHERE base = ? AND item_id = ?",
+                [(base_name, r[id_col]) for r in removed if len(r) > id_col and r[id_col]],
+            )
+            conn.executemany(
+                f"INSERT INTO log({cols}) VALUES ({marks})",
+                [_fit(r, width) for r in log_rows],
+            )
+            # No. は読み込み時に並び順から振り直される
+            for i, row in enumerate(rows, start=1):
+                row[0] = str(i)
+            self._bump(conn, "log")
+            self._bump(conn, f"inventory:{base_name}")
+            return self._version(conn, f"inventory:{base_name}")
+
+    # --- ログ ---
+    def append_log(self, log_rows):
+        width = len(LOG_COLUMNS)
+        cols = ", ".join(LOG_COLUMNS)
+        marks = ", ".join("?" for _ in LOG_COLUMNS)
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                f"INSERT INTO log({cols}) VALUES ({marks})",
+                [_fit(r, width) for r in log_rows],
+            )
+            self._bump(conn, "log")
+
+    def log_version(self):
+        return self._version(self._conn(), "log")
+
+    def load_log(self):
+        """(キー, 行) のリストを書き込み順で返す。キーはログの id"""
+        cols = ", ".join(LOG_COLUMNS)
+        cur = self._conn().execute(f"SELECT id, {cols} FROM log ORDER BY id")
+        return [(r[0], list(r[1:])) for r in cur]
+
+    def iter_log(self, mode=None, date_from=None, date_to=None):
+        """
+        (キー, 行) を古い順にストリームで返す。
+        日付は出庫なら出庫日、それ以外は入庫日（idx_log_shukko / idx_log_nyuko を使う）
+        """
+        cols = ", ".join(LOG_COLUMNS)
+        where, params = [], []
+        if mode:
+            where.append("mode = ?")
+            params.append(mode)
+        if date_from or date_to:
+            lo = normalize_date(date_from) if date_from else ""
+            hi = normalize_date(date_to) if date_to else "9999/99/99"
+            where.append(
+                "((mode = '出庫' AND shukko_date BETWEEN ? AND ?)"
+                " OR (mode <> '出庫' AND nyuko_date BETWEEN ? AND ?))"
+            )
+            params += [lo, hi, lo, hi]
+        sql = f"SELECT id, {cols} FROM log"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        for r in self._conn().execute(sql + " ORDER BY id", params):
+            yield r[0], list(r[1:])
+
+    def read_log_page(self, mode=None, offset=0, limit=100):
+        """新しい順に1ページ分（idx_log_mode を使う）。戻り値: ([(キー, 行)], 該当件数)"""
+        cols = ", ".join(LOG_COLUMNS)
+        conn = self._conn()
+        if mode:
+            total = conn.execute("SELECT COUNT(*) FROM log WHERE mode = ?", (mode,)).fetchone()[0]
+            cur = conn.execute(
+                f"SELECT id, {cols} FROM log WHERE mode = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                (mode, limit, offset),
+            )
+        else:
+            total = conn.execute("SELECT COUNT(*) FROM log").fetchone()[0]
+            cur = conn.execute(
+                f"SELECT id, {cols} FROM log ORDER BY id DESC LIMIT ? OFFSET ?", (limit, offset)
+            )
+        return [(r[0], list(r[1:])) for r in cur], total
+
+    def update_log_memos(self, memos):
+        if not memos:
+            return {}
+        cols = ", ".join(LOG_COLUMNS)
+        memo_col = LOG_COLUMNS.index("memo")
+        keys = list(memos)
+        conn = self._conn()
+        changed = {}
+        with conn:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                marks = ", ".join("?" for _ in chunk)
+                for r in conn.execute(f"SELECT id, {cols} FROM log WHERE id IN ({marks})", chunk):
+                    row = list(r[1:])
+                    if row[memo_col] != memos[r[0]]:
+                        row[memo_col] = memos[r[0]]
+                        changed[r[0]] = row
+            if changed:
+                conn.executemany(
+                    "UPDATE log SET memo = ? WHERE id = ?",
+                    [(row[memo_col], key) for key, row in changed.items()],
+                )
+                self._bump(conn, "log")
+        return changed
+
+    def parse_log_key(self, value):
+        return int(value)
+
+
+def create_storage(backend, data_dir, headers, log_headers, sqlite_path=None):
+    """設定値からストレージエンジンを作る"""
+    if backend == "sqlite":
+        return SqliteStorage(sqlite_path or os.path.join(data_dir, "inventory.db"))
+    if backend == "csv":
+        return CsvStorage(data_dir, headers, log_headers)
+    raise ValueError(f"未対応の STORAGE_BACKEND です: {backend}")
+
+
+def migrate_csv_to_sqlite(csv_storage, sqlite_storage, base_names):
+    """
+    既存の data/*.csv と data/log/ のログを SQLite に移す（一回限りの移行用）
+    戻り値: {拠点名: 件数, "log": 件数}
+    """
+    counts = {}
+    per_base = {}
+    # CSV 側で払い出し済みの ID を二度と使わないよう、採番カウンタを引き継ぐ。
+    # 出庫済みの ID は在庫に残らないので、採番ファイルとログの ID も見る
+    max_seq = csv_storage.last_item_seq()
+    for base in base_names:
+        rows = [_fit(r, len(INVENTORY_COLUMNS)) for r in csv_storage.load_inventory(base)]
+        for r in rows:
+            max_seq = max(max_seq, item_id_number(r[-1]))
+        per_base[base] = rows
+
+    log_id_col = LOG_COLUMNS.index("item_id")
+    log_rows = [row for _, row in csv_storage.load_log() if row]
+    for row in log_rows:
+        if len(row) > log_id_col:
+            max_seq = max(max_seq, item_id_number(row[log_id_col]))
+
+    conn = sqlite_storage._conn()
+    with conn:
+        conn.execute(
+            "INSERT INTO versions(name, version) VALUES ('item_id_seq', ?) "
+            "ON CONFLICT(name) DO UPDATE SET version = max(version, excluded.version)",
+            (max_seq,),
+        )
+
+    for base, rows in per_base.items():
+        missing = [r for r in rows if not r[-1]]
+        for r, item_id in zip(missing, sqlite_storage.allocate_item_ids(len(missing))):
+            r[-1] = item_id
+        sqlite_storage.save_inventory(base, rows)
+        counts[base] = len(rows)
+
+    conn = sqlite_storage._conn()
+    with conn:
+        conn.execute("DELETE FROM log")
+    sqlite_storage.append_log(log_rows)
+    counts["log"] = len(log_rows)
+    return counts
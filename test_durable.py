@@ -0,0 +1,171 @@
+"""
+durable（atomic_write・FileLock・GroupCommit）のテスト
+
+  python -m pytest -q test_durable.py   （または python -m unittest test_durable）
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from durable import FileLock, GroupCommit, atomic_write
+
+
+class AtomicWriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "a.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_replaces_whole_file(self):
+        with open(self.path, "w") as f:
+            f.write("old contents that are longer")
+        with atomic_write(self.path, encoding="utf-8") as f:
+            f.write("新しい")
+        with open(self.path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), "新しい")
+        self.assertEqual(os.listdir(self.dir), ["a.txt"])
+
+    def test_error_keeps_original_and_removes_tmp(self):
+        with open(self.path, "w") as f:
+            f.write("old")
+        with self.assertRaises(RuntimeError):
+            with atomic_write(self.path) as f:
+                f.write("half")
+                raise RuntimeError("crash")
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "old")
+        self.assertEqual(os.listdir(self.dir), ["a.txt"])
+
+
+class FileLockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.lock = FileLock(os.path.join(self.dir, "locks", "x.lock"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def try_from_other_thread(self, lock=None):
+        """別スレッドから待たずに取れるか"""
+        lock = lock or self.lock
+        got = []
+
+        def run():
+            ok = lock.acquire(blocking=False)
+            got.append(ok)
+            if ok:
+                lock.release()
+
+        t = threading.Thread(target=run)
+        t.start()
+        t.join()
+        return got[0]
+
+    def test_reentrant_in_same_thread(self):
+        with self.lock:
+            with self.lock:
+                self.assertTrue(self.lock.held())
+            # 内側を出てもまだ持っている
+            self.assertTrue(self.lock.held())
+            self.assertFalse(self.try_from_other_thread())
+        self.assertFalse(self.lock.held())
+        self.assertTrue(self.try_from_other_thread())
+
+    def test_exclusive_across_lock_objects(self):
+        # 別のオブジェクト（別ワーカーと同じく、ファイルを開き直す）とも排他
+        other = FileLock(self.lock.path)
+        with self.lock:
+            self.assertFalse(self.try_from_other_thread(other))
+        self.assertTrue(self.try_from_other_thread(other))
+
+    def test_shared_readers_exclude_writer(self):
+        got = []
+        held, done = threading.Event(), threading.Event()
+
+        def other_reader():
+            reader = FileLock(self.lock.path)
+            got.append(reader.acquire(blocking=False, shared=True))
+            held.set()
+            done.wait(5)
+            reader.release()
+
+        with self.lock.shared():
+            t = threading.Thread(target=other_reader)
+            t.start()
+            held.wait(5)
+            # 共有同士は同時に持てる
+            self.assertEqual(got, [True])
+        # もう1人が共有で持っている間は排他で取れない
+        self.assertFalse(self.try_from_other_thread(FileLock(self.lock.path)))
+        done.set()
+        t.join()
+        self.assertTrue(self.try_from_other_thread(FileLock(self.lock.path)))
+
+    def test_blocking_acquire_waits_for_release(self):
+        order = []
+        self.lock.acquire()
+
+        def waiter():
+            with FileLock(self.lock.path):
+                order.append("waiter")
+
+        t = threading.Thread(target=waiter)
+        t.start()
+        time.sleep(0.1)
+        order.append("holder")
+        self.lock.release()
+        t.join(5)
+        self.assertEqual(order, ["holder", "waiter"])
+
+
+class GroupCommitTest(unittest.TestCase):
+
+    def test_concurrent_submits_lose_nothing(self):
+        flushed = []
+        gate = threading.Lock()
+
+        def flush(items):
+            time.sleep(0.005)  # 書いている間に次の submit を溜める
+            with gate:
+                flushed.append(list(items))
+
+        commit = GroupCommit(flush)
+        threads = [
+            threading.Thread(target=commit.submit, args=([(n, i) for i in range(3)],))
+            for n in range(20)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10)
+        items = [x for batch in flushed for x in batch]
+        self.assertEqual(sorted(items), [(n, i) for n in range(20) for i in range(3)])
+        # submit ごとの並びは崩さない
+        for n in range(20):
+            self.assertEqual([x for x in items if x[0] == n], [(n, 0), (n, 1), (n, 2)])
+        self.assertLess(len(flushed), 20)
+
+    def test_flush_error_is_raised_and_next_submit_still_writes(self):
+        written = []
+
+        def flush(items):
+            if not written:
+                written.append(None)
+                raise OSError("disk full")
+            written.extend(items)
+
+        commit = GroupCommit(flush)
+        with self.assertRaises(OSError):
+            commit.submit([1])
+        commit.submit([2])
+        self.assertEqual(written, [None, 2])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+"""
+gas_outbox の送信キューのテスト（ローカルに立てたスタブの HTTP サーバーに送る）
+
+  python -m pytest -q test_gas_outbox.py   （または python -m unittest test_gas_outbox）
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from gas_outbox import GasOutbox
+
+
+class StubGas:
+    """POST された JSON を溜めておくだけの GAS の代わり。fail_next 回だけ 500 を返す"""
+
+    def __init__(self):
+        self.received = []
+        self.fail_next = 0
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with stub._lock:
+                    failing = stub.fail_next > 0
+                    if failing:
+                        stub.fail_next -= 1
+                    else:
+                        stub.received.append(json.loads(body))
+                self.send_response(500 if failing else 200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(b'{"ok": false}' if failing else b'{"ok": true}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/exec"
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class GasOutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.gas = StubGas()
+        self.outbox = GasOutbox(os.path.join(self.dir, "gas_outbox"), self.gas.url)
+
+    def tearDown(self):
+        self.outbox.stop()
+        self.gas.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def enqueue(self, *payloads):
+        """ワーカーを起こさずにキューに入れる（送るタイミングはテストで決める）"""
+        self.outbox.ensure_worker = lambda: None
+        for p in payloads:
+            self.outbox.enqueue(p)
+
+    # --- まとめて送る（_coalesce） ---
+    def test_coalesce_same_action_and_base(self):
+        self.enqueue(
+            {"action": "add", "base": "神戸", "rows": [[1]], "user": ""},
+            {"action": "add", "base": "神戸", "rows": [[2]], "user": "河野"},
+            {"action": "add", "base": "横浜", "rows": [[3]]},
+            {"action": "ping"},
+            {"action": "add", "base": "神戸", "rows": [[4]]},
+        )
+        self.assertEqual(self.outbox.deliver_pending(), 5)
+        self.assertEqual(self.outbox.depth(), 0)
+        self.assertEqual(self.gas.received, [
+            {"action": "add", "base": "神戸", "rows": [[1], [2], [4]], "user": "河野"},
+            {"action": "add", "base": "横浜", "rows": [[3]]},
+            {"action": "ping"},
+        ])
+
+    def test_coalesce_keeps_chunks_apart_and_limits_batch(self):
+        self.outbox.MAX_BATCH = 2
+        self.enqueue(
+            {"action": "replace_chunk", "base": "神戸", "chunk": "1", "rows": [["a"]]},
+            {"action": "replace_chunk", "base": "神戸", "chunk": "2", "rows": [["b"]]},
+            {"action": "add", "base": "神戸", "rows": [[1]]},
+            {"action": "add", "base": "神戸", "rows": [[2]]},
+            {"action": "add", "base": "神戸", "rows": [[3]]},
+        )
+        batches = self.outbox._coalesce(self.outbox._load(self.outbox._pending_files()))
+        self.assertEqual([len(paths) for paths, _ in batches], [1, 1, 2, 1])
+        self.assertEqual([p.get("chunk") for _, p in batches[:2]], ["1", "2"])
+        self.assertEqual(batches[2][1]["rows"], [[1], [2]])
+
+    def test_replace_chunk_sends_only_the_latest(self):
+        self.enqueue(
+            {"action": "replace_chunk", "base": "神戸", "chunk": "1", "seq": 1, "rows": [["a"], ["b"]]},
+            {"action": "add", "base": "神戸", "rows": [[1]]},
+            {"action": "replace_chunk", "base": "神戸", "chunk": "1", "seq": 2, "rows": [["a2"]]},
+            {"action": "replace_chunk", "base": "神戸", "chunk": "2", "seq": 2, "rows": [["c"]]},
+        )
+        self.assertEqual(self.outbox.deliver_pending(), 4)
+        # 古い置き換えは送らずにファイルだけ消える
+        self.assertEqual(self.outbox.depth(), 0)
+        self.assertEqual(self.gas.received, [
+            {"action": "add", "base": "神戸", "rows": [[1]]},
+            {"action": "replace_chunk", "base": "神戸", "chunk": "1", "seq": 2, "rows": [["a2"]]},
+            {"action": "replace_chunk", "base": "神戸", "chunk": "2", "seq": 2, "rows": [["c"]]},
+        ])
+
+    # --- 失敗したときの送り直し ---
+    def test_failure_keeps_files_and_backs_off(self):
+        self.enqueue({"action": "add", "base": "神戸", "rows": [[1]]})
+        self.gas.fail_next = 3
+
+        delays = []
+        for _ in range(3):
+            before = time.monotonic()
+            self.assertEqual(self.outbox.deliver_pending(), 0)
+            delays.append(self.outbox._next_at - before)
+        self.assertEqual(self.outbox.depth(), 1)
+        self.assertEqual(self.outbox.status()["failures"], 3)
+        # BASE_DELAY, ×2, ×4（±20% ずらす）
+        for n, delay in enumerate(delays):
+            expected = GasOutbox.BASE_DELAY * 2 ** n
+            self.assertGreaterEqual(delay, expected * 0.8 - 0.1)
+            self.assertLessEqual(delay, expected * 1.2 + 0.1)
+
+        # 直ったら送れて、失敗回数・待ち時間は戻る
+        self.assertEqual(self.outbox.deliver_pending(), 1)
+        self.assertEqual(self.outbox.depth(), 0)
+        status = self.outbox.status()
+        self.assertEqual((status["failures"], status["retry_in"], status["sent"]), (0, 0.0, 1))
+        self.assertEqual(self.gas.received, [{"action": "add", "base": "神戸", "rows": [[1]]}])
+
+    def test_backoff_is_capped(self):
+        self.outbox._failures = 20
+        self.outbox._record_failure(RuntimeError("down"))
+        self.assertLessEqual(self.outbox._next_at - time.monotonic(), GasOutbox.MAX_DELAY * 1.2)
+
+    def test_worker_retries_until_sent(self):
+        self.outbox.BASE_DELAY = 0.05
+        self.gas.fail_next = 2
+        self.outbox.enqueue({"action": "add", "base": "神戸", "rows": [[1]]})
+        deadline = time.monotonic() + 10
+        while self.outbox.depth() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(self.outbox.depth(), 0)
+        self.assertEqual(self.gas.received, [{"action": "add", "base": "神戸", "rows": [[1]]}])
+        self.assertEqual(self.outbox.status()["failures"], 0)
+
+    # --- 送るのは同時に1つだけ ---
+    def test_skips_while_another_sender_holds_the_lock(self):
+        self.enqueue({"action": "ping"})
+        held = threading.Event()
+        done = threading.Event()
+
+        def other_sender():
+            with self.outbox.lock:
+                held.set()
+                done.wait(5)
+
+        t = threading.Thread(target=other_sender)
+        t.start()
+        held.wait(5)
+        try:
+            self.assertEqual(self.outbox.deliver_pending(), 0)
+            self.assertEqual(self.outbox.depth(), 1)
+        finally:
+            done.set()
+            t.join()
+        self.assertEqual(self.outbox.deliver_pending(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
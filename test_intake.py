@@ -0,0 +1,45 @@
+"""
+intake（入庫の入力行の検証・正規化）のテスト
+
+  python -m pytest -q test_intake.py   （または python -m unittest test_intake）
+"""
+import unittest
+
+import intake
+
+BASES = ["神戸", "横浜"]
+
+
+def full_values(**kw):
+    values = {
+        "jigan": "K18", "item": "リング", "chuseki": "ダイヤ", "size": "0.3", "hinban": "H-1",
+        "uedai": "10,000", "gedai": "ABC", "input_user": "u", "nyuko_date": "2025-01-02",
+    }
+    values.update(kw)
+    return values
+
+
+class ValidateBatchTest(unittest.TestCase):
+
+    def test_rows_with_only_optional_fields_are_skipped(self):
+        records = [
+            (1, {}),
+            (2, {"wakishi": "メレ"}),
+            (3, {"chain_len": "45cm", "tekiyo": "箱あり"}),
+            (4, {"gedai_numeric": "5000", "branch": "神戸"}),
+            (5, full_values()),
+        ]
+        per_base, errors = intake.validate_batch(records, BASES, default_base="神戸")
+        self.assertEqual(errors, [])
+        self.assertEqual(len(per_base["神戸"]), 1)
+
+    def test_partly_filled_row_is_an_error(self):
+        values = full_values(hinban="", wakishi="メレ")
+        per_base, errors = intake.validate_batch([(1, {"size": "12"}), (2, values)], BASES, "神戸")
+        self.assertEqual(per_base, {})
+        self.assertEqual(len(errors), 2)
+        self.assertIn("品番", errors[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,224 @@
+"""
+logstore（月別パーティションのログ・行位置の索引・メモ）のテスト
+
+  python -m pytest -q test_logstore.py   （または python -m unittest test_logstore）
+"""
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from logstore import IndexedLogFile, MemoStore, PartitionedLogStore
+
+LOG_HEADERS = [
+    "処理", "拠点",
+    "No.", "地金", "アイテム", "中石", "サイズ", "品番",
+    "上代", "下代", "脇石", "チェーン長", "摘要", "入力者",
+    "入庫日", "出庫日", "メモ", "下代（数値）", "ID",
+]
+MEMO = LOG_HEADERS.index("メモ")
+
+
+def month_before(month, n):
+    y, m = map(int, month.split("-"))
+    m -= n
+    while m < 1:
+        y, m = y - 1, m + 12
+    return f"{y:04d}-{m:02d}"
+
+
+def log_row(mode, n, month, memo=""):
+    """month（YYYY-MM）の日付の入庫 / 出庫ログ1行。摘要にはクォート内の改行も入れる"""
+    day = f"{month.replace('-', '/')}/{n % 28 + 1:02d}"
+    in_date, out_date = (day, "") if mode == "入庫" else ("2020/01/01", day)
+    return [mode, "神戸", str(n), "K18", "リング", "ダイヤ", "0.3", f"H-{n}",
+            "10,000", "ABC", "", "", f"摘要 {n}\n2行目" if n % 5 == 0 else f"摘要 {n}", "u",
+            in_date, out_date, memo, "", f"S{n:07d}"]
+
+
+class LogStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.log_dir = os.path.join(self.dir, "log")
+        self.current = PartitionedLogStore.current_month()
+        self.months = [month_before(self.current, 3), month_before(self.current, 1), self.current]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def store(self, legacy_file=None):
+        return PartitionedLogStore(self.log_dir, LOG_HEADERS, legacy_file=legacy_file)
+
+
+class MigrateLegacyTest(LogStoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # 1ファイルのログ（月はばらばらの順で並んでいる）
+        self.rows = []
+        for n in range(1, 61):
+            month = self.months[n % 3]
+            self.rows.append(log_row("出庫" if n % 4 == 0 else "入庫", n, month))
+        self.legacy = os.path.join(self.dir, "log.csv")
+        with open(self.legacy, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows([LOG_HEADERS] + self.rows)
+        # 旧メモ（キーは log.csv の行番号。見出しが 0 行目）
+        with open(os.path.join(self.dir, "log_memo.csv"), "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows([["3", "旧メモ3"], ["30", "旧メモ30"]])
+
+    def expected(self):
+        """月の古い順・月の中は元の順（メモは旧キーから引き継ぐ）"""
+        memos = {3: "旧メモ3", 30: "旧メモ30"}
+        out = []
+        for month in self.months:
+            for i, row in enumerate(self.rows, 1):
+                if self.months[int(row[2]) % 3] == month:
+                    row = list(row)
+                    if i in memos:
+                        row[MEMO] = memos[i]
+                    out.append(row)
+        return out
+
+    def test_partitions_and_order_after_migration(self):
+        store = self.store(self.legacy)
+        self.assertFalse(os.path.exists(self.legacy))
+        self.assertTrue(os.path.exists(self.legacy + ".migrated"))
+        # 先月以前は gzip、今月は索引つきの CSV
+        self.assertEqual(store.partitions(), [(self.months[0], True), (self.months[1], True),
+                                              (self.current, False)])
+
+        expected = self.expected()
+        keys_rows = list(store.iter_rows())
+        self.assertEqual([r for _, r in keys_rows], expected)
+        self.assertTrue(all(k.startswith(m) for (k, _), m in zip(
+            keys_rows, [self.months[int(r[2]) % 3] for r in expected])))
+
+        # 新しい順のページ（月をまたいでも続く）
+        entries, total = store.read_page(limit=1000)
+        self.assertEqual(total, 60)
+        self.assertEqual([r for _, r in entries], expected[::-1])
+        page, _ = store.read_page(offset=15, limit=10)
+        self.assertEqual(page, entries[15:25])
+
+        out_rows = [r for r in expected if r[0] == "出庫"]
+        entries, total = store.read_page(mode="出庫", limit=1000)
+        self.assertEqual(total, len(out_rows))
+        self.assertEqual([r for _, r in entries], out_rows[::-1])
+        self.assertEqual([r for _, r in store.iter_rows(mode="出庫")], out_rows)
+
+    def test_manifest_stats_and_date_filter(self):
+        store = self.store(self.legacy)
+        with open(store.manifest_file, encoding="utf-8") as f:
+            manifest = json.load(f)
+        for month in self.months[:2]:
+            rows = [r for r in self.rows if self.months[int(r[2]) % 3] == month]
+            stats = manifest[month]
+            self.assertEqual(stats["rows"], len(rows))
+            self.assertEqual(stats["modes"].get("出庫", 0), len([r for r in rows if r[0] == "出庫"]))
+            self.assertEqual(stats["min"][:7].replace("/", "-"), month)
+        # 1か月分だけの期間指定
+        first = self.months[1].replace("-", "/")
+        got = [r for _, r in store.iter_rows(date_from=f"{first}/01", date_to=f"{first}/31")]
+        self.assertEqual(got, [r for r in self.expected() if self.months[int(r[2]) % 3] == self.months[1]])
+
+    def test_second_worker_does_not_migrate_again(self):
+        self.store(self.legacy)
+        before = list(self.store(self.legacy).iter_rows())
+        self.assertEqual(len(before), 60)
+
+
+class MemoTest(LogStoreTestCase):
+
+    def test_memo_updates_survive_month_compression(self):
+        store = self.store()
+        last_month = self.months[1]
+        rows = [log_row("出庫", n, last_month) for n in range(1, 11)]
+        # 先月分を追記中のまま置いておく（月が替わる前に書いた状態）
+        store._file(last_month).append(rows)
+        keys = [k for k, _ in store.iter_rows()]
+        changed = store.update_memos({keys[2]: "箱あり", keys[7]: "修理中"})
+        self.assertEqual(set(changed), {keys[2], keys[7]})
+        # 同じ値はもう一度書かない
+        self.assertEqual(store.update_memos({keys[2]: "箱あり"}), {})
+
+        store.close_old_months()
+        self.assertEqual(store.partitions(), [(last_month, True)])
+        got = dict(store.iter_rows())
+        self.assertEqual(list(got), keys)
+        self.assertEqual(got[keys[2]][MEMO], "箱あり")
+        self.assertEqual(got[keys[7]][MEMO], "修理中")
+        self.assertEqual(got[keys[7]][2], "8")
+        # 締めた月のメモも書き換えられる
+        store.update_memos({keys[7]: "返却済み"})
+        entries, _ = store.read_page(limit=3)
+        self.assertEqual([(k, r[MEMO]) for k, r in entries], [(keys[9], ""), (keys[8], ""), (keys[7], "返却済み")])
+
+    def test_memo_store_compaction_keeps_latest(self):
+        memos = MemoStore(os.path.join(self.dir, "memo.csv"))
+        memos.COMPACT_MIN_LINES = 5
+        for i in range(10):
+            memos.set_many({"2025-01:1": f"v{i}", "2025-01:2": "固定"})
+        self.assertEqual(MemoStore(memos.path).get_all(), {"2025-01:1": "v9", "2025-01:2": "固定"})
+        with open(memos.path, encoding="utf-8") as f:
+            self.assertLess(len(f.readlines()), 20)
+
+
+class IndexOffsetTest(LogStoreTestCase):
+
+    def test_offsets_point_at_rows_after_appends(self):
+        path = os.path.join(self.dir, "current.csv")
+        log = IndexedLogFile(path, LOG_HEADERS)
+        written = []
+        for n in range(1, 40, 7):
+            batch = [log_row("入庫" if i % 2 else "出庫", i, self.current) for i in range(n, n + 7)]
+            log.append(batch)
+            written.extend(batch)
+        # 索引の外から追記された分（ジャーナルからの追記と同じ）は次の sync で拾う
+        extra = [log_row("出庫", 100, self.current), log_row("入庫", 101, self.current)]
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(extra)
+        written.extend(extra)
+        log.sync()
+
+        self.assertEqual(log.row_count(), len(written))
+        numbers = [0, 5, len(written) - 1, 10, 3]
+        self.assertEqual(log.read_numbers(numbers), [(n, written[n]) for n in numbers])
+        self.assertEqual(log.count("出庫"), len([r for r in written if r[0] == "出庫"]))
+        self.assertEqual([r for _, r in log.read_page("入庫", 0, 3)],
+                         [r for r in written if r[0] == "入庫"][::-1][:3])
+
+        # 索引ファイルから読み直しても同じ位置を指す（別ワーカー）
+        other = IndexedLogFile(path, LOG_HEADERS)
+        other.sync()
+        self.assertEqual(other.read_numbers(numbers), log.read_numbers(numbers))
+
+    def test_index_rebuilt_when_log_is_rewritten_shorter(self):
+        path = os.path.join(self.dir, "current.csv")
+        log = IndexedLogFile(path, LOG_HEADERS)
+        rows = [log_row("入庫", n, self.current) for n in range(1, 6)]
+        log.append(rows)
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            csv.writer(f).writerows(rows[:2])
+        log.sync()
+        self.assertEqual(log.row_count(), 2)
+        self.assertEqual(log.read_numbers([1]), [(1, rows[1])])
+
+    def test_reader_without_index_write_sees_new_rows(self):
+        store = self.store()
+        store.import_rows([log_row("入庫", 1, self.current)])
+        reader = self.store()
+        reader.read_page(limit=1)
+        store.import_rows([log_row("入庫", 2, self.current)])
+        # 読む側は索引ファイルを書かずにメモリ上で追いつく
+        entries, total = reader.read_page(limit=5)
+        self.assertEqual((total, [r[2] for _, r in entries]), (2, ["2", "1"]))
+        store.import_rows([log_row("入庫", 3, self.current)])
+        entries, total = reader.read_page(limit=5)
+        self.assertEqual((total, [r[2] for _, r in entries]), (3, ["3", "2", "1"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
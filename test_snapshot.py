@@ -0,0 +1,141 @@
+"""
+snapshot（拠点ごとの列形式スナップショットを mmap して読む）のテスト
+
+  python -m pytest -q test_snapshot.py   （または python -m unittest test_snapshot）
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from snapshot import InventorySnapshot
+
+HEADERS = ["No.", "地金", "品番", "摘要", "ID"]
+ID_COL = HEADERS.index("ID")
+
+
+def make_rows(n, note="", start=1):
+    # 地金は種類が少ない（dict 列）、品番・ID は行ごとに違う（text 列）
+    return [
+        [str(i), ["K18", "Pt900", "Pt850"][i % 3], f"品番-{i:04d}", note if i % 2 else "", f"S{i:07d}"]
+        for i in range(start, start + n)
+    ]
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "snapshot")
+        self.snap = InventorySnapshot(self.path, HEADERS, ID_COL)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class RoundTripTest(SnapshotTestCase):
+
+    def test_rows_and_id_lookup_round_trip(self):
+        rows = make_rows(50, note="メモ，全角")
+        # 並びは ID 順でなくてもよい
+        rows.reverse()
+        self.snap.publish({"神戸": ((1, 100), rows)})
+        view = self.snap.base("神戸", (1, 100))
+
+        self.assertEqual(len(view), 50)
+        self.assertEqual([list(r) for r in view], rows)
+        self.assertEqual(list(view[-1]), rows[-1])
+        self.assertEqual([list(r) for r in view[10:13]], rows[10:13])
+        for i, row in enumerate(rows):
+            self.assertEqual(view.get(row[ID_COL]), i)
+            self.assertEqual(view[i][ID_COL], row[ID_COL])
+        self.assertIsNone(view.get("S9999999"))
+        self.assertIsNone(view.get(""))
+        self.assertEqual(view.get("S0000000", -1), -1)
+        self.assertEqual(view.distinct(1), {"K18", "Pt900", "Pt850"})
+
+    def test_short_rows_and_none_are_padded(self):
+        self.snap.publish({"神戸": (1, [["1", "K18"], ["2", None, "X", "", "S0000002"]])})
+        view = self.snap.base("神戸", 1)
+        self.assertEqual([list(r) for r in view],
+                         [["1", "K18", "", "", ""], ["2", "", "X", "", "S0000002"]])
+
+    def test_empty_base(self):
+        self.snap.publish({"神戸": (1, [])})
+        view = self.snap.base("神戸", 1)
+        self.assertEqual((len(view), list(view), view.get("S0000001")), (0, [], None))
+
+    def test_other_process_reads_the_file(self):
+        rows = make_rows(5)
+        self.snap.publish({"神戸": (7, rows)})
+        # 別ワーカー（新しく作ったオブジェクト）はファイルから読む
+        other = InventorySnapshot(self.path, HEADERS, ID_COL)
+        self.assertEqual([list(r) for r in other.base("神戸", 7)], rows)
+        self.assertEqual(other.status()["bases"], {"神戸": 5})
+
+
+class StaleSnapshotTest(SnapshotTestCase):
+
+    def test_other_version_is_rejected(self):
+        self.snap.publish({"神戸": ((1, 10), make_rows(3))})
+        self.assertIsNotNone(self.snap.base("神戸", (1, 10)))
+        # 在庫が書き換わった（バージョンが違う）→ 使わない
+        self.assertIsNone(self.snap.base("神戸", (2, 10)))
+        self.assertIsNone(self.snap.base("横浜", (1, 10)))
+
+    def test_publish_skips_when_inventory_already_changed(self):
+        self.snap.publish({"神戸": (1, make_rows(3))})
+        self.snap.publish({"神戸": (2, make_rows(4))}, is_current=lambda base, version: False)
+        self.assertIsNone(self.snap.base("神戸", 2))
+        self.assertEqual(len(self.snap.base("神戸", 1)), 3)
+
+    def test_headers_mismatch_is_rejected(self):
+        self.snap.publish({"神戸": (1, make_rows(3))})
+        other = InventorySnapshot(self.path, HEADERS + ["追加列"], ID_COL)
+        self.assertIsNone(other.base("神戸", 1))
+
+    def test_broken_file_is_rejected(self):
+        os.makedirs(self.path)
+        with open(self.snap.file_path("神戸"), "wb") as f:
+            f.write(b"ISNP\x03")
+        self.assertIsNone(self.snap.base("神戸", 1))
+
+
+class RepublishTest(SnapshotTestCase):
+
+    def test_reader_keeps_old_mapping_while_new_snapshot_is_published(self):
+        old_rows = make_rows(20, note="old")
+        self.snap.publish({"神戸": (1, old_rows)})
+        old_view = self.snap.base("神戸", 1)
+        first = old_view[0]
+
+        new_rows = make_rows(30, note="new", start=100)
+        self.snap.publish({"神戸": (2, new_rows)})
+
+        # 置き換わる前に取った view・行は元の中身のまま読める
+        self.assertEqual([list(r) for r in old_view], old_rows)
+        self.assertEqual(list(first), old_rows[0])
+        self.assertEqual(old_view.get("S0000005"), 4)
+        # 新しいバージョンは新しいファイルから
+        self.assertIsNone(self.snap.base("神戸", 1))
+        self.assertEqual([list(r) for r in self.snap.base("神戸", 2)], new_rows)
+
+    def test_publish_later_writes_in_background(self):
+        done = threading.Event()
+        published = []
+
+        def on_published(base, version):
+            published.append((base, version))
+            done.set()
+
+        snap = InventorySnapshot(self.path, HEADERS, ID_COL,
+                                 is_current=lambda base, version: True, on_published=on_published)
+        snap.publish_later("神戸", 3, make_rows(4))
+        self.assertTrue(done.wait(5))
+        self.assertEqual(published, [("神戸", 3)])
+        self.assertEqual(len(snap.base("神戸", 3)), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
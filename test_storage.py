@@ -0,0 +1,213 @@
+"""
+storage のテスト（一時ディレクトリの data/ に CSV 保存を作って試す）
+
+  python -m pytest -q test_storage.py   （または python -m unittest test_storage）
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import storage
+
+HEADERS = [
+    "No.", "出庫", "地金", "アイテム", "中石", "サイズ", "品番",
+    "上代", "下代", "脇石", "チェーン長", "摘要", "入力者", "入庫日", "下代（数値）", "ID",
+]
+LOG_HEADERS = [
+    "処理", "拠点",
+    "No.", "地金", "アイテム", "中石", "サイズ", "品番",
+    "上代", "下代", "脇石", "チェーン長", "摘要", "入力者",
+    "入庫日", "出庫日", "メモ", "下代（数値）", "ID",
+]
+
+
+def stock_row(item_id, hinban="X-1"):
+    return ["", "", "K18", "リング", "ダイヤ", "0.3", hinban,
+            "10,000", "ABC", "", "", "", "u", "2025/01/02", "", item_id]
+
+
+def log_row(mode, base, row, out_date=""):
+    """在庫行 → ログ行（LOG_HEADERS の並び）"""
+    return [mode, base] + row[0:1] + row[2:14] + [out_date, "", row[14], row[15]]
+
+
+class StorageTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.dir, "data")
+        self.csv = storage.CsvStorage(self.data_dir, HEADERS, LOG_HEADERS)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def intake(self, base, count):
+        """count 点を入庫する（ID を払い出して在庫とログに書く）"""
+        rows = [stock_row(i) for i in self.csv.allocate_item_ids(count)]
+        self.csv.save_inventory(base, [list(r) for r in self.csv.load_inventory(base)] + rows)
+        self.csv.append_log([log_row("入庫", base, r) for r in rows])
+        return [r[-1] for r in rows]
+
+    def checkout(self, base, item_id):
+        rows = self.csv.load_inventory(base)
+        removed = [r for r in rows if r[-1] == item_id]
+        kept = [r for r in rows if r[-1] != item_id]
+        self.csv.commit_checkout(base, kept, removed,
+                                 [log_row("出庫", base, r, "2025/01/03") for r in removed])
+        return removed
+
+
+class CheckoutJournalTest(StorageTestCase):
+    """出庫（在庫の書き換え＋ログの追記）が途中で止まったときのジャーナルからのやり直し"""
+
+    def setUp(self):
+        super().setUp()
+        self.ids = self.intake("神戸", 3)
+        self.log_before = self.csv.load_log()
+
+    def assert_checked_out(self, item_id):
+        """在庫から消えていて、出庫ログがちょうど1行ある"""
+        self.assertNotIn(item_id, [r[-1] for r in self.csv.load_inventory("神戸")])
+        log = [row for _, row in self.csv.load_log()]
+        self.assertEqual(len([r for r in log if r[0] == "出庫" and r[-1] == item_id]), 1)
+        self.assertEqual(len(log), len(self.log_before) + 1)
+        self.assertFalse(os.path.exists(self.csv.journal_file))
+        self.assertFalse(os.path.exists(self.csv.inventory_path("神戸") + ".tmp"))
+
+    def test_crash_after_journal_is_written(self):
+        # ジャーナルを書いたところで落ちる（ログも在庫もまだ）
+        with mock.patch.object(storage.CsvStorage, "_apply_journal", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.checkout("神戸", self.ids[1])
+        self.assertTrue(os.path.exists(self.csv.journal_file))
+        with open(self.csv.inventory_path("神戸"), encoding="utf-8") as f:
+            self.assertIn(self.ids[1], f.read())  # 在庫ファイルはまだ出庫前
+
+        # 次の起動（recover）で最後までやり直す
+        restarted = storage.CsvStorage(self.data_dir, HEADERS, LOG_HEADERS)
+        self.csv = restarted
+        self.assert_checked_out(self.ids[1])
+
+    def test_crash_after_log_append_is_replayed_once(self):
+        # ログは追記したが、在庫を置き換える前に落ちる
+        real_replace = os.replace
+
+        def crash_on_inventory(src, dst):
+            if dst == self.csv.inventory_path("神戸"):
+                raise KeyboardInterrupt
+            return real_replace(src, dst)
+
+        with mock.patch("os.replace", side_effect=crash_on_inventory):
+            with self.assertRaises(KeyboardInterrupt):
+                self.checkout("神戸", self.ids[0])
+        self.csv.recover()
+        self.assert_checked_out(self.ids[0])
+
+    def test_crash_before_journal_is_removed_is_replayed_once(self):
+        # 在庫もログも書き終えて、ジャーナルを消す前に落ちる → やり直してもログは二重にならない
+        real_remove = os.remove
+
+        def crash_on_journal(path):
+            if path == self.csv.journal_file:
+                raise KeyboardInterrupt
+            return real_remove(path)
+
+        with mock.patch("os.remove", side_effect=crash_on_journal):
+            with self.assertRaises(KeyboardInterrupt):
+                self.checkout("神戸", self.ids[2])
+        self.csv.recover()
+        self.csv.recover()
+        self.assert_checked_out(self.ids[2])
+
+    def test_live_worker_replays_leftover_journal_first(self):
+        # 落ちたワーカーのジャーナルが残ったまま、別のワーカーが出庫する
+        with mock.patch.object(storage.CsvStorage, "_apply_journal", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.checkout("神戸", self.ids[0])
+        self.checkout("神戸", self.ids[1])
+
+        inventory = [r[-1] for r in self.csv.load_inventory("神戸")]
+        self.assertEqual(inventory, [self.ids[2]])
+        out = [row[-1] for _, row in self.csv.load_log() if row[0] == "出庫"]
+        self.assertEqual(out, self.ids[:2])
+        self.assertFalse(os.path.exists(self.csv.journal_file))
+
+    def test_truncated_journal_is_discarded(self):
+        # ジャーナル自体を書いている途中で落ちた＝何も反映していない
+        with open(self.csv.journal_file, "w", encoding="utf-8") as f:
+            f.write('{"log": "')
+        self.csv.recover()
+        self.assertFalse(os.path.exists(self.csv.journal_file))
+        self.assertEqual(self.csv.load_log(), self.log_before)
+
+
+class LogGroupCommitTest(StorageTestCase):
+
+    def test_concurrent_appends_lose_no_rows(self):
+        row = stock_row("S0000001")
+        errors = []
+
+        def writer(n):
+            try:
+                for i in range(10):
+                    self.csv.append_log([log_row("入庫", f"拠点{n}", row[:12] + [str(i)] + row[13:])])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(30)
+        self.assertEqual(errors, [])
+
+        log = [row for _, row in self.csv.load_log()]
+        self.assertEqual(len(log), 80)
+        for n in range(8):
+            # 拠点ごとの追記順も崩れない
+            self.assertEqual([r[13] for r in log if r[1] == f"拠点{n}"], [str(i) for i in range(10)])
+        # 索引からも全部読める
+        entries, total = self.csv.log.read_page(limit=100)
+        self.assertEqual(total, 80)
+        self.assertEqual([r for _, r in reversed(entries)], log)
+
+
+class MigrateToSqliteTest(StorageTestCase):
+
+    def migrate(self):
+        dst = storage.SqliteStorage(os.path.join(self.dir, "inventory.db"))
+        storage.migrate_csv_to_sqlite(self.csv, dst, ["神戸", "横浜"])
+        return dst
+
+    def test_ids_checked_out_before_migration_are_not_reused(self):
+        ids = self.intake("神戸", 3) + self.intake("横浜", 1)
+        # 一番大きい番号を出庫する（在庫には残らない）
+        self.checkout("横浜", ids[-1])
+        dst = self.migrate()
+
+        new_ids = dst.allocate_item_ids(2)
+        self.assertEqual(new_ids, ["S0000005", "S0000006"])
+        self.assertFalse(set(new_ids) & set(ids))
+
+    def test_seq_comes_from_the_log_without_item_seq_file(self):
+        ids = self.intake("神戸", 2)
+        self.checkout("神戸", ids[-1])
+        os.remove(self.csv.item_seq_file)
+        dst = self.migrate()
+
+        self.assertEqual(dst.allocate_item_ids(1), ["S0000003"])
+
+    def test_seq_comes_from_item_seq_file(self):
+        self.intake("神戸", 1)
+        # 払い出したが保存されなかった ID（入庫の途中で止まったなど）も使わない
+        self.csv.allocate_item_ids(5)
+        dst = self.migrate()
+
+        self.assertEqual(dst.allocate_item_ids(1), ["S0000007"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+"""
+XLSX の最初のシートを1行ずつ読む（外部パッケージなし）
+
+シートの XML を iterparse で読み、読んだ行はすぐ捨てるので、行数が多くてもメモリは一定。
+（共有文字列表だけは先に読み込む）
+セルの値はすべて文字列で返す。数値は "1.0" → "1" のように整数なら小数点を付けない。
+日付セルは Excel のシリアル値（数値）のまま返るので、必要なら excel_serial_to_date() で変換する。
+"""
+import datetime
+import posixpath
+import re
+import zipfile
+from xml.etree import ElementTree as ET
+
+
+_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_CELL_REF_RE = re.compile(r"([A-Z]+)")
+
+
+def _col_index(ref):
+    """"C12" → 2"""
+    m = _CELL_REF_RE.match(ref or "")
+    if not m:
+        return None
+    n = 0
+    for ch in m.group(1):
+        n = n * 26 + (ord(ch) - 64)
+    return n - 1
+
+
+def _text(el):
+    """<si> / <is> の中の <t> をつなげる（ふりがな <rPh> は除く）"""
+    parts = []
+    for child in el:
+        if child.tag == _NS + "t":
+            parts.append(child.text or "")
+        elif child.tag == _NS + "r":
+            t = child.find(_NS + "t")
+            if t is not None:
+                parts.append(t.text or "")
+    return "".join(parts)
+
+
+def _shared_strings(z):
+    try:
+        f = z.open("xl/sharedStrings.xml")
+    except KeyError:
+        return []
+    strings = []
+    with f:
+        for _, el in ET.iterparse(f):
+            if el.tag == _NS + "si":
+                strings.append(_text(el))
+                el.clear()
+    return strings
+
+
+def _first_sheet_path(z):
+    """workbook.xml の最初のシートのファイル名"""
+    try:
+        wb = ET.fromstring(z.read("xl/workbook.xml"))
+        rels = ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+        first = wb.find(f"{_NS}sheets/{_NS}sheet")
+        rid = first.get(_REL_NS + "id")
+        for rel in rels.iter(_PKG_REL_NS + "Relationship"):
+            if rel.get("Id") == rid:
+                target = rel.get("Target")
+                if target.startswith("/"):
+                    return target.lstrip("/")
+                return posixpath.normpath(posixpath.join("xl", target))
+    except (KeyError, AttributeError, ET.ParseError):
+        pass
+    return "xl/worksheets/sheet1.xml"
+
+
+def _number(v):
+    try:
+        f = float(v)
+    except ValueError:
+        return v
+    return str(int(f)) if f.is_integer() else v
+
+
+def iter_rows(fileobj):
+    """
+    最初のシートの行を [文字列, ...] で返す（空行も [] で返す）
+    XLSX として読めなければ ValueError
+    """
+    try:
+        yield from _iter_rows(fileobj)
+    except (zipfile.BadZipFile, KeyError, ET.ParseError) as e:
+        raise ValueError(f"XLSX を読み込めません: {e}") from e
+
+
+def _iter_rows(fileobj):
+    with zipfile.ZipFile(fileobj) as z:
+        shared = _shared_strings(z)
+        with z.open(_first_sheet_path(z)) as f:
+            for _, el in ET.iterparse(f):
+                if el.tag != _NS + "row":
+                    continue
+                row = []
+                for c in el.iter(_NS + "c"):
+                    i = _col_index(c.get("r"))
+                    if i is None:
+                        i = len(row)
+                    t = c.get("t")
+                    v = c.find(_NS + "v")
+                    if t == "inlineStr":
+                        is_ = c.find(_NS + "is")
+                        value = _text(is_) if is_ is not None else ""
+                    elif v is None or v.text is None:
+                        value = ""
+                    elif t == "s":
+                        value = shared[int(v.text)]
+                    elif t == "b":
+                        value = "TRUE" if v.text == "1" else "FALSE"
+                    elif t in ("str", "e"):
+                        value = v.text
+                    else:
+                        value = _number(v.text)
+                    if i >= len(row):
+                        row.extend([""] * (i + 1 - len(row)))
+                    row[i] = value
+                yield row
+                el.clear()
+
+
+def excel_serial_to_date(value):
+    """Excel の日付シリアル値（"45678" など）→ date。数値でなければ None"""
+    try:
+        n = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not 1 <= n < 2958466:
+        return None
+    return datetime.date(1899, 12, 30) + datetime.timedelta(days=int(n))
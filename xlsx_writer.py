@@ -0,0 +1,174 @@
+"""
+XLSX を1行ずつ書き出すライブラリ（外部パッケージなし）
+
+XLSX は XML を zip にまとめたもの。シートの XML を1行ずつ zip に流し込み、
+圧縮済みのバイト列をその都度 yield するので、何万行でもメモリは一定。
+文字列はセルに直接書く（inlineStr）ので、共有文字列表を溜める必要もない。
+
+使い方:
+    sheets = [("在庫", ["品番", "上代"], rows), ("集計", header2, rows2)]
+    Response(iter_xlsx(sheets), mimetype=XLSX_MIMETYPE)
+
+rows の要素は値のリスト。int / float は数値セル、それ以外は文字列セルになる。
+"""
+import re
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# この行数ごとに、たまった圧縮データを送り出す
+FLUSH_ROWS = 500
+
+_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+
+# XML に書けない制御文字（タブ・改行以外）
+_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+# シート名に使えない文字
+_BAD_SHEET_CHARS = re.compile(r"[\[\]:*?/\\]")
+
+
+class _Sink:
+    """zip の書き込み先。書かれたバイト列を take() まで溜めておくだけ（seek できない）"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _sheet_name(name, used):
+    name = _BAD_SHEET_CHARS.sub("_", str(name))[:31] or "Sheet"
+    base, n = name, 2
+    while name in used:
+        suffix = f"({n})"
+        name = base[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(name)
+    return name
+
+
+def _cell(value, style):
+    s = f' s="{style}"' if style else ""
+    if isinstance(value, bool):
+        value = str(value)
+    if isinstance(value, (int, float)):
+        return f"<c{s}><v>{value}</v></c>"
+    text = "" if value is None else _ILLEGAL.sub("", str(value))
+    if not text:
+        return f"<c{s}/>" if s else "<c/>"
+    return f'<c{s} t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def _row(values, style=0):
+    return ("<row>" + "".join(_cell(v, style) for v in values) + "</row>").encode("utf-8")
+
+
+def _static_parts(names):
+    sheets = "".join(
+        f'<sheet name={quoteattr(n)} sheetId="{i}" r:id="rId{i}"/>'
+        for i, n in enumerate(names, 1)
+    )
+    sheet_rels = "".join(
+        f'<Relationship Id="rId{i}" '
+        f'Type="{_REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(names) + 1)
+    )
+    sheet_types = "".join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(names) + 1)
+    )
+    n = len(names) + 1
+    head = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    return {
+        "[Content_Types].xml": head +
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            + sheet_types + "</Types>",
+        "_rels/.rels": head +
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+            "</Relationships>",
+        "xl/workbook.xml": head +
+            f'<workbook xmlns="{_NS}" xmlns:r="{_REL_NS}"><sheets>{sheets}</sheets></workbook>',
+        "xl/_rels/workbook.xml.rels": head +
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + sheet_rels +
+            f'<Relationship Id="rId{n}" Type="{_REL_NS}/styles" Target="styles.xml"/>'
+            "</Relationships>",
+        # スタイル 0 = 標準、1 = 見出し（太字＋薄い網掛け）
+        "xl/styles.xml": head +
+            f'<styleSheet xmlns="{_NS}">'
+            '<fonts count="2"><font><sz val="11"/><name val="Yu Gothic"/></font>'
+            '<font><b/><sz val="11"/><name val="Yu Gothic"/></font></fonts>'
+            '<fills count="3"><fill><patternFill patternType="none"/></fill>'
+            '<fill><patternFill patternType="gray125"/></fill>'
+            '<fill><patternFill patternType="solid"><fgColor rgb="FFF0F0F0"/></patternFill></fill></fills>'
+            '<borders count="1"><border/></borders>'
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+            '<xf numFmtId="0" fontId="1" fillId="2" borderId="0" xfId="0" applyFont="1" applyFill="1"/>'
+            "</cellXfs>"
+            '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+            "</styleSheet>",
+    }
+
+
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<worksheet xmlns="{_NS}">'
+    # 見出し行を固定
+    '<sheetViews><sheetView workbookViewId="0">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    "</sheetView></sheetViews>"
+    "<sheetData>"
+).encode("utf-8")
+_SHEET_TAIL = b"</sheetData></worksheet>"
+
+
+def iter_xlsx(sheets):
+    """
+    sheets: [(シート名, 見出しのリスト, 行の iterable)]
+    XLSX のバイト列を少しずつ yield する。行の iterable は書き出す順に1回だけ読む
+    """
+    sheets = list(sheets)
+    used = set()
+    names = [_sheet_name(name, used) for name, _, _ in sheets]
+
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+        for path, xml in _static_parts(names).items():
+            zf.writestr(path, xml)
+        yield sink.take()
+
+        for i, (_, header, rows) in enumerate(sheets, 1):
+            with zf.open(f"xl/worksheets/sheet{i}.xml", "w") as f:
+                f.write(_SHEET_HEAD)
+                f.write(_row(header, style=1))
+                for n, row in enumerate(rows, 1):
+                    f.write(_row(row))
+                    if n % FLUSH_ROWS == 0:
+                        data = sink.take()
+                        if data:
+                            yield data
+                f.write(_SHEET_TAIL)
+            yield sink.take()
+    yield sink.take()